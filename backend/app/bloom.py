@@ -0,0 +1,36 @@
+"""
+进程内 Bloom 过滤器 - 记录已经入库的行指纹（row_hash），重复导入时减少无效的数据库往返
+判断为“不存在”时一定不存在；判断为“可能存在”时仍需到数据库确认
+"""
+import math
+import threading
+from typing import Iterable
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(1, capacity)
+        bits = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.num_bits = max(8, bits)
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, key: int) -> Iterable[int]:
+        # key 本身已是 64 位哈希，拆成两半做双重哈希
+        key &= 0xFFFFFFFFFFFFFFFF
+        h1 = key & 0xFFFFFFFF
+        h2 = (key >> 32) | 1
+        m = self.num_bits
+        return ((h1 + i * h2) % m for i in range(self.num_hashes))
+
+    def add_many(self, keys: Iterable[int]):
+        with self._lock:
+            bits = self._bits
+            for key in keys:
+                for pos in self._positions(key):
+                    bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: int) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
@@ -0,0 +1,72 @@
+"""
+导入进度持久化 - import_checkpoints 表
+位置记录与对应批次的数据在同一事务中提交：崩溃时最多丢失一个未提交的批次，不会重复也不会遗漏
+"""
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from backend.app.database import engine
+from backend.app.models import ImportCheckpoint
+
+
+_table_ready = False
+
+
+def ensure_checkpoint_table():
+    """确保 import_checkpoints 表存在（独立运行导入脚本时应用可能还没有建表）"""
+    global _table_ready
+    if _table_ready:
+        return
+    ImportCheckpoint.__table__.create(bind=engine, checkfirst=True)
+    _table_ready = True
+
+
+def load_checkpoints(db: Session) -> Dict[str, dict]:
+    """读取全部位置记录：file_key -> 状态字典（offset/inode/size/mtime_ns/head_len/head）"""
+    ensure_checkpoint_table()
+    rows = db.execute(select(ImportCheckpoint)).scalars().all()
+    return {
+        r.file_key: {
+            "offset": r.byte_offset,
+            "inode": r.inode,
+            "size": r.size,
+            "mtime_ns": r.mtime_ns,
+            "head_len": r.head_len,
+            "head": r.head,
+        }
+        for r in rows
+    }
+
+
+def save_checkpoint(db: Session, file_key: str, state: dict):
+    """写入（或覆盖）一个文件的位置记录；不提交，由调用方与数据一起提交"""
+    ensure_checkpoint_table()
+    values = {
+        "byte_offset": state["offset"],
+        "inode": state.get("inode"),
+        "size": state.get("size"),
+        "mtime_ns": state.get("mtime_ns"),
+        "head_len": state.get("head_len"),
+        "head": state.get("head"),
+    }
+    stmt = pg_insert(ImportCheckpoint).values(file_key=file_key, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ImportCheckpoint.file_key],
+        set_={**values, "updated_at": func.now()},
+    )
+    db.execute(stmt)
+
+
+def delete_checkpoints(db: Session, file_keys: Optional[Iterable[str]] = None):
+    """删除指定文件（None 表示全部）的位置记录；不提交"""
+    ensure_checkpoint_table()
+    stmt = delete(ImportCheckpoint)
+    if file_keys is not None:
+        keys = list(file_keys)
+        if not keys:
+            return
+        stmt = stmt.where(ImportCheckpoint.file_key.in_(keys))
+    db.execute(stmt)
@@ -0,0 +1,544 @@
+"""
+列式内存引擎 - 把 match_records 以 NumPy 数组常驻内存，胜率/时长统计不再访问 PostgreSQL
+STATS_ENGINE=columnar 时启用（需要 numpy），数据有两种来源：
+- 进程内快照（默认）：启动后在后台线程全量加载一次，本进程的导入批次提交后把实际插入的行追加到数组末尾；
+- 共享快照文件（设置 COLUMNAR_SNAPSHOT_DIR，见 columnar_store.py）：导入批次写成只读段文件，
+  各 uvicorn worker 以 mmap 方式读取，共享操作系统页缓存，重启后无需重新加载。
+数据版本号（import_generation）对不上时（其他进程导入、卸载分区等）重新加载/重建，期间查询回退到 SQL。
+过滤条件与 crud._apply_common_filters 等价（向量化掩码），分组聚合使用 bincount / lexsort，
+结果与 SQL 路径一致（可用 scripts/verify_columnar.py 核对）
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from backend.app import columnar_store, rollups
+from backend.app.database import offload
+from backend.app.models import MatchRecord
+from backend.app.schemas import get_server_group
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# 导入时 RETURNING 的列在 rollups.SOURCE_COLUMNS 之后追加这些列，全量加载时按同样的顺序读取
+EXTRA_COLUMNS = (
+    "server_group",
+    "spirit_animal",
+    "spirit_animal_talents",
+    "legendary_runes",
+    "super_armor",
+    "score_ratio",
+)
+ROW_COLUMNS = rollups.SOURCE_COLUMNS + EXTRA_COLUMNS
+
+# 每行一个值的定长列；st_a / st_b 为展开后的胜率类型与时长类型（NO_TYPE 表示不计入）
+SCALAR_COLUMNS = (
+    "server", "server_group", "timestamp", "level", "clazz", "schools",
+    "opponent_class", "opponent_schools", "is_win", "duration",
+    "st_a", "st_b", "super_armor", "super_armor_null", "score_ratio",
+)
+# 变长列表列：offsets（行数 + 1 个，第 i 行的值为 values[offsets[i]:offsets[i+1]]）与对应的值数组；
+# talents 与 pets 按位置一一对应（缺少天赋按 0，与 match_pet_talent_v 一致），列表中的 NULL 不存储
+LIST_COLUMNS = {
+    "pet_offsets": ("pets", "talents"),
+    "rune_offsets": ("runes",),
+}
+
+_INT_LADDER = ("int8", "int16", "int32", "int64")
+# 不计入的 st_a / st_b；不能用 0：拆分存储的旧数据中 source_type 可能就是 0，SQL 路径照常计入
+NO_TYPE = -1
+_LOAD_BATCH = 50000
+
+
+def enabled() -> bool:
+    return os.environ.get("STATS_ENGINE", "sql").strip().lower() == "columnar" and np is not None
+
+
+def smallest_dtype(values, floor: str = "int8"):
+    """能容纳 values 全部取值的最小整数类型（不小于 floor）"""
+    if len(values) == 0:
+        return np.dtype(floor)
+    lo, hi = int(values.min()), int(values.max())
+    for name in _INT_LADDER[_INT_LADDER.index(floor):]:
+        info = np.iinfo(name)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(name)
+    return np.dtype("int64")
+
+
+def arrays_from_rows(rows: Sequence[Sequence]) -> Dict[str, "np.ndarray"]:
+    """把按 ROW_COLUMNS 排列的行转换为列数组（int64，列表列为 offsets + values）"""
+    get = dict(zip(ROW_COLUMNS, zip(*rows))) if rows else {c: () for c in ROW_COLUMNS}
+    st_a, st_b = [], []
+    for source_type, league, win_valid, duration_valid in zip(
+            get["source_type"], get["league"], get["win_valid"], get["duration_valid"]):
+        # 与 crud._source_type_expansion 相同：一行最多计入一个胜率类型与一个时长类型
+        if league is None:
+            st_a.append(source_type)
+            st_b.append(NO_TYPE)
+        else:
+            st_a.append(league if (win_valid or not duration_valid) else NO_TYPE)
+            st_b.append(league + 3 if duration_valid else NO_TYPE)
+    pet_offsets, pets, talents = [0], [], []
+    for pet_list, talent_list in zip(get["spirit_animal"], get["spirit_animal_talents"]):
+        talent_list = talent_list or []
+        for i, pet_id in enumerate(pet_list or []):
+            if pet_id is None:
+                continue
+            pets.append(pet_id)
+            talents.append(talent_list[i] if i < len(talent_list) and talent_list[i] is not None else 0)
+        pet_offsets.append(len(pets))
+    rune_offsets, runes = [0], []
+    for rune_list in get["legendary_runes"]:
+        runes.extend(r for r in (rune_list or []) if r is not None)
+        rune_offsets.append(len(runes))
+
+    def arr(values):
+        return np.asarray(values, dtype=np.int64)
+
+    return {
+        "server": arr(get["server"]),
+        "server_group": arr([g if g is not None else get_server_group(s)
+                             for g, s in zip(get["server_group"], get["server"])]),
+        "timestamp": arr(get["timestamp"]),
+        "level": arr(get["level"]),
+        "clazz": arr(get["clazz"]),
+        "schools": arr(get["schools"]),
+        "opponent_class": arr(get["opponent_class"]),
+        "opponent_schools": arr(get["opponent_schools"]),
+        "is_win": arr(get["is_win"]),
+        "duration": arr(get["duration"]),
+        "st_a": arr(st_a),
+        "st_b": arr(st_b),
+        "super_armor": arr([v if v is not None else 0 for v in get["super_armor"]]),
+        "super_armor_null": arr([v is None for v in get["super_armor"]]),
+        "score_ratio": arr(get["score_ratio"]),
+        "pet_offsets": arr(pet_offsets),
+        "pets": arr(pets),
+        "talents": arr(talents),
+        "rune_offsets": arr(rune_offsets),
+        "runes": arr(runes),
+    }
+
+
+def concat_arrays(parts: List[Dict[str, "np.ndarray"]]) -> Dict[str, "np.ndarray"]:
+    """拼接多组列数组（列表列的 offsets 依次平移）"""
+    out = {name: np.concatenate([p[name] for p in parts]) if parts else np.zeros(0, dtype=np.int64)
+           for name in SCALAR_COLUMNS}
+    for off, value_names in LIST_COLUMNS.items():
+        offsets, base = [np.zeros(1, dtype=np.int64)], 0
+        for p in parts:
+            offsets.append(np.asarray(p[off][1:], dtype=np.int64) + base)
+            base += int(p[off][-1])
+        out[off] = np.concatenate(offsets)
+        for name in value_names:
+            out[name] = np.concatenate([p[name] for p in parts]) if parts else np.zeros(0, dtype=np.int64)
+    return out
+
+
+def read_database(on_batch: Callable[[Dict[str, "np.ndarray"]], None]) -> int:
+    """在一个 REPEATABLE READ 快照中读取全部记录，按批回调列数组，返回该快照对应的数据版本号"""
+    from backend.app.database import SessionLocal
+    from backend.app.stats_cache import current_generation
+
+    with SessionLocal() as db:
+        # 版本号与数据在同一个快照中读取
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        generation = current_generation(db)
+        stmt = select(*(getattr(MatchRecord, c) for c in ROW_COLUMNS))
+        result = db.execute(stmt, execution_options={"yield_per": _LOAD_BATCH})
+        for part in result.partitions():
+            on_batch(arrays_from_rows(part))
+    return generation
+
+
+class _Column:
+    """可追加的一维整数数组：容量按倍增扩展，dtype 取能容纳已有数值的最小整数类型"""
+
+    def __init__(self):
+        self.buf = np.zeros(0, dtype=np.int8)
+
+    def append(self, n: int, values):
+        """把 values 写入 [n, n+len(values))；需要时换用更大（或类型更宽）的缓冲区"""
+        k = len(values)
+        if k == 0:
+            return
+        dtype = smallest_dtype(values, self.buf.dtype.name)
+        if dtype != self.buf.dtype or n + k > len(self.buf):
+            new = np.zeros(max(n + k, len(self.buf) * 2, 1024), dtype=dtype)
+            new[:n] = self.buf[:n]
+            self.buf = new
+        self.buf[n:n + k] = values
+
+
+class _Snapshot:
+    """进程内快照；查询通过 view() 取得一致的 ([列字典], 行数, 数据版本号)，追加只写入已发布范围之后的位置"""
+
+    def __init__(self):
+        self.columns: Dict[str, _Column] = {name: _Column() for name in SCALAR_COLUMNS}
+        self.sizes: Dict[str, int] = {}
+        for off, value_names in LIST_COLUMNS.items():
+            self.columns[off] = _Column()
+            self.columns[off].append(0, np.zeros(1, dtype=np.int64))
+            for name in value_names:
+                self.columns[name] = _Column()
+            self.sizes[off] = 0
+        self.n = 0
+        self.generation = 0
+        self._view = ([], 0, 0)
+
+    def view(self):
+        return self._view
+
+    def append(self, arrays: Dict[str, "np.ndarray"], generation: Optional[int] = None):
+        """追加一批列数组（arrays_from_rows 的结果）；generation 给定时同时更新快照对应的数据版本号"""
+        n = self.n
+        k = len(arrays["server"])
+        for name in SCALAR_COLUMNS:
+            self.columns[name].append(n, arrays[name])
+        for off, value_names in LIST_COLUMNS.items():
+            base = self.sizes[off]
+            self.columns[off].append(n + 1, arrays[off][1:] + base)
+            for name in value_names:
+                self.columns[name].append(base, arrays[name])
+            self.sizes[off] = base + int(arrays[off][-1])
+        self.n = n + k
+        if generation is not None:
+            self.generation = generation
+        view = {name: self.columns[name].buf[:self.n] for name in SCALAR_COLUMNS}
+        for off, value_names in LIST_COLUMNS.items():
+            view[off] = self.columns[off].buf[:self.n + 1]
+            for name in value_names:
+                view[name] = self.columns[name].buf[:self.sizes[off]]
+        self._view = ([view] if self.n else [], self.n, self.generation)
+
+    def nbytes(self) -> int:
+        return sum(c.buf.nbytes for c in self.columns.values())
+
+
+class _Engine:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot: Optional[_Snapshot] = None
+        self.loading = False
+        self.pending: List[tuple] = []   # 加载期间到达的 (generation, arrays)
+        self.stale = False
+        self.mismatch_since: Optional[float] = None
+
+    def _load(self):
+        started = time.perf_counter()
+        try:
+            if columnar_store.enabled():
+                parts = []
+                generation = read_database(parts.append)
+                columnar_store.write_base(concat_arrays(parts), generation)
+                print(f"Columnar snapshot file rebuilt: generation {generation}, "
+                      f"{time.perf_counter() - started:.1f}s")
+                with self.lock:
+                    self.stale = False
+                    self.loading = False
+                return
+            snap = _Snapshot()
+            generation = read_database(snap.append)
+            snap.append(arrays_from_rows([]), generation)
+        except Exception as e:
+            print(f"Warning: columnar snapshot load failed: {e}")
+            with self.lock:
+                self.loading = False
+                self.pending = []
+            return
+        with self.lock:
+            for generation, arrays in sorted(self.pending, key=lambda p: p[0]):
+                _apply(snap, arrays, generation)
+            self.pending = []
+            self.snapshot = snap
+            self.stale = False
+            self.loading = False
+        print(f"Columnar snapshot loaded: {snap.n} rows in {time.perf_counter() - started:.1f}s "
+              f"(generation {snap.generation})")
+
+    def load_now(self):
+        """同步加载（供脚本使用）"""
+        with self.lock:
+            self.loading = True
+            self.pending = []
+        self._load()
+
+    def reload_async(self):
+        with self.lock:
+            if self.loading:
+                return
+            self.loading = True
+            self.pending = []
+        threading.Thread(target=self._load, name="columnar-load", daemon=True).start()
+
+
+def _apply(snap: _Snapshot, arrays: Dict[str, "np.ndarray"], generation: int) -> bool:
+    """按版本号顺序追加一个导入批次；出现缺口（有本进程没见过的导入）时返回 False"""
+    if generation <= snap.generation:
+        return True
+    if generation != snap.generation + 1:
+        return False
+    snap.append(arrays, generation)
+    return True
+
+
+_ENGINE = _Engine()
+
+
+def start():
+    """应用启动时调用：启用时加载快照（共享快照文件已存在时直接映射，不需要访问数据库）"""
+    if enabled():
+        if columnar_store.enabled() and columnar_store.current_view() is not None:
+            return
+        _ENGINE.reload_async()
+    elif os.environ.get("STATS_ENGINE", "sql").strip().lower() == "columnar":
+        print("Warning: STATS_ENGINE=columnar requires numpy; using SQL")
+
+
+def load_now():
+    _ENGINE.load_now()
+
+
+def append_inserted(rows: Sequence[Sequence], generation: Optional[int]):
+    """导入批次提交后调用：rows 为按 ROW_COLUMNS 排列的实际插入行，generation 为该批次写入的数据版本号"""
+    if not enabled() or not rows or generation is None:
+        return
+    arrays = arrays_from_rows(rows)
+    if columnar_store.enabled():
+        try:
+            columnar_store.append_segment(arrays, generation)
+        except Exception as e:
+            print(f"Warning: failed to write columnar segment: {e}")
+        return
+    with _ENGINE.lock:
+        if _ENGINE.loading:
+            _ENGINE.pending.append((generation, arrays))
+            return
+        snap = _ENGINE.snapshot
+        if snap is None:
+            return
+        if not _apply(snap, arrays, generation):
+            _ENGINE.stale = True
+    if _ENGINE.stale:
+        _ENGINE.reload_async()
+
+
+def _reload_grace() -> float:
+    try:
+        return float(os.environ.get("COLUMNAR_RELOAD_GRACE_SEC", "2"))
+    except ValueError:
+        return 2.0
+
+
+def _current_view():
+    if columnar_store.enabled():
+        return columnar_store.current_view()
+    snap = _ENGINE.snapshot
+    return snap.view() if snap is not None else None
+
+
+def _ready_view(db: Session, generation: Optional[int] = None):
+    """可用且与主库的数据版本号一致时返回快照视图，否则返回 None（并在需要时触发后台重新加载）
+
+    快照从主库加载；generation 为调用方已读到的主库版本号，未给出时从 db 读取（db 必须是主库会话，
+    只读副本的版本号可能落后，用它比较会导致快照被反复重新加载）
+    """
+    from backend.app.stats_cache import current_generation
+
+    view = _current_view()
+    if view is None:
+        _ENGINE.reload_async()
+        return None
+    if generation is None:
+        generation = current_generation(db)
+    if generation == view[2]:
+        _ENGINE.mismatch_since = None
+        return view
+    # 版本号不一致：刚提交的批次会在提交后立即追加（或写入新的段），先短暂回退到 SQL；
+    # 超过 COLUMNAR_RELOAD_GRACE_SEC 仍不一致（其他进程导入、卸载分区等）时重新加载
+    now = time.monotonic()
+    if _ENGINE.mismatch_since is None:
+        _ENGINE.mismatch_since = now
+    if _ENGINE.stale or now - _ENGINE.mismatch_since >= _reload_grace():
+        _ENGINE.mismatch_since = None
+        _ENGINE.reload_async()
+    return None
+
+
+def _list_hit(offsets, value_hit):
+    """列表列：每行是否至少有一个值命中（value_hit 为逐值的布尔数组）"""
+    cs = np.concatenate([[0], np.cumsum(value_hit, dtype=np.int64)])
+    return cs[offsets[1:]] > cs[offsets[:-1]]
+
+
+def _mask(v: Dict[str, "np.ndarray"], n: int,
+          servers=None, start_ts=None, end_ts=None, min_level=None, max_level=None,
+          clazz=None, schools=None, opponent_class=None, opponent_schools=None,
+          spirit_animal=None, spirit_animal_talents=None, legendary_runes=None,
+          super_armor=None, score_ratio=None, **_):
+    """与 crud._apply_common_filters 对应的行掩码（source_types 在展开后单独处理）"""
+    m = np.ones(n, dtype=bool)
+    if servers:
+        m &= np.isin(v["server"], servers)
+    if start_ts is not None:
+        m &= v["timestamp"] >= start_ts
+    if end_ts is not None:
+        m &= v["timestamp"] <= end_ts
+    if min_level is not None:
+        m &= v["level"] >= min_level
+    if max_level is not None:
+        m &= v["level"] <= max_level
+    if clazz is not None:
+        m &= v["clazz"] == clazz
+    if schools is not None:
+        m &= v["schools"] == schools
+    if opponent_class is not None:
+        m &= v["opponent_class"] == opponent_class
+    if opponent_schools is not None:
+        m &= v["opponent_schools"] == opponent_schools
+    if spirit_animal:
+        hit = np.isin(v["pets"], spirit_animal)
+        if spirit_animal_talents is not None and spirit_animal_talents != 0:
+            hit &= v["talents"] == spirit_animal_talents
+        m &= _list_hit(v["pet_offsets"], hit)
+    if legendary_runes:
+        m &= _list_hit(v["rune_offsets"], np.isin(v["runes"], legendary_runes))
+    if super_armor is not None:
+        m &= (v["super_armor"] == super_armor) & (v["super_armor_null"] == 0)
+    if score_ratio is not None:
+        m &= v["score_ratio"] >= score_ratio
+    return m
+
+
+def _select(v: Dict[str, "np.ndarray"], group_by_opponent: bool, source_types, filters) -> List["np.ndarray"]:
+    """在一个段上过滤并展开 source_type，返回 [分组列..., is_win, duration]（只包含选中的行）"""
+    m = _mask(v, len(v["server"]), **filters)
+    # 展开 source_type：每行最多产生 st_a、st_b 两条
+    sel_a = m & (v["st_a"] != NO_TYPE)
+    sel_b = m & (v["st_b"] != NO_TYPE)
+    if source_types:
+        sel_a &= np.isin(v["st_a"], source_types)
+        sel_b &= np.isin(v["st_b"], source_types)
+    idx = np.concatenate([np.flatnonzero(sel_a), np.flatnonzero(sel_b)])
+    st = np.concatenate([v["st_a"][sel_a], v["st_b"][sel_b]])
+    cols = [v["server_group"][idx], v["clazz"][idx], v["schools"][idx], st]
+    if group_by_opponent:
+        cols += [v["opponent_class"][idx], v["opponent_schools"][idx]]
+    return cols + [v["is_win"][idx], v["duration"][idx]]
+
+
+def _group(cols: List["np.ndarray"]):
+    """对若干整数列做分组：返回 (每行的组号, 各组的列值列表)"""
+    k = len(cols[0])
+    spans = []
+    radix = 1
+    for col in cols:
+        lo = int(col.min())
+        span = int(col.max()) - lo + 1
+        spans.append((lo, span))
+        radix *= span
+    if radix >= (1 << 62):
+        present, gid = np.unique(np.stack([c.astype(np.int64) for c in cols], axis=1), axis=0, return_inverse=True)
+        return gid.reshape(-1), [present[:, i] for i in range(len(cols))]
+    key = np.zeros(k, dtype=np.int64)
+    for col, (lo, span) in zip(cols, spans):
+        key = key * span + (col.astype(np.int64) - lo)
+    if radix <= (1 << 24):
+        counts = np.bincount(key, minlength=radix)
+        present = np.flatnonzero(counts)
+        lut = np.empty(radix, dtype=np.int64)
+        lut[present] = np.arange(len(present))
+        gid = lut[key]
+    else:
+        present, gid = np.unique(key, return_inverse=True)
+    values = []
+    rest = present.copy()
+    for lo, span in reversed(spans):
+        values.append(rest % span + lo)
+        rest //= span
+    values.reverse()
+    return gid, values
+
+
+def query(db: Session, metric: str, group_by_opponent: bool,
+          source_types: Optional[List[int]] = None, exact: bool = False,
+          min_matches: Optional[int] = None, generation: Optional[int] = None, **filters) -> Optional[list]:
+    """在列式快照上计算统计，返回与 crud.query_winrate / query_duration 相同列的行（未排序）；快照不可用时返回 None
+    min_matches：只返回场次不少于该值的分组（与 SQL 的 HAVING count(*) >= n 相同）"""
+    if not enabled():
+        return None
+    view = _ready_view(db, generation)
+    if view is None:
+        return None
+    return offload(_compute, view, metric, group_by_opponent, source_types, min_matches, filters)
+
+
+def _compute(view, metric: str, group_by_opponent: bool, source_types: Optional[List[int]],
+             min_matches: Optional[int], filters: dict) -> list:
+    segments, n, _ = view
+    if n == 0:
+        return []
+    parts = [_select(v, group_by_opponent, source_types, filters) for v in segments]
+    selected = [np.concatenate(cols) for cols in zip(*parts)]
+    key_cols, is_win, duration = selected[:-2], selected[-2], selected[-1]
+    if len(is_win) == 0:
+        return []
+    gid, keys = _group(key_cols)
+    groups = len(keys[0])
+    match_count = np.bincount(gid, minlength=groups)
+    key_rows = [[int(x) for x in t] for t in zip(*keys)]
+    min_count = min_matches or 0
+
+    if metric == "winrate":
+        win = np.bincount(gid, weights=(is_win == 1).astype(np.float64), minlength=groups).astype(np.int64)
+        lose = np.bincount(gid, weights=(is_win == 0).astype(np.float64), minlength=groups).astype(np.int64)
+        return [
+            key + [int(w), int(lo), int(c), (w / c) if w else None]
+            for key, w, lo, c in zip(key_rows, win, lose, match_count)
+            if c >= min_count
+        ]
+
+    from backend.app.crud import DURATION_PERCENTILES
+
+    order = np.lexsort((duration, gid))
+    sorted_dur = duration[order]
+    starts = np.concatenate([[0], np.cumsum(match_count)[:-1]])
+    sums = np.bincount(gid, weights=duration, minlength=groups)
+    mins = sorted_dur[starts]
+    maxs = sorted_dur[starts + match_count - 1]
+    # percentile_disc(p)：组内第 ceil(p * n) 个值（至少第 1 个），与 PostgreSQL 的计算方式相同
+    percentiles = []
+    for _, p in DURATION_PERCENTILES:
+        rank = np.maximum(np.ceil(p * match_count.astype(np.float64)).astype(np.int64), 1)
+        percentiles.append(sorted_dur[starts + rank - 1])
+    rows = []
+    for g, key in enumerate(key_rows):
+        c = int(match_count[g])
+        if c < min_count:
+            continue
+        rows.append(key + [float(sums[g]) / c, int(maxs[g]), int(mins[g])]
+                    + [float(pc[g]) for pc in percentiles])
+    return rows
+
+
+def status() -> Dict[str, object]:
+    view = _current_view() if enabled() else None
+    info = {
+        "enabled": enabled(),
+        "source": "file" if columnar_store.enabled() else "memory",
+        "loading": _ENGINE.loading,
+        "rows": view[1] if view is not None else 0,
+        "generation": view[2] if view is not None else None,
+        "segments": len(view[0]) if view is not None else 0,
+    }
+    if view is not None and not columnar_store.enabled() and _ENGINE.snapshot is not None:
+        info["bytes"] = _ENGINE.snapshot.nbytes()
+    return info
@@ -0,0 +1,230 @@
+"""
+列式快照文件 - 在 COLUMNAR_SNAPSHOT_DIR 下以只读段（segment）保存 match_records 的列数组，供多个 worker 进程 mmap 共享
+目录结构：
+    manifest.json              当前生效的段列表与对应的数据版本号（整体替换，os.replace 保证原子性）
+    seg-<版本号>-<随机串>/      一个段：每列一个 .npy（定长整数数组；列表列为 offsets + values）和 header.json
+    .lock                      写入方之间的文件锁
+导入批次提交后把实际插入的行写成新段并追加到 manifest；段数超过 COLUMNAR_MAX_SEGMENTS 时合并为一个段。
+读取方发现 manifest 变化后重新映射（段文件不可变，已映射的段直接复用），被替换的旧段在没有进程映射后由系统回收
+"""
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+_MANIFEST = "manifest.json"
+_LOCK = ".lock"
+_TMP_MAX_AGE_SEC = 3600
+# 列编码版本：columnar.arrays_from_rows 的编码变化时加一，旧版本的快照文件不再读取，由全量重建替换
+_FORMAT = 2
+
+
+def store_dir() -> Optional[str]:
+    return os.environ.get("COLUMNAR_SNAPSHOT_DIR", "").strip() or None
+
+
+def enabled() -> bool:
+    return store_dir() is not None and np is not None
+
+
+def _max_segments() -> int:
+    try:
+        return max(1, int(os.environ.get("COLUMNAR_MAX_SEGMENTS", "32")))
+    except ValueError:
+        return 32
+
+
+class _DirLock:
+    """写入方之间的互斥（flock，进程退出时自动释放）"""
+
+    def __init__(self, path: str):
+        self._path = os.path.join(path, _LOCK)
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self._path, os.O_CREAT | os.O_RDWR, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+def _read_manifest(path: str) -> dict:
+    try:
+        with open(os.path.join(path, _MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {"format": _FORMAT}
+    manifest.setdefault("format", 1)
+    manifest.setdefault("generation", 0)
+    manifest.setdefault("segments", [])
+    manifest.setdefault("pending", [])
+    return manifest
+
+
+def _write_manifest(path: str, manifest: dict):
+    tmp = os.path.join(path, f"{_MANIFEST}.tmp-{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(path, _MANIFEST))
+
+
+def _write_segment(path: str, arrays: Dict[str, "np.ndarray"], generation: int) -> str:
+    """把一组列数组写入临时目录（尚未对读取方可见），返回临时目录名"""
+    from backend.app.columnar import smallest_dtype
+
+    tmp = f"tmp-{uuid.uuid4().hex[:12]}"
+    seg_dir = os.path.join(path, tmp)
+    os.makedirs(seg_dir)
+    dtypes = {}
+    for name, values in arrays.items():
+        values = values.astype(smallest_dtype(values), copy=False)
+        np.save(os.path.join(seg_dir, f"{name}.npy"), values)
+        dtypes[name] = values.dtype.name
+    with open(os.path.join(seg_dir, "header.json"), "w", encoding="utf-8") as f:
+        json.dump({"generation": generation, "rows": int(len(arrays["server"])), "columns": dtypes}, f)
+    return tmp
+
+
+def _publish(path: str, tmp: str, generation: int) -> str:
+    name = f"seg-{generation:012d}-{tmp[4:]}"
+    os.rename(os.path.join(path, tmp), os.path.join(path, name))
+    return name
+
+
+def _promote(manifest: dict):
+    """pending 中与当前版本号连续的段依次转为生效段，不再需要的（版本号已被覆盖）丢弃"""
+    pending = sorted(manifest["pending"], key=lambda p: p["generation"])
+    kept = []
+    for item in pending:
+        if item["generation"] <= manifest["generation"]:
+            continue
+        if item["generation"] == manifest["generation"] + 1:
+            manifest["segments"].append(item["name"])
+            manifest["generation"] = item["generation"]
+        else:
+            kept.append(item)
+    manifest["pending"] = kept
+
+
+def _load_segment(path: str, name: str) -> Dict[str, "np.ndarray"]:
+    seg_dir = os.path.join(path, name)
+    with open(os.path.join(seg_dir, "header.json"), "r", encoding="utf-8") as f:
+        header = json.load(f)
+    arrays = {}
+    for column in header["columns"]:
+        file = os.path.join(seg_dir, f"{column}.npy")
+        # 空数组无法 mmap
+        arrays[column] = np.load(file, mmap_mode="r") if os.path.getsize(file) > 128 else np.load(file)
+    return arrays
+
+
+def _compact(path: str, manifest: dict):
+    """把全部生效段合并为一个段"""
+    from backend.app.columnar import concat_arrays
+
+    merged = concat_arrays([_load_segment(path, name) for name in manifest["segments"]])
+    tmp = _write_segment(path, merged, manifest["generation"])
+    manifest["segments"] = [_publish(path, tmp, manifest["generation"])]
+
+
+def _cleanup(path: str, manifest: dict):
+    """删除不再被 manifest 引用的段，以及遗留的临时目录（已映射这些文件的进程不受影响）"""
+    referenced = set(manifest["segments"]) | {p["name"] for p in manifest["pending"]}
+    now = time.time()
+    for entry in os.listdir(path):
+        full = os.path.join(path, entry)
+        if entry.startswith("seg-") and entry not in referenced:
+            shutil.rmtree(full, ignore_errors=True)
+        elif entry.startswith("tmp-") and now - os.path.getmtime(full) > _TMP_MAX_AGE_SEC:
+            shutil.rmtree(full, ignore_errors=True)
+
+
+def append_segment(arrays: Dict[str, "np.ndarray"], generation: int):
+    """导入批次提交后调用：写入一个新段并追加到 manifest（版本号不连续时先挂起，等缺失的批次写入）"""
+    path = store_dir()
+    os.makedirs(path, exist_ok=True)
+    tmp = _write_segment(path, arrays, generation)
+    with _DirLock(path):
+        manifest = _read_manifest(path)
+        if generation <= manifest["generation"] or manifest["format"] != _FORMAT:
+            # 旧编码的快照等待全量重建（write_base），不在其后追加新编码的段
+            shutil.rmtree(os.path.join(path, tmp), ignore_errors=True)
+            return
+        name = _publish(path, tmp, generation)
+        manifest["pending"].append({"name": name, "generation": generation})
+        _promote(manifest)
+        if len(manifest["segments"]) > _max_segments():
+            _compact(path, manifest)
+        _write_manifest(path, manifest)
+        _cleanup(path, manifest)
+
+
+def write_base(arrays: Dict[str, "np.ndarray"], generation: int) -> bool:
+    """用全量数据替换快照（generation 为读取数据时的版本号）；已有更新的快照时放弃并返回 False"""
+    path = store_dir()
+    os.makedirs(path, exist_ok=True)
+    tmp = _write_segment(path, arrays, generation)
+    with _DirLock(path):
+        manifest = _read_manifest(path)
+        if generation < manifest["generation"] and manifest["format"] == _FORMAT:
+            shutil.rmtree(os.path.join(path, tmp), ignore_errors=True)
+            return False
+        manifest["segments"] = [_publish(path, tmp, generation)]
+        manifest["generation"] = generation
+        manifest["format"] = _FORMAT
+        _promote(manifest)
+        _write_manifest(path, manifest)
+        _cleanup(path, manifest)
+    return True
+
+
+class _Reader:
+    """读取方缓存：manifest 未变化时直接返回上次的视图；段文件不可变，按名字复用已映射的段"""
+
+    def __init__(self):
+        self.key: Optional[Tuple[int, int]] = None
+        self.view = None
+        self.segments: Dict[str, Dict[str, "np.ndarray"]] = {}
+
+
+_READER = _Reader()
+
+
+def current_view():
+    """当前快照：([每段的列字典], 总行数, 数据版本号)；快照文件不存在或编码版本不同时返回 None"""
+    path = store_dir()
+    try:
+        st = os.stat(os.path.join(path, _MANIFEST))
+    except FileNotFoundError:
+        return None
+    key = (st.st_ino, st.st_mtime_ns)
+    if key == _READER.key:
+        return _READER.view
+    manifest = _read_manifest(path)
+    if manifest["format"] != _FORMAT:
+        return None
+    try:
+        segments = {name: _READER.segments.get(name) or _load_segment(path, name) for name in manifest["segments"]}
+    except FileNotFoundError:
+        # 读 manifest 与映射段之间快照被替换，下次再读
+        return _READER.view
+    segs: List[Dict[str, "np.ndarray"]] = [segments[name] for name in manifest["segments"]]
+    _READER.segments = segments
+    _READER.view = (segs, sum(len(s["server"]) for s in segs), manifest["generation"])
+    _READER.key = key
+    return _READER.view
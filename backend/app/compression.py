@@ -0,0 +1,142 @@
+"""
+响应压缩 - 按 Accept-Encoding 对较大的响应做 brotli / gzip 压缩（ASGI 中间件）
+- 客户端接受 br 且安装了 brotli 时优先使用 brotli，否则使用 gzip；
+- 小于 HTTP_COMPRESS_MIN_BYTES（默认 1024）的一次性响应不压缩；流式响应（导出）逐块压缩并刷出，
+  客户端仍然边下载边收到数据；
+- 只压缩文本类内容（JSON / CSV / HTML / JS / CSS），Parquet 等二进制格式原样输出；
+HTTP_COMPRESS=0 关闭（例如由反向代理负责压缩时）；gzip 级别 HTTP_COMPRESS_GZIP_LEVEL（默认 6），
+brotli 质量 HTTP_COMPRESS_BROTLI_QUALITY（默认 5，动态内容用较低的质量换取速度）
+"""
+import os
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+_COMPRESSIBLE = ("text/", "application/json", "application/javascript")
+
+
+def enabled() -> bool:
+    return os.environ.get("HTTP_COMPRESS", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """从 Accept-Encoding 中选择编码（忽略 q=0 的项）；都不接受时返回 None"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class _Encoder:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=min(11, _int_env("HTTP_COMPRESS_BROTLI_QUALITY", 5)))
+        else:
+            # wbits=31：带 gzip 头与校验和
+            self._z = zlib.compressobj(min(9, _int_env("HTTP_COMPRESS_GZIP_LEVEL", 6)), zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, last: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._br.process(data)
+            return out + (self._br.finish() if last else self._br.flush())
+        out = self._z.compress(data)
+        return out + self._z.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not enabled():
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _Responder(self.app, encoding, _int_env("HTTP_COMPRESS_MIN_BYTES", 1024))(scope, receive, send)
+
+
+class _Responder:
+    """缓存 http.response.start，看到第一段响应体后决定是否压缩（与 Starlette 的 GZipMiddleware 相同的流程）"""
+
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send: Optional[Send] = None
+        self.initial_message: Message = {}
+        self.started = False
+        self.passthrough = False
+        self.encoder: Optional[_Encoder] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message):
+        if message["type"] == "http.response.start":
+            self.initial_message = message
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            self.passthrough = ("content-encoding" in headers
+                                or not content_type.startswith(_COMPRESSIBLE)
+                                or message["status"] in (204, 304))
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not self.started:
+            self.started = True
+            if self.passthrough or (len(body) < self.minimum_size and not more_body):
+                self.passthrough = True
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+            self.encoder = _Encoder(self.encoding)
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if "etag" in headers and not headers["etag"].startswith("W/"):
+                # 强 ETag 对应未压缩的字节，压缩后改为弱 ETag
+                headers["ETag"] = "W/" + headers["etag"]
+            body = self.encoder.compress(body, last=not more_body)
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(body))
+            await self.send(self.initial_message)
+            await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+            return
+        if self.passthrough:
+            await self.send(message)
+            return
+        await self.send({"type": "http.response.body", "body": self.encoder.compress(body, last=not more_body),
+                         "more_body": more_body})
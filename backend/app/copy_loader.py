@@ -0,0 +1,312 @@
+"""
+批量入库模块 - 使用 PostgreSQL COPY FROM STDIN 写入 match_records
+不构造 ORM 对象；驱动不支持 COPY 或设置 IMPORT_LOADER=orm 时回退到 ORM 的 INSERT
+每行带有确定性指纹 row_hash（原始日志行 + source_type），插入时 ON CONFLICT DO NOTHING，重复导入同一文件不会产生重复数据
+MATCH_STORAGE=single（默认）时每条日志只存一行（league + is_win/duration 有效标记），split 为旧的按 source_type 拆分存储
+"""
+import hashlib
+import io
+import math
+import os
+import time
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from backend.app import columnar, partitions, rollups
+from backend.app.bloom import BloomFilter
+from backend.app.models import MatchRecord
+from backend.app.schemas import get_server_group, pack_pet_talents
+from backend.app.stats_cache import bump_generation
+from backend.app.log_decoder import LogRecord, record_league, record_source_types
+
+
+# COPY 列顺序，record_values 返回的元组与之一一对应
+COPY_COLUMNS = (
+    "server",
+    "timestamp",
+    "level",
+    "clazz",
+    "schools",
+    "opponent_class",
+    "opponent_schools",
+    "is_win",
+    "duration",
+    "spirit_animal",
+    "spirit_animal_talents",
+    "legendary_runes",
+    "super_armor",
+    "source_type",
+    "score_ratio",
+    "row_hash",
+    "league",
+    "win_valid",
+    "duration_valid",
+    "server_group",
+    "pet_talent_packed",
+)
+
+_ARRAY_COLUMNS = {"spirit_animal", "spirit_animal_talents", "legendary_runes", "pet_talent_packed"}
+_HASH_INDEX = COPY_COLUMNS.index("row_hash")
+_TS_INDEX = COPY_COLUMNS.index("timestamp")
+
+# COPY 不支持 ON CONFLICT：先 COPY 到会话级临时表，再 INSERT ... SELECT ... ON CONFLICT DO NOTHING
+# （不指定冲突列：分区表上的唯一索引是 (row_hash, timestamp)，未分区的旧表上是 row_hash）
+_STAGE_TABLE = "_match_records_stage"
+_STAGE_SQL = (
+    f"CREATE TEMP TABLE IF NOT EXISTS {_STAGE_TABLE} ON COMMIT DELETE ROWS AS "
+    f"SELECT {', '.join(COPY_COLUMNS)} FROM {MatchRecord.__tablename__} WITH NO DATA"
+)
+_COPY_SQL = f"COPY {_STAGE_TABLE} ({', '.join(COPY_COLUMNS)}) FROM STDIN"
+# RETURNING 实际插入的行，用于在同一事务中累加 match_rollups，并在提交后追加到列式内存引擎
+_MERGE_SQL = (
+    f"INSERT INTO {MatchRecord.__tablename__} ({', '.join(COPY_COLUMNS)}) "
+    f"SELECT {', '.join(COPY_COLUMNS)} FROM {_STAGE_TABLE} "
+    f"ON CONFLICT DO NOTHING "
+    f"RETURNING {', '.join(columnar.ROW_COLUMNS)}"
+)
+
+_NULL = "\\N"
+
+
+def _to_int(value) -> Optional[int]:
+    """把日志中的数值统一成 int（bool -> 0/1，浮点按四舍五入，与 Postgres 的整型转换一致）"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float):
+        return int(math.floor(value + 0.5)) if value >= 0 else int(math.ceil(value - 0.5))
+    return int(value)
+
+
+def _to_int_list(value) -> Optional[List[Optional[int]]]:
+    if value is None:
+        return None
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    return [_to_int(v) for v in value]
+
+
+def row_fingerprint(line: str, source_type: int) -> int:
+    """行指纹：原始日志行（去掉首尾空白）+ source_type 的 64 位哈希，取有符号整数以存入 BIGINT"""
+    digest = hashlib.blake2b(f"{line.strip()}\x1f{source_type}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def record_values(rec: LogRecord, source_type: int, line: str,
+                  league: Optional[tuple] = None) -> tuple:
+    """把一条解码后的日志记录转换为按 COPY_COLUMNS 排列的元组
+
+    字段缺省值与原 ORM 构造逻辑保持一致；数值非法时抛出 ValueError/TypeError，由调用方跳过该行。
+    league 为 record_league() 的结果（单行存储），None 时 league/有效标记列为 NULL（拆分存储）
+    """
+    source_type = _to_int(source_type)
+    league_id, win_valid, duration_valid = league if league is not None else (None, None, None)
+    spirit_animal = _to_int_list(rec.spirit_animal)
+    spirit_animal_talents = _to_int_list(rec.spirit_animal_talents)
+    return (
+        rec.server,
+        _to_int(rec.timestamp),
+        _to_int(rec.level),
+        _to_int(rec.clazz),
+        _to_int(rec.schools),
+        _to_int(rec.opponent_class),
+        _to_int(rec.opponent_schools),
+        _to_int(rec.is_win) if rec.is_win is not None else 0,
+        _to_int(rec.duration) if rec.duration is not None else 0,
+        spirit_animal,
+        spirit_animal_talents,
+        _to_int_list(rec.legendary_runes),
+        _to_int(rec.super_armor),
+        source_type,
+        _to_int(rec.score_ratio),
+        row_fingerprint(line, source_type),
+        league_id,
+        win_valid,
+        duration_valid,
+        get_server_group(rec.server),
+        pack_pet_talents(spirit_animal, spirit_animal_talents),
+    )
+
+
+def _single_row_storage() -> bool:
+    return os.environ.get("MATCH_STORAGE", "single").strip().lower() != "split"
+
+
+def record_rows(rec: LogRecord, line: str) -> List[tuple]:
+    """一条日志对应的入库记录
+
+    单行存储：只生成一行，source_type 取拆分时的第一个类型（与旧数据中保留的那一行及其指纹一致）；
+    拆分存储：每个 source_type 一行
+    """
+    source_types = record_source_types(rec)
+    if _single_row_storage():
+        league = record_league(rec)
+        if league is not None:
+            return [record_values(rec, source_types[0], line, league)]
+    return [record_values(rec, source_type, line) for source_type in source_types]
+
+
+def _format_array(values: Optional[Sequence[Optional[int]]]) -> str:
+    """int[] 的 COPY 文本格式：{1,2,NULL}"""
+    if values is None:
+        return _NULL
+    return "{" + ",".join("NULL" if v is None else str(v) for v in values) + "}"
+
+
+def _format_row(row: Sequence) -> str:
+    parts = []
+    for col, value in zip(COPY_COLUMNS, row):
+        if col in _ARRAY_COLUMNS:
+            parts.append(_format_array(value))
+        elif value is None:
+            parts.append(_NULL)
+        else:
+            parts.append(str(value))
+    return "\t".join(parts) + "\n"
+
+
+def _use_copy() -> bool:
+    return os.environ.get("IMPORT_LOADER", "copy").strip().lower() != "orm"
+
+
+def _copy_rows(db: Session, rows: Sequence[tuple]) -> Optional[List[tuple]]:
+    """通过 COPY FROM STDIN 写入并跳过重复指纹，返回实际插入的行（columnar.ROW_COLUMNS）；驱动不支持 COPY 时返回 None"""
+    raw_conn = db.connection().connection
+    cur = raw_conn.cursor()
+    try:
+        if not hasattr(cur, "copy_expert"):
+            return None
+        buf = io.StringIO()
+        buf.writelines(_format_row(r) for r in rows)
+        buf.seek(0)
+        cur.execute(_STAGE_SQL)
+        cur.copy_expert(_COPY_SQL, buf)
+        cur.execute(_MERGE_SQL)
+        return cur.fetchall()
+    finally:
+        cur.close()
+
+
+def _orm_rows(db: Session, rows: Sequence[tuple]) -> List[tuple]:
+    stmt = (
+        pg_insert(MatchRecord)
+        .on_conflict_do_nothing()
+        .returning(*(getattr(MatchRecord, c) for c in columnar.ROW_COLUMNS))
+    )
+    return [tuple(r) for r in db.execute(stmt, [dict(zip(COPY_COLUMNS, r)) for r in rows]).all()]
+
+
+_BLOOM: Optional[BloomFilter] = None
+
+
+def _bloom() -> Optional[BloomFilter]:
+    """IMPORT_BLOOM=1 时启用进程内 Bloom 过滤器，容量取 IMPORT_BLOOM_CAPACITY（默认 1000 万个指纹）"""
+    global _BLOOM
+    if os.environ.get("IMPORT_BLOOM", "0").strip().lower() not in ("1", "true", "yes", "on"):
+        return None
+    if _BLOOM is None:
+        try:
+            capacity = int(os.environ.get("IMPORT_BLOOM_CAPACITY", "10000000"))
+        except ValueError:
+            capacity = 10_000_000
+        _BLOOM = BloomFilter(capacity)
+    return _BLOOM
+
+
+def _drop_known(db: Session, rows: Sequence[tuple], bloom: BloomFilter) -> Sequence[tuple]:
+    """Bloom 判断“可能已存在”的行批量到数据库确认一次，确认存在的不再发送"""
+    maybe = [r[_HASH_INDEX] for r in rows if r[_HASH_INDEX] in bloom]
+    if not maybe:
+        return rows
+    existing = set(db.execute(
+        select(MatchRecord.row_hash).where(MatchRecord.row_hash.in_(maybe))
+    ).scalars())
+    if not existing:
+        return rows
+    return [r for r in rows if r[_HASH_INDEX] not in existing]
+
+
+def _skip_uncovered(rows: Sequence[tuple], uncovered: List[Tuple[str, int, int]]) -> Sequence[tuple]:
+    """去掉时间落在没有挂载分区的范围（已卸载的分区）内的行，并给出警告"""
+    kept = [r for r in rows
+            if r[_TS_INDEX] is None or not any(lo <= r[_TS_INDEX] < hi for _, lo, hi in uncovered)]
+    if len(kept) < len(rows):
+        names = ", ".join(name for name, _, _ in uncovered)
+        print(f"Warning: skipped {len(rows) - len(kept)} rows in detached partition ranges ({names})")
+    return kept
+
+
+def _write_batch(db: Session, rows: Sequence[tuple], bloom,
+                 before_commit: Optional[Callable[[Session], None]]) -> Tuple[List[tuple], Optional[int]]:
+    """在当前事务中写入一批记录（不提交），返回 (实际插入的行, 新的数据版本号)"""
+    # 先于其他语句创建缺少的时间分区（DDL 需要父表上的排他锁）；已卸载的时间范围没有分区可写，跳过这些行
+    uncovered = partitions.ensure_for_timestamps(db, (r[_TS_INDEX] for r in rows))
+    if uncovered:
+        rows = _skip_uncovered(rows, uncovered)
+    pending = _drop_known(db, rows, bloom) if bloom is not None else rows
+    inserted: List[tuple] = []
+    generation = None
+    if pending:
+        inserted = _copy_rows(db, pending) if _use_copy() else None
+        if inserted is None:
+            inserted = _orm_rows(db, pending)
+        rollups.apply_inserted(db, inserted)
+        if inserted:
+            # 数据版本号与数据一起提交，统计缓存据此失效
+            generation = bump_generation(db)
+    if before_commit is not None:
+        before_commit(db)
+    return inserted, generation
+
+
+def flush_rows(db: Session, rows: Sequence[tuple],
+               before_commit: Optional[Callable[[Session], None]] = None) -> int:
+    """写入一批记录并提交，返回实际插入的行数（已存在的指纹被跳过）
+
+    实际插入的行在同一事务中累加到 match_rollups；
+    before_commit 在提交前于同一事务内执行（例如更新导入位置）；给定时即使 rows 为空也会执行并提交
+    """
+    if not rows and before_commit is None:
+        return 0
+    bloom = _bloom()
+    try:
+        inserted, generation = _write_batch(db, rows, bloom, before_commit)
+    except Exception as e:
+        if not partitions.is_missing_partition(e):
+            raise
+        # 分区被其他进程（manage_partitions.py）卸载或表刚被转换：本进程的分区缓存已过期，
+        # 清空后重新确认分区并重试一次，否则同一批次会一直失败、导入位置无法前进
+        print(f"Warning: {e}; re-checking partitions and retrying the batch")
+        db.rollback()
+        partitions.forget()
+        inserted, generation = _write_batch(db, rows, bloom, before_commit)
+    db.commit()
+    columnar.append_inserted(inserted, generation)
+    if bloom is not None:
+        bloom.add_many(r[_HASH_INDEX] for r in rows)
+    return len(inserted)
+
+
+def insert_rows(db: Session, rows: Iterable[tuple], batch_size: int = 2000) -> int:
+    """按批写入任意可迭代的记录元组，返回写入总行数"""
+    count = 0
+    buf: List[tuple] = []
+    for row in rows:
+        buf.append(row)
+        if len(buf) >= batch_size:
+            count += flush_rows(db, buf)
+            buf.clear()
+    if buf:
+        count += flush_rows(db, buf)
+    return count
+
+
+def report_throughput(label: str, rows: int, started: float):
+    """打印一次导入的吞吐量（started 为 time.perf_counter() 起点）"""
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    loader = "copy" if _use_copy() else "orm"
+    print(f"{label}: {rows} 行, 耗时 {elapsed:.2f}s, 吞吐 {rows / elapsed:.0f} 行/秒 (loader={loader})")
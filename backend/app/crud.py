@@ -1,7 +1,73 @@
-from typing import List, Optional, Tuple
+import base64
+import json
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import select, func, asc, desc, case, exists, and_
-from backend.app.models import MatchRecord, match_pet_talent_v, match_rune_v
+from sqlalchemy import select, func, asc, desc, case, exists, and_, or_, not_, true, false, null, tuple_, values, column, literal_column, SmallInteger
+from backend.app.models import MatchRecord, MatchRollup, match_pet_talent_v
+from backend.app import columnar, rollups
+from backend.app.database import offload
+from backend.app.schemas import SERVER_GROUP_MAP, get_server_group, pack_pet_talent, server_group_members
+
+
+def _server_group_case(server_col):
+    """区服 -> 合并组（用于没有 server_group 列的 match_rollups，映射来自 schemas.SERVER_GROUP_MAP）"""
+    if not SERVER_GROUP_MAP:
+        return server_col.label('server_group')
+    return case(SERVER_GROUP_MAP, value=server_col, else_=server_col).label('server_group')
+
+
+def _server_filter(servers: List[int], server_col, group_col):
+    """区服过滤：列表恰好覆盖若干完整的合并组时按 server_group 过滤（可走索引），否则按原始区服过滤"""
+    groups = {get_server_group(s) for s in servers}
+    if group_col is not None and set().union(*(server_group_members(g) for g in groups)) == set(servers):
+        return group_col.in_(sorted(groups))
+    return server_col.in_(servers)
+
+
+def _source_type_expansion():
+    """把存储的行展开为对外的 source_type（LATERAL VALUES，每行最多两个）
+
+    - league 为 NULL：拆分存储的旧数据，source_type 原值
+    - 胜率类型 league：is_win 有效，或 is_win/duration 都无效（与拆分导入的默认规则一致）
+    - 时长类型 league + 3：duration 有效
+    不计入的位置为 NULL，由调用方过滤
+    """
+    win_type = case(
+        (MatchRecord.league.is_(None), MatchRecord.source_type),
+        (or_(MatchRecord.win_valid, not_(MatchRecord.duration_valid)), MatchRecord.league),
+    )
+    duration_type = case(
+        (and_(MatchRecord.league.isnot(None), MatchRecord.duration_valid), MatchRecord.league + 3),
+    )
+    return values(column('source_type', SmallInteger), name='st').data([(win_type,), (duration_type,)]).lateral()
+
+
+def _source_type_prefilter(source_types: List[int]):
+    """按 source_type 过滤时先在存储行上缩小范围（可走 source_type / league 索引），再由展开结果精确过滤"""
+    leagues = {t for t in source_types if t in (1, 2, 3)} | {t - 3 for t in source_types if t in (4, 5, 6)}
+    cond = and_(MatchRecord.league.is_(None), MatchRecord.source_type.in_(source_types))
+    if leagues:
+        cond = or_(cond, MatchRecord.league.in_(leagues))
+    return cond
+
+
+def _pet_filter(spirit_animal: List[int], spirit_animal_talents: Optional[int]):
+    """灵宠（及天赋）过滤：数组重叠 && 走 GIN 索引
+
+    指定天赋时匹配打包列 pet_talent_packed（同一位置的灵宠与天赋）；
+    天赋或灵宠 ID 超出可打包范围时回退为展开视图 match_pet_talent_v 上的 EXISTS 子查询
+    """
+    if spirit_animal_talents is None or spirit_animal_talents == 0:
+        return MatchRecord.spirit_animal.overlap(spirit_animal)
+    packed = [pack_pet_talent(pet_id, spirit_animal_talents) for pet_id in spirit_animal]
+    if None not in packed:
+        return MatchRecord.pet_talent_packed.overlap(packed)
+    return exists(select(1).where(and_(
+        match_pet_talent_v.c.match_id == MatchRecord.id,
+        match_pet_talent_v.c.pet_id.in_(spirit_animal),
+        match_pet_talent_v.c.talent_value == spirit_animal_talents,
+    )))
 
 
 def _apply_common_filters(q, 
@@ -19,9 +85,10 @@ def _apply_common_filters(q,
                           legendary_runes: Optional[List[int]] = None,
                           super_armor: Optional[int] = None,
                           source_types: Optional[List[int]] = None,
-                          score_ratio: Optional[int] = None):
+                          score_ratio: Optional[int] = None,
+                          source_type_col=None):
     if servers:
-        q = q.where(MatchRecord.server.in_(servers))
+        q = q.where(_server_filter(servers, MatchRecord.server, MatchRecord.server_group))
     if start_ts is not None:
         q = q.where(MatchRecord.timestamp >= start_ts)
     if end_ts is not None:
@@ -39,25 +106,50 @@ def _apply_common_filters(q,
     if opponent_schools is not None:
         q = q.where(MatchRecord.opponent_schools == opponent_schools)
     if spirit_animal:
-        pet_cond = [match_pet_talent_v.c.match_id == MatchRecord.id,
-                    match_pet_talent_v.c.pet_id.in_(spirit_animal)]
-        if spirit_animal_talents is not None and spirit_animal_talents != 0:
-            pet_cond.append(match_pet_talent_v.c.talent_value == spirit_animal_talents)
-        q = q.where(exists(select(1).where(and_(*pet_cond))))
+        q = q.where(_pet_filter(spirit_animal, spirit_animal_talents))
     if legendary_runes:
-        q = q.where(exists(select(1).where(and_(
-            match_rune_v.c.match_id == MatchRecord.id,
-            match_rune_v.c.rune_id.in_(legendary_runes)
-        ))))
+        q = q.where(MatchRecord.legendary_runes.overlap(legendary_runes))
     if super_armor is not None:
         q = q.where(MatchRecord.super_armor == super_armor)
     if source_types:
-        q = q.where(MatchRecord.source_type.in_(source_types))
+        if source_type_col is None:
+            q = q.where(MatchRecord.source_type.in_(source_types))
+        else:
+            q = q.where(_source_type_prefilter(source_types), source_type_col.in_(source_types))
     if score_ratio is not None:
         q = q.where(MatchRecord.score_ratio >= score_ratio)
     return q
 
 
+# 时长统计输出的分位数列：(列名, 分位点)
+DURATION_PERCENTILES = [
+    ('median_duration', 0.5),
+    ('p25_duration', 0.25),
+    ('p75_duration', 0.75),
+    ('p90_duration', 0.9),
+    ('p99_duration', 0.99),
+]
+
+
+# 统计结果中分组列之后的聚合列（与查询返回的列顺序一致）
+METRIC_COLUMNS = {
+    'winrate': ['win_count', 'lose_count', 'match_count', 'win_rate'],
+    'duration': ['avg_duration', 'max_duration', 'min_duration'] + [name for name, _ in DURATION_PERCENTILES],
+}
+# 合并统计（query_summary）：胜率列 + 时长列，最后一列标记该行是否为按对手细分的分组
+METRIC_COLUMNS['summary'] = (METRIC_COLUMNS['winrate'] + ['duration_count'] + METRIC_COLUMNS['duration']
+                             + ['by_opponent'])
+
+
+def result_columns(metric: str, group_by_opponent: bool) -> List[str]:
+    """统计结果的列名（用于内存排序）"""
+    columns = ['server', 'class', 'schools', 'source_type']
+    # 合并统计的行总是带对手列（按职业分组的行中为 NULL）
+    if group_by_opponent or metric == 'summary':
+        columns += ['opponent_class', 'opponent_schools']
+    return columns + METRIC_COLUMNS[metric]
+
+
 def _parse_sort(sort: Optional[str], mapping: dict) -> List:
     if not sort:
         return []
@@ -73,24 +165,45 @@ def _parse_sort(sort: Optional[str], mapping: dict) -> List:
     return orders
 
 
-def query_winrate(db: Session,
-                  group_by_opponent: bool,
-                  **filters):
-    # 提前取出排序参数，避免传入通用过滤器
-    sort_param = filters.pop('sort', None)
+def _fetch(db: Session, q, yield_per: Optional[int]):
+    """执行查询：yield_per 为空时一次取回全部行；否则使用服务端游标，返回按批拉取的可迭代结果（用于导出）"""
+    if yield_per:
+        return db.execute(q, execution_options={"yield_per": yield_per})
+    return db.execute(q).all()
+
+
+def sort_rows(rows: List[list], sort: Optional[str], columns: List[str]) -> List[list]:
+    """在内存中按 sort（"col:asc,col2:desc"）排序，与 SQL 的 ORDER BY 一致：升序时 NULL 在后，降序时 NULL 在前"""
+    if not sort:
+        return rows
+    index = {name: i for i, name in enumerate(columns)}
+    keys = []
+    for part in sort.split(','):
+        if not part:
+            continue
+        col, _, direction = part.partition(':')
+        col = col.strip()
+        if col in index:
+            keys.append((index[col], (direction.strip().lower() or 'asc') != 'asc'))
+    # 多列排序：从最后一个排序列开始做稳定排序
+    for i, reverse in reversed(keys):
+        rows = sorted(rows, key=lambda r: (r[i] is None, r[i] if r[i] is not None else 0), reverse=reverse)
+    return rows
+
+
+def _winrate_select(group_by_opponent: bool, min_matches: Optional[int] = None, **filters):
+    """胜率统计的分组查询（未排序），返回 (查询, 可排序列的映射)"""
     # 分组字段：是否细分到对手职业与流派
-    # 区服合并：8001/8002/8004 合并为同一组（以8001代表）
-    # 区服合并：8024/8027 合并为同一组（以8024代表）
-    server_group = case(
-        (MatchRecord.server.in_([8001, 8002, 8004]), 8001),
-        (MatchRecord.server.in_([8024, 8027]), 8024),
-        else_=MatchRecord.server,
-    ).label('server_group')
+    # 区服合并：入库时写入的 server_group 列（schemas.SERVER_GROUP_MAP），分组可直接使用索引
+    server_group = MatchRecord.server_group.label('server_group')
+    # 对外的 source_type 由存储行展开得到（单行存储的一行可能同时计入胜率类型与时长类型）
+    st = _source_type_expansion()
+    source_type = st.c.source_type
     group_cols = [
         server_group,
         MatchRecord.clazz,
         MatchRecord.schools,
-        MatchRecord.source_type
+        source_type
     ]
     if group_by_opponent:
         group_cols += [MatchRecord.opponent_class, MatchRecord.opponent_schools]
@@ -101,8 +214,11 @@ def query_winrate(db: Session,
     win_rate = (func.nullif(win_count, 0) / func.nullif(match_count, 0)).label('win_rate')
 
     q = select(*group_cols, win_count, lose_count, match_count, win_rate)
-    q = _apply_common_filters(q, **filters)
+    q = q.select_from(MatchRecord).join(st, true()).where(source_type.isnot(None))
+    q = _apply_common_filters(q, source_type_col=source_type, **filters)
     q = q.group_by(*group_cols)
+    if min_matches:
+        q = q.having(func.count() >= min_matches)
 
     sort_mapping = {
         'server': server_group,
@@ -110,37 +226,42 @@ def query_winrate(db: Session,
         'schools': MatchRecord.schools,
         'opponent_class': MatchRecord.opponent_class,
         'opponent_schools': MatchRecord.opponent_schools,
-        'source_type': MatchRecord.source_type,
+        'source_type': source_type,
         'score_ratio': MatchRecord.score_ratio,
         'win_count': win_count,
         'lose_count': lose_count,
         'match_count': match_count,
         'win_rate': win_rate,
     }
+    return q, sort_mapping
+
+
+def query_winrate(db: Session,
+                  group_by_opponent: bool,
+                  yield_per: Optional[int] = None,
+                  **filters):
+    # 提前取出排序参数，避免传入通用过滤器
+    sort_param = filters.pop('sort', None)
+    q, sort_mapping = _winrate_select(group_by_opponent, **filters)
     orders = _parse_sort(sort_param, sort_mapping)
     if orders:
         q = q.order_by(*orders)
 
-    return db.execute(q).all()
+    return _fetch(db, q, yield_per)
 
 
-def query_duration(db: Session,
-                   group_by_opponent: bool,
-                   **filters):
-    # 提前取出排序参数，避免传入通用过滤器
-    sort_param = filters.pop('sort', None)
-    # 区服合并：8001/8002/8004 合并为同一组（以8001代表）
-    # 区服合并：8024/8027 合并为同一组（以8024代表）
-    server_group = case(
-        (MatchRecord.server.in_([8001, 8002, 8004]), 8001),
-        (MatchRecord.server.in_([8024, 8027]), 8024),
-        else_=MatchRecord.server,
-    ).label('server_group')
+def _duration_select(group_by_opponent: bool, min_matches: Optional[int] = None, **filters):
+    """时长统计的分组查询（未排序），返回 (查询, 可排序列的映射)"""
+    # 区服合并：入库时写入的 server_group 列（schemas.SERVER_GROUP_MAP），分组可直接使用索引
+    server_group = MatchRecord.server_group.label('server_group')
+    # 对外的 source_type 由存储行展开得到（单行存储的一行可能同时计入胜率类型与时长类型）
+    st = _source_type_expansion()
+    source_type = st.c.source_type
     group_cols = [
         server_group,
         MatchRecord.clazz,
         MatchRecord.schools,
-        MatchRecord.source_type
+        source_type
     ]
     if group_by_opponent:
         group_cols += [MatchRecord.opponent_class, MatchRecord.opponent_schools]
@@ -148,12 +269,18 @@ def query_duration(db: Session,
     avg_duration = func.avg(MatchRecord.duration).label('avg_duration')
     max_duration = func.max(MatchRecord.duration).label('max_duration')
     min_duration = func.min(MatchRecord.duration).label('min_duration')
-    # 近似中位数：percentile_disc(0.5) within group
-    median_duration = func.percentile_disc(0.5).within_group(MatchRecord.duration).label('median_duration')
+    # 精确分位数：percentile_disc(p) within group（需要对组内全部时长排序）
+    percentiles = [
+        func.percentile_disc(p).within_group(MatchRecord.duration).label(name)
+        for name, p in DURATION_PERCENTILES
+    ]
 
-    q = select(*group_cols, avg_duration, max_duration, min_duration, median_duration)
-    q = _apply_common_filters(q, **filters)
+    q = select(*group_cols, avg_duration, max_duration, min_duration, *percentiles)
+    q = q.select_from(MatchRecord).join(st, true()).where(source_type.isnot(None))
+    q = _apply_common_filters(q, source_type_col=source_type, **filters)
     q = q.group_by(*group_cols)
+    if min_matches:
+        q = q.having(func.count() >= min_matches)
 
     sort_mapping = {
         'server': server_group,
@@ -161,17 +288,424 @@ def query_duration(db: Session,
         'schools': MatchRecord.schools,
         'opponent_class': MatchRecord.opponent_class,
         'opponent_schools': MatchRecord.opponent_schools,
-        'source_type': MatchRecord.source_type,
+        'source_type': source_type,
         'score_ratio': MatchRecord.score_ratio,
         'avg_duration': avg_duration,
         'max_duration': max_duration,
         'min_duration': min_duration,
-        'median_duration': median_duration,
     }
+    sort_mapping.update({pc.name: pc for pc in percentiles})
+    return q, sort_mapping
+
+
+def query_duration(db: Session,
+                   group_by_opponent: bool,
+                   yield_per: Optional[int] = None,
+                   **filters):
+    # 提前取出排序参数，避免传入通用过滤器
+    sort_param = filters.pop('sort', None)
+    q, sort_mapping = _duration_select(group_by_opponent, **filters)
     orders = _parse_sort(sort_param, sort_mapping)
     if orders:
         q = q.order_by(*orders)
 
-    return db.execute(q).all()
+    return _fetch(db, q, yield_per)
+
+
+
+
+def _apply_rollup_filters(q,
+                          servers: Optional[List[int]] = None,
+                          start_ts: Optional[int] = None,
+                          end_ts: Optional[int] = None,
+                          min_level: Optional[int] = None,
+                          max_level: Optional[int] = None,
+                          clazz: Optional[int] = None,
+                          schools: Optional[int] = None,
+                          opponent_class: Optional[int] = None,
+                          opponent_schools: Optional[int] = None,
+                          source_types: Optional[List[int]] = None,
+                          **_):
+    # 时间 / 等级范围已由 rollups.unsupported_filters 确认与桶边界对齐
+    if servers:
+        q = q.where(_server_filter(servers, MatchRollup.server, None))
+    if start_ts is not None:
+        q = q.where(MatchRollup.bucket_ts >= start_ts)
+    if end_ts is not None:
+        q = q.where(MatchRollup.bucket_ts <= end_ts)
+    if min_level is not None:
+        q = q.where(MatchRollup.level_band >= min_level)
+    if max_level is not None:
+        q = q.where(MatchRollup.level_band <= max_level)
+    if clazz is not None:
+        q = q.where(MatchRollup.clazz == clazz)
+    if schools is not None:
+        q = q.where(MatchRollup.schools == schools)
+    if opponent_class is not None:
+        q = q.where(MatchRollup.opponent_class == opponent_class)
+    if opponent_schools is not None:
+        q = q.where(MatchRollup.opponent_schools == opponent_schools)
+    if source_types:
+        q = q.where(MatchRollup.source_type.in_(source_types))
+    return q
+
+
+def _winrate_rollup_select(group_by_opponent: bool, min_matches: Optional[int] = None, **filters):
+    """与 _winrate_select 相同的列，但从 match_rollups 汇总"""
+    server_group = _server_group_case(MatchRollup.server)
+    group_cols = [
+        server_group,
+        MatchRollup.clazz,
+        MatchRollup.schools,
+        MatchRollup.source_type
+    ]
+    if group_by_opponent:
+        group_cols += [MatchRollup.opponent_class, MatchRollup.opponent_schools]
+
+    win_count = func.sum(MatchRollup.win_count).label('win_count')
+    lose_count = func.sum(MatchRollup.lose_count).label('lose_count')
+    match_count = func.sum(MatchRollup.match_count).label('match_count')
+    win_rate = (func.nullif(win_count, 0) / func.nullif(match_count, 0)).label('win_rate')
+
+    q = select(*group_cols, win_count, lose_count, match_count, win_rate)
+    q = _apply_rollup_filters(q, **filters)
+    q = q.group_by(*group_cols)
+    if min_matches:
+        q = q.having(func.sum(MatchRollup.match_count) >= min_matches)
+
+    sort_mapping = {
+        'server': server_group,
+        'class': MatchRollup.clazz,
+        'schools': MatchRollup.schools,
+        'opponent_class': MatchRollup.opponent_class,
+        'opponent_schools': MatchRollup.opponent_schools,
+        'source_type': MatchRollup.source_type,
+        'win_count': win_count,
+        'lose_count': lose_count,
+        'match_count': match_count,
+        'win_rate': win_rate,
+    }
+    return q, sort_mapping
+
+
+def query_winrate_rollup(db: Session,
+                         group_by_opponent: bool,
+                         yield_per: Optional[int] = None,
+                         **filters):
+    """与 query_winrate 返回相同的列，但从 match_rollups 汇总"""
+    sort_param = filters.pop('sort', None)
+    q, sort_mapping = _winrate_rollup_select(group_by_opponent, **filters)
+    orders = _parse_sort(sort_param, sort_mapping)
+    if orders:
+        q = q.order_by(*orders)
+
+    return _fetch(db, q, yield_per)
+
+
+def query_winrate_routed(db: Session,
+                         group_by_opponent: bool,
+                         yield_per: Optional[int] = None,
+                         primary_generation: Optional[int] = None,
+                         **filters) -> Tuple[list, str]:
+    """胜率统计：过滤条件只涉及 rollup 维度时查 match_rollups，否则扫描原始记录，返回 (结果, 查询路径)
+
+    启用列式内存引擎（STATS_ENGINE=columnar）且快照可用时直接在内存中计算（查询路径 columnar）；
+    yield_per 给定时结果为服务端游标上按批拉取的可迭代对象；
+    db 为只读副本会话时 primary_generation 给出主库的数据版本号（列式快照来自主库，见 columnar.query）
+    """
+    if yield_per is None:
+        rows = columnar.query(db, 'winrate', group_by_opponent, generation=primary_generation, **filters)
+        if rows is not None:
+            return offload(sort_rows, rows, filters.get('sort'), result_columns('winrate', group_by_opponent)), "columnar"
+    path = rollups.choose_path(filters)
+    if path == "rollup":
+        return query_winrate_rollup(db, group_by_opponent, yield_per=yield_per, **filters), path
+    return query_winrate(db, group_by_opponent, yield_per=yield_per, **filters), path
+
+
+def query_duration_rollup(db: Session,
+                          group_by_opponent: bool,
+                          **filters):
+    """与 query_duration 返回相同的列，但从 match_rollups 汇总；分位数由合并后的时长直方图估算（见 rollups.hist_percentile）"""
+    sort_param = filters.pop('sort', None)
+    min_matches = filters.pop('min_matches', None)
+    server_group = _server_group_case(MatchRollup.server).label('server_group')
+    group_cols = [
+        server_group,
+        MatchRollup.clazz,
+        MatchRollup.schools,
+        MatchRollup.source_type
+    ]
+    if group_by_opponent:
+        group_cols += [MatchRollup.opponent_class, MatchRollup.opponent_schools]
+
+    q = select(
+        *group_cols,
+        func.sum(MatchRollup.duration_sum).label('duration_sum'),
+        func.sum(MatchRollup.match_count).label('match_count'),
+        func.max(MatchRollup.duration_max).label('max_duration'),
+        func.min(MatchRollup.duration_min).label('min_duration'),
+    )
+    q = _apply_rollup_filters(q, **filters).group_by(*group_cols)
+    if min_matches:
+        q = q.having(func.sum(MatchRollup.match_count) >= min_matches)
+    groups = {tuple(r[:len(group_cols)]): r[len(group_cols):] for r in db.execute(q).all()}
+
+    # 直方图逐桶求和：展开为 (桶下标, 计数) 后按分组与桶聚合，只返回非空桶
+    h = func.unnest(MatchRollup.duration_hist).table_valued('n', with_ordinality='i').render_derived(name='h')
+    hq = select(*group_cols, h.c.i, func.sum(h.c.n))
+    hq = hq.select_from(MatchRollup).join(h, true()).where(h.c.n > 0)
+    hq = _apply_rollup_filters(hq, **filters).group_by(*group_cols, h.c.i)
+    hist_rows = db.execute(hq).all()
+    return offload(_merge_duration_rollup, groups, hist_rows, len(group_cols), sort_param, group_by_opponent)
+
+
+def _merge_duration_rollup(groups: dict, hist_rows: list, width: int, sort_param: Optional[str],
+                           group_by_opponent: bool) -> list:
+    """按分组合并直方图并估算分位数（纯 CPU，异步模式下在线程池中执行）"""
+    hists = {}
+    for r in hist_rows:
+        key = tuple(r[:width])
+        hist = hists.setdefault(key, [0] * rollups.HIST_BUCKETS)
+        idx, n = r[width], r[width + 1]
+        if 1 <= idx <= rollups.HIST_BUCKETS:
+            hist[idx - 1] = int(n)
+
+    rows = []
+    for key, (duration_sum, match_count, max_duration, min_duration) in groups.items():
+        avg_duration = float(duration_sum) / match_count if match_count else None
+        hist = hists.get(key)
+        percentiles = [
+            rollups.hist_percentile(hist, p, min_duration, max_duration) if hist else None
+            for _, p in DURATION_PERCENTILES
+        ]
+        rows.append([*key, avg_duration, max_duration, min_duration, *percentiles])
+
+    return sort_rows(rows, sort_param, result_columns('duration', group_by_opponent))
+
+
+def query_duration_routed(db: Session,
+                          group_by_opponent: bool,
+                          exact: bool = False,
+                          yield_per: Optional[int] = None,
+                          primary_generation: Optional[int] = None,
+                          **filters) -> Tuple[list, str]:
+    """时长统计，返回 (结果, 查询路径)
+
+    列式内存引擎可用时在内存中精确计算（查询路径 columnar，primary_generation 同 query_winrate_routed）；
+    否则默认在条件允许时从 match_rollups 的时长直方图估算分位数（查询路径 rollup）；
+    exact=True 或过滤条件不支持时扫描原始记录，用 percentile_disc 计算精确分位数（查询路径 raw）
+    """
+    if yield_per is None:
+        rows = columnar.query(db, 'duration', group_by_opponent, generation=primary_generation, **filters)
+        if rows is not None:
+            return offload(sort_rows, rows, filters.get('sort'), result_columns('duration', group_by_opponent)), "columnar"
+    path = "raw" if exact else rollups.choose_path(filters)
+    if path == "rollup":
+        # 分位数在内存中由直方图合并得到，结果行数与分组数相同，不需要游标
+        return query_duration_rollup(db, group_by_opponent, **filters), path
+    return query_duration(db, group_by_opponent, yield_per=yield_per, **filters), path
+
+
+# 合并统计中胜率类型与对应的时长类型（单行存储时为 league 与 league + 3）
+SUMMARY_SOURCE_PAIRS = {1: 4, 2: 5, 3: 6, 7: 8}
+
+
+def query_summary(db: Session,
+                  group_by_opponent: bool = True,
+                  min_matches: Optional[int] = None,
+                  **filters):
+    """胜率与时长的合并统计：一次扫描同时计算两类聚合，返回 (结果行, 查询路径 summary)
+
+    与分别查询 winrate / duration 不同，存储行不经 LATERAL 展开：按胜率类型（1/2/3/7）分组，
+    胜率聚合只计入计入胜率类型的行，时长聚合只计入计入对应时长类型（4/5/6/8）的行（FILTER 子句）。
+    group_by_opponent 为 True 时用 GROUPING SETS 在同一个查询中同时返回按职业与按对手细分的分组，
+    by_opponent 列区分两者；source_types 中的时长类型按对应的胜率类型处理。
+    列顺序见 result_columns('summary', ...)，时长分位数为 percentile_disc 精确值；sort 与其他统计相同，在内存中排序
+    """
+    sort_param = filters.pop('sort', None)
+    source_types = filters.pop('source_types', None)
+    server_group = MatchRecord.server_group.label('server_group')
+    # 胜率类型：单行存储为 league，拆分存储的时长行映射回对应的胜率类型
+    pair = case(
+        (MatchRecord.league.isnot(None), MatchRecord.league),
+        *[(MatchRecord.source_type == d, w) for w, d in SUMMARY_SOURCE_PAIRS.items()],
+        else_=MatchRecord.source_type,
+    ).label('source_type')
+    # 与 _source_type_expansion 相同的规则：该行是否计入胜率类型 / 时长类型
+    counts_win = or_(
+        and_(MatchRecord.league.is_(None), MatchRecord.source_type.in_(list(SUMMARY_SOURCE_PAIRS))),
+        and_(MatchRecord.league.isnot(None), or_(MatchRecord.win_valid, not_(MatchRecord.duration_valid))),
+    )
+    counts_duration = or_(
+        and_(MatchRecord.league.is_(None), MatchRecord.source_type.in_(list(SUMMARY_SOURCE_PAIRS.values()))),
+        and_(MatchRecord.league.isnot(None), MatchRecord.duration_valid),
+    )
+    class_cols = [server_group, MatchRecord.clazz, MatchRecord.schools, pair]
+    opponent_cols = [MatchRecord.opponent_class, MatchRecord.opponent_schools]
+
+    win_count = func.count().filter(and_(counts_win, MatchRecord.is_win == 1)).label('win_count')
+    lose_count = func.count().filter(and_(counts_win, MatchRecord.is_win == 0)).label('lose_count')
+    match_count = func.count().filter(counts_win).label('match_count')
+    win_rate = (func.nullif(win_count, 0) / func.nullif(match_count, 0)).label('win_rate')
+    duration_count = func.count().filter(counts_duration).label('duration_count')
+    duration_aggs = [
+        func.avg(MatchRecord.duration).filter(counts_duration).label('avg_duration'),
+        func.max(MatchRecord.duration).filter(counts_duration).label('max_duration'),
+        func.min(MatchRecord.duration).filter(counts_duration).label('min_duration'),
+    ] + [
+        func.percentile_disc(p).within_group(MatchRecord.duration).filter(counts_duration).label(name)
+        for name, p in DURATION_PERCENTILES
+    ]
+
+    if group_by_opponent:
+        by_opponent = (func.grouping(*opponent_cols) == 0).label('by_opponent')
+        group_by = [func.grouping_sets(tuple_(*class_cols), tuple_(*class_cols, *opponent_cols))]
+    else:
+        by_opponent = false().label('by_opponent')
+        group_by = class_cols
+    q = select(*class_cols, *opponent_cols if group_by_opponent else [null(), null()],
+               win_count, lose_count, match_count, win_rate, duration_count, *duration_aggs, by_opponent)
+    # 不计入任何一侧的行（拆分存储中 source_type 不属于任何类型对的旧数据）不参与分组，否则会产生两侧场次都为 0 的分组
+    q = _apply_common_filters(q.select_from(MatchRecord).where(or_(counts_win, counts_duration)), **filters)
+    if source_types:
+        pairs = sorted({t for t in source_types if t in SUMMARY_SOURCE_PAIRS}
+                       | {w for w, d in SUMMARY_SOURCE_PAIRS.items() if d in source_types})
+        q = q.where(_source_type_prefilter(pairs + [SUMMARY_SOURCE_PAIRS[w] for w in pairs]), pair.in_(pairs))
+    q = q.group_by(*group_by)
+    if min_matches:
+        q = q.having(func.greatest(match_count, duration_count) >= min_matches)
+    rows = db.execute(q).all()
+    return offload(sort_rows, rows, sort_param, result_columns('summary', True)), "summary"
+
+
+def page_keys(sort: Optional[str], metric: str, group_by_opponent: bool) -> List[Tuple[str, bool]]:
+    """分页的排序键 [(列名, 是否降序)]：sort 中的结果列，再以分组列（升序）补全，保证顺序唯一、游标可以续接"""
+    columns = result_columns(metric, group_by_opponent)
+    group = columns[:6 if group_by_opponent else 4]
+    keys, seen = [], set()
+    for part in (sort or '').split(','):
+        col, _, direction = part.partition(':')
+        col = col.strip()
+        if col in columns and col not in seen:
+            keys.append((col, (direction.strip().lower() or 'asc') != 'asc'))
+            seen.add(col)
+    return keys + [(col, False) for col in group if col not in seen]
+
+
+def encode_cursor(keys: List[Tuple[str, bool]], row, columns: List[str]) -> str:
+    """本页最后一行的排序键值编码为不透明的游标（numeric 以字符串保存，避免精度损失）"""
+    values = []
+    for name, _ in keys:
+        v = row[columns.index(name)]
+        values.append({'d': str(v)} if isinstance(v, Decimal) else v)
+    raw = json.dumps({'k': [[n, int(d)] for n, d in keys], 'v': values}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, keys: List[Tuple[str, bool]]) -> list:
+    """解析游标；格式错误或与当前排序不一致时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        cursor_keys = [(n, bool(d)) for n, d in payload['k']]
+        values = [Decimal(v['d']) if isinstance(v, dict) else v for v in payload['v']]
+    except Exception:
+        raise ValueError('invalid cursor')
+    if cursor_keys != keys or len(values) != len(keys):
+        raise ValueError('cursor does not match the current sort')
+    return values
+
+
+def _keyset_clause(keys: List[Tuple[str, bool]], mapping: dict, values: list):
+    """排在游标之后的行（HAVING 条件），与 ORDER BY 一致：升序时 NULL 在后，降序时 NULL 在前"""
+    clauses = []
+    for i, (name, is_desc) in enumerate(keys):
+        col, v = mapping[name], values[i]
+        if is_desc:
+            after = col < v if v is not None else col.isnot(None)
+        elif v is not None:
+            after = or_(col > v, col.is_(None))
+        else:
+            continue
+        equal = [mapping[n].is_not_distinct_from(pv) for (n, _), pv in zip(keys[:i], values[:i])]
+        clauses.append(and_(*equal, after))
+    return or_(*clauses) if clauses else false()
+
+
+def _sort_key(keys: List[Tuple[str, bool]], columns: List[str]):
+    index = [(columns.index(name), is_desc) for name, is_desc in keys]
+
+    def key(row):
+        out = []
+        for i, is_desc in index:
+            v = row[i]
+            if is_desc:
+                out.append((0, 0) if v is None else (1, -v))
+            else:
+                out.append((1, 0) if v is None else (0, v))
+        return tuple(out)
+    return key
+
+
+def paginate_rows(rows: List[list], keys: List[Tuple[str, bool]], columns: List[str],
+                  limit: int, cursor_values: Optional[list]) -> Tuple[List[list], Optional[str]]:
+    """在内存中按分页排序键取一页（与 SQL 的 ORDER BY + 游标条件结果一致），返回 (本页行, 下一页游标)"""
+    key = _sort_key(keys, columns)
+    rows = sorted(rows, key=key)
+    if cursor_values is not None:
+        after = key(_cursor_row(keys, columns, cursor_values))
+        rows = [r for r in rows if key(r) > after]
+    page = rows[:limit]
+    next_cursor = encode_cursor(keys, page[-1], columns) if len(rows) > limit else None
+    return page, next_cursor
+
+
+def _cursor_row(keys, columns, values) -> list:
+    row = [None] * len(columns)
+    for (name, _), v in zip(keys, values):
+        row[columns.index(name)] = v
+    return row
+
+
+def query_page(db: Session,
+               metric: str,
+               group_by_opponent: bool,
+               limit: int,
+               cursor: Optional[str] = None,
+               exact: bool = False,
+               primary_generation: Optional[int] = None,
+               **filters) -> Dict[str, object]:
+    """统计结果的一页：排序、游标条件、LIMIT 与 min_matches 下推到 SQL，总分组数由单独的 count 查询得到
+
+    返回 {"rows", "total", "next_cursor", "path"}；列式引擎与 rollup 时长路径本身在内存中计算，
+    在内存中按相同的规则分页（primary_generation 同 query_winrate_routed）。游标无效时抛出 ValueError
+    """
+    keys = page_keys(filters.pop('sort', None), metric, group_by_opponent)
+    columns = result_columns(metric, group_by_opponent)
+    cursor_values = decode_cursor(cursor, keys) if cursor else None
 
+    rows = columnar.query(db, metric, group_by_opponent, generation=primary_generation, **filters)
+    path = "columnar"
+    if rows is None:
+        path = "raw" if (metric == 'duration' and exact) else rollups.choose_path(filters)
+        if metric == 'duration' and path == "rollup":
+            rows = query_duration_rollup(db, group_by_opponent, **filters)
+    if rows is not None:
+        page, next_cursor = offload(paginate_rows, rows, keys, columns, limit, cursor_values)
+        return {"rows": page, "total": len(rows), "next_cursor": next_cursor, "path": path}
 
+    if metric == 'winrate':
+        builder = _winrate_rollup_select if path == "rollup" else _winrate_select
+    else:
+        builder = _duration_select
+    q, mapping = builder(group_by_opponent, **filters)
+    # 总数只需要分组（与 HAVING），不计算聚合列（特别是 percentile_disc 的组内排序）
+    counted = q.with_only_columns(literal_column('1'), maintain_column_froms=True)
+    total = db.execute(select(func.count()).select_from(counted.subquery())).scalar()
+    if cursor_values is not None:
+        q = q.having(_keyset_clause(keys, mapping, cursor_values))
+    q = q.order_by(*(desc(mapping[n]) if d else asc(mapping[n]) for n, d in keys)).limit(limit + 1)
+    rows = [list(r) for r in db.execute(q).all()]
+    next_cursor = encode_cursor(keys, rows[limit - 1], columns) if len(rows) > limit else None
+    return {"rows": rows[:limit], "total": total, "next_cursor": next_cursor, "path": path}
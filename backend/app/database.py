@@ -1,7 +1,11 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.util.concurrency import await_only, have_greenlet, in_greenlet
+import functools
 import os
 
+import anyio
+
 
 DB_USER = os.getenv("POSTGRES_USER", "app")
 DB_PASS = os.getenv("POSTGRES_PASSWORD", "app")
@@ -9,18 +13,31 @@ DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
 DB_PORT = os.getenv("POSTGRES_PORT", "5432")
 DB_NAME = os.getenv("POSTGRES_DB", "pvp")
 
-def _build_url() -> str:
+# 只读副本（统计查询与导出使用）：设置 POSTGRES_READ_HOST 后启用，其余 POSTGRES_READ_* 未设置时沿用主库的值
+READ_HOST = os.getenv("POSTGRES_READ_HOST", "").strip()
+READ_PORT = os.getenv("POSTGRES_READ_PORT", DB_PORT)
+READ_USER = os.getenv("POSTGRES_READ_USER", DB_USER)
+READ_PASS = os.getenv("POSTGRES_READ_PASSWORD", DB_PASS)
+READ_NAME = os.getenv("POSTGRES_READ_DB", DB_NAME)
+
+
+def _build_url(driver: str = "psycopg2", host: str = DB_HOST, port: str = DB_PORT,
+               user: str = DB_USER, password: str = DB_PASS, name: str = DB_NAME) -> str:
     # 若传入UNIX Socket路径，则使用host=/socket的连接方式
-    if DB_HOST.startswith('/'):
-        if DB_PASS:
-            return f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@/{DB_NAME}?host={DB_HOST}"
+    if host.startswith('/'):
+        if password:
+            return f"postgresql+{driver}://{user}:{password}@/{name}?host={host}"
         else:
-            return f"postgresql+psycopg2://{DB_USER}@/{DB_NAME}?host={DB_HOST}"
+            return f"postgresql+{driver}://{user}@/{name}?host={host}"
     # 否则走TCP
-    if DB_PASS:
-        return f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    if password:
+        return f"postgresql+{driver}://{user}:{password}@{host}:{port}/{name}"
     else:
-        return f"postgresql+psycopg2://{DB_USER}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+        return f"postgresql+{driver}://{user}@{host}:{port}/{name}"
+
+
+def _build_read_url(driver: str = "psycopg2") -> str:
+    return _build_url(driver, READ_HOST, READ_PORT, READ_USER, READ_PASS, READ_NAME)
 
 
 DATABASE_URL = _build_url()
@@ -28,6 +45,48 @@ DATABASE_URL = _build_url()
 engine = create_engine(DATABASE_URL, pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 未配置副本时读写使用同一个引擎
+read_engine = create_engine(_build_read_url(), pool_pre_ping=True) if READ_HOST else engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+
+# 异步模式（DB_ASYNC=1，需要 asyncpg）：统计与导出接口在事件循环中经 asyncpg 执行查询，不占用线程池，
+# 客户端断开时取消正在执行的查询；导入、脚本等其余部分仍使用上面的同步引擎
+async_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+if os.getenv("DB_ASYNC", "0").strip().lower() in ("1", "true", "yes", "on"):
+    try:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        async_engine = create_async_engine(_build_url("asyncpg"), pool_pre_ping=True)
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+        if READ_HOST:
+            AsyncReadSessionLocal = async_sessionmaker(
+                create_async_engine(_build_read_url("asyncpg"), pool_pre_ping=True),
+                autoflush=False, expire_on_commit=False)
+    except ImportError as e:
+        print(f"Warning: DB_ASYNC requires asyncpg ({e}); using the sync engine")
+
+
+def async_enabled() -> bool:
+    return AsyncSessionLocal is not None
+
+
+def offload(fn, *args, **kwargs):
+    """执行纯 CPU 的计算（列式统计、直方图合并、排序、JSON 编解码），返回 fn 的结果
+
+    DB_ASYNC 模式下查询函数经 AsyncSession.run_sync 运行在事件循环线程的 greenlet 中，
+    这里把计算交给线程池并在 greenlet 中等待，不阻塞其他请求；同步模式（本身已在线程池中）直接调用
+    """
+    if have_greenlet and in_greenlet():
+        return await_only(anyio.to_thread.run_sync(functools.partial(fn, *args, **kwargs)))
+    return fn(*args, **kwargs)
+
+
+def replica_enabled() -> bool:
+    return bool(READ_HOST)
+
 
 class Base(DeclarativeBase):
     pass
@@ -41,3 +100,19 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """异步会话依赖；未启用 DB_ASYNC 时为 None（调用方改用同步会话）"""
+    if AsyncSessionLocal is None:
+        yield None
+        return
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_async_read_db():
+    """只读副本的异步会话依赖；未启用 DB_ASYNC 或未配置副本时为 None"""
+    if AsyncReadSessionLocal is None:
+        yield None
+        return
+    async with AsyncReadSessionLocal() as db:
+        yield db
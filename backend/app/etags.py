@@ -0,0 +1,99 @@
+"""
+条件请求 - 统计与导出接口的 ETag / If-None-Match
+统计结果只在导入批次提交后变化，ETag 由接口名、规范化后的查询参数（列表参数排序去重、去掉空值）
+与数据版本号 import_generation 计算；请求带有匹配的 If-None-Match 时直接返回 304，不执行查询、不占用执行名额。
+版本号在进程内最多缓存 HTTP_ETAG_CHECK_SEC（默认 1 秒），缓存有效期内的 304 不访问数据库；
+响应带 Cache-Control: no-cache，浏览器与反向代理每次都会带上 ETag 重新验证。
+HTTP_ETAG=0 关闭；允许副本落后（REPLICA_MAX_LAG > 0）时结果可能来自旧版本，不生成 ETag
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+
+def enabled() -> bool:
+    return os.environ.get("HTTP_ETAG", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _check_sec() -> float:
+    try:
+        return max(0.0, float(os.environ.get("HTTP_ETAG_CHECK_SEC", "1")))
+    except ValueError:
+        return 1.0
+
+
+class _State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation: Optional[int] = None
+        self.checked_at = 0.0
+        self.issued = 0
+        self.not_modified = 0
+
+
+_STATE = _State()
+
+
+def cached_generation() -> Optional[int]:
+    """缓存有效期内的数据版本号；已过期（或从未读取）时返回 None，由调用方调用 load_generation"""
+    with _STATE.lock:
+        if _STATE.generation is not None and time.monotonic() - _STATE.checked_at < _check_sec():
+            return _STATE.generation
+    return None
+
+
+def load_generation(load: Callable[[], int]) -> int:
+    """读取数据版本号（load 执行一次主库查询）并缓存"""
+    generation = load()
+    with _STATE.lock:
+        _STATE.generation, _STATE.checked_at = generation, time.monotonic()
+    return generation
+
+
+def make_etag(endpoint: str, params: Dict[str, object], generation: int) -> str:
+    """弱 ETag：响应中的 cache / query_path 等字段可能不同，但数据相同"""
+    norm = {}
+    for k, v in params.items():
+        if v is None or v == []:
+            continue
+        norm[k] = sorted(set(v)) if isinstance(v, (list, tuple, set)) else v
+    raw = json.dumps([endpoint, norm], sort_keys=True, separators=(",", ":"), default=str)
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+    with _STATE.lock:
+        _STATE.issued += 1
+    return f'W/"{digest}-g{generation}"'
+
+
+def matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否命中（弱比较：忽略 W/ 前缀）"""
+    if not if_none_match:
+        return False
+    target = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            hit = True
+        else:
+            hit = (candidate[2:] if candidate.startswith("W/") else candidate) == target
+        if hit:
+            with _STATE.lock:
+                _STATE.not_modified += 1
+            return True
+    return False
+
+
+def headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+def status() -> Dict[str, object]:
+    with _STATE.lock:
+        return {
+            "enabled": enabled(),
+            "generation": _STATE.generation,
+            "etags_issued": _STATE.issued,
+            "not_modified": _STATE.not_modified,
+        }
@@ -0,0 +1,132 @@
+"""
+统计结果导出 - 按批把结果行写成 CSV / Parquet / Arrow IPC 字节流，供 StreamingResponse 边查边发
+结果行来自服务端游标（crud 查询的 yield_per），内存占用与导出行数无关；
+Parquet / Arrow 需要安装 pyarrow，未安装时 available_formats() 中不包含这两种格式
+"""
+import csv
+import io
+import os
+from typing import Callable, Iterable, Iterator, List, Sequence
+
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+# 列类型：分组列与计数为整数，其余为浮点
+_INT_COLUMNS = {"server", "class", "schools", "source_type", "opponent_class", "opponent_schools",
+                "win_count", "lose_count", "match_count", "max_duration", "min_duration"}
+
+
+def batch_size() -> int:
+    """EXPORT_BATCH_SIZE：服务端游标每批拉取的行数，也是 CSV 刷出 / Parquet 行组的大小"""
+    try:
+        return max(1, int(os.environ.get("EXPORT_BATCH_SIZE", "5000")))
+    except ValueError:
+        return 5000
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+        return pyarrow
+    except ImportError:
+        return None
+
+
+def available_formats() -> List[str]:
+    if _pyarrow() is None:
+        return ["csv"]
+    return list(FORMATS)
+
+
+def _batches(rows: Iterable[Sequence], size: int) -> Iterator[List[Sequence]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_csv(header: List[str], rows: Iterable[Sequence]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    yield buf.getvalue()
+    for batch in _batches(rows, batch_size()):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(batch)
+        yield buf.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """只追加的输出流：pyarrow 写入的字节暂存在这里，每写完一批取走一次"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        data = bytes(b)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _schema(pa, header: List[str]):
+    return pa.schema([(name, pa.int64() if name in _INT_COLUMNS else pa.float64()) for name in header])
+
+
+def stream_columnar(fmt: str, header: List[str], rows: Iterable[Sequence]) -> Iterator[bytes]:
+    """以列式格式（parquet / arrow）按批输出；每批对应 Parquet 的一个行组或 Arrow 的一个 RecordBatch"""
+    pa = _pyarrow()
+    schema = _schema(pa, header)
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        writer = pa.parquet.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+    try:
+        for batch in _batches(rows, batch_size()):
+            columns = [pa.array([r[i] for r in batch], type=schema.field(i).type) for i in range(len(header))]
+            writer.write_batch(pa.record_batch(columns, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def stream(fmt: str, header: List[str], rows: Iterable[Sequence],
+           on_close: Callable[[], None] = None) -> Iterator:
+    """按格式生成导出字节流；on_close 在输出结束（或客户端断开）后调用，用于关闭游标所在的会话"""
+    try:
+        if fmt == "csv":
+            yield from stream_csv(header, rows)
+        else:
+            yield from stream_columnar(fmt, header, rows)
+    finally:
+        if on_close is not None:
+            on_close()
@@ -0,0 +1,218 @@
+"""
+查询调度（准入控制）- 统计/导出接口执行数据库聚合前的并发上限、等待队列与语句超时
+- 每个 worker 进程最多同时执行 QUERY_MAX_CONCURRENCY 个查询（默认 4，0 表示不限制）；
+- 没有空闲名额时最多 QUERY_QUEUE_SIZE 个请求排队（默认 16），队列已满直接返回 429；
+  排队超过 QUERY_QUEUE_TIMEOUT_SEC（默认 10 秒）返回 503，两者都带 Retry-After（QUERY_RETRY_AFTER_SEC，默认 5）；
+- 每个接口的查询在事务内设置 statement_timeout（QUERY_TIMEOUT_MS_<接口>，未设置时取 QUERY_TIMEOUT_MS，
+  默认胜率/时长 30 秒、合并统计 60 秒、导出 300 秒，0 表示不限制），超时同样返回 503；
+排队、拒绝与超时按接口计数（GET /api/stats/governor），用来按实际数据确定容量
+"""
+import asyncio
+import contextlib
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+
+_DEFAULT_TIMEOUT_MS = {"winrate": 30000, "duration": 30000, "summary": 60000, "export": 300000}
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def max_concurrency() -> int:
+    return _int_env("QUERY_MAX_CONCURRENCY", 4)
+
+
+def retry_after() -> int:
+    return max(1, _int_env("QUERY_RETRY_AFTER_SEC", 5))
+
+
+def statement_timeout_ms(endpoint: str) -> int:
+    default = _int_env("QUERY_TIMEOUT_MS", _DEFAULT_TIMEOUT_MS.get(endpoint, 30000))
+    return _int_env(f"QUERY_TIMEOUT_MS_{endpoint.upper()}", default)
+
+
+class QueryRejected(Exception):
+    """查询未被执行（排队已满 / 排队超时 / 语句超时），由 main 转换为带 Retry-After 的 429 / 503 响应"""
+
+    def __init__(self, status_code: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after()
+
+
+class _Counters:
+    def __init__(self):
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_queue_full = 0
+        self.rejected_wait_timeout = 0
+        self.statement_timeouts = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+
+
+class _Governor:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.running = 0
+        self.waiting = 0
+        self.counters: Dict[str, _Counters] = {}
+
+    def counter(self, endpoint: str) -> _Counters:
+        with self.lock:
+            if endpoint not in self.counters:
+                self.counters[endpoint] = _Counters()
+            return self.counters[endpoint]
+
+    def ensure(self, size: int) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        # 名额数在进程启动时确定；事件循环变化（例如测试中多次启动应用）时重新创建
+        if self.semaphore is None or self.loop is not loop:
+            self.semaphore = asyncio.Semaphore(size)
+            self.loop = loop
+            self.running = 0
+        return self.semaphore
+
+
+_GOVERNOR = _Governor()
+
+
+class Slot:
+    """一个执行名额；release() 可重复调用，也可以在线程池线程中调用（例如导出流结束时）"""
+
+    def __init__(self, semaphore: Optional[asyncio.Semaphore], loop: Optional[asyncio.AbstractEventLoop]):
+        self._semaphore = semaphore
+        self._loop = loop
+        self._released = semaphore is None
+
+    def _release(self):
+        _GOVERNOR.running -= 1
+        self._semaphore.release()
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._release()
+        else:
+            self._loop.call_soon_threadsafe(self._release)
+
+
+async def admit(endpoint: str) -> Slot:
+    """取得一个执行名额；队列已满抛出 QueryRejected(429)，排队超时抛出 QueryRejected(503)"""
+    size = max_concurrency()
+    if size <= 0:
+        return Slot(None, None)
+    semaphore = _GOVERNOR.ensure(size)
+    counter = _GOVERNOR.counter(endpoint)
+    if semaphore.locked():
+        if _GOVERNOR.waiting >= _int_env("QUERY_QUEUE_SIZE", 16):
+            counter.rejected_queue_full += 1
+            raise QueryRejected(429, "too many concurrent stats queries")
+        counter.queued += 1
+        _GOVERNOR.waiting += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=_float_env("QUERY_QUEUE_TIMEOUT_SEC", 10.0))
+        except asyncio.TimeoutError:
+            counter.rejected_wait_timeout += 1
+            raise QueryRejected(503, "stats queries are saturated, timed out waiting for a slot")
+        finally:
+            _GOVERNOR.waiting -= 1
+            waited = (time.perf_counter() - started) * 1000
+            counter.wait_ms_total += waited
+            counter.wait_ms_max = max(counter.wait_ms_max, waited)
+    else:
+        await semaphore.acquire()
+    counter.admitted += 1
+    _GOVERNOR.running += 1
+    return Slot(semaphore, _GOVERNOR.loop)
+
+
+@contextlib.asynccontextmanager
+async def slot(endpoint: str):
+    """async with governor.slot("winrate"): ... —— 在名额内执行，退出时归还"""
+    held = await admit(endpoint)
+    try:
+        yield held
+    finally:
+        held.release()
+
+
+def apply_timeout(db: Session, endpoint: str):
+    """在当前事务中设置 statement_timeout（SET LOCAL，事务结束即恢复，不影响连接池中的其他请求）"""
+    ms = statement_timeout_ms(endpoint)
+    if ms > 0:
+        db.execute(text("SELECT set_config('statement_timeout', :ms, true)"), {"ms": str(ms)})
+
+
+def with_timeout(endpoint: str, fn: Callable) -> Callable:
+    """包装查询函数 fn(db, ..., read_db=None)：执行前在主库与副本会话上设置该接口的 statement_timeout"""
+    def run(db: Session, *args, **kwargs):
+        apply_timeout(db, endpoint)
+        if kwargs.get("read_db") is not None:
+            apply_timeout(kwargs["read_db"], endpoint)
+        return fn(db, *args, **kwargs)
+    return run
+
+
+def is_statement_timeout(exc: BaseException) -> bool:
+    """是否为 statement_timeout 取消的查询（SQLSTATE 57014；客户端断开导致的取消不算）"""
+    orig = getattr(exc, "orig", None) or exc
+    code = getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None) \
+        or getattr(getattr(orig, "__cause__", None), "sqlstate", None)
+    return code == "57014" and "statement timeout" in str(exc)
+
+
+def record_statement_timeout(endpoint: str):
+    _GOVERNOR.counter(endpoint).statement_timeouts += 1
+
+
+def status() -> Dict[str, object]:
+    with _GOVERNOR.lock:
+        endpoints = {
+            name: {
+                "admitted": c.admitted,
+                "queued": c.queued,
+                "rejected_queue_full": c.rejected_queue_full,
+                "rejected_wait_timeout": c.rejected_wait_timeout,
+                "statement_timeouts": c.statement_timeouts,
+                "avg_wait_ms": c.wait_ms_total / c.queued if c.queued else 0.0,
+                "max_wait_ms": c.wait_ms_max,
+            }
+            for name, c in _GOVERNOR.counters.items()
+        }
+    return {
+        "max_concurrency": max_concurrency(),
+        "queue_size": _int_env("QUERY_QUEUE_SIZE", 16),
+        "queue_timeout_sec": _float_env("QUERY_QUEUE_TIMEOUT_SEC", 10.0),
+        "running": _GOVERNOR.running,
+        "waiting": _GOVERNOR.waiting,
+        "statement_timeout_ms": {name: statement_timeout_ms(name) for name in _DEFAULT_TIMEOUT_MS},
+        "endpoints": endpoints,
+    }
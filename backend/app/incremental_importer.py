@@ -1,103 +1,32 @@
 """
 增量导入模块 - 支持追加日志文件的增量导入
-记录每个文件的导入位置，只导入新增内容
+记录每个文件的导入位置（数据库 import_checkpoints 表），只导入新增内容
 """
 import os
 import json
 import hashlib
+import threading
+import time
 from typing import List, Iterable, Set, Optional, Tuple
 from pathlib import Path
-import re
 
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 
 from backend.app.database import SessionLocal
-from backend.app.models import MatchRecord
+from backend.app.checkpoints import delete_checkpoints, load_checkpoints, save_checkpoint
+from backend.app.copy_loader import flush_rows, record_rows, report_throughput
+from backend.app.log_decoder import decode_record, robust_json_load
+from backend.app.log_files import is_compressed, is_log_file, open_log_binary, skip_to, uncompressed_size
 
 
-_ST_FIX_RE = re.compile(r'("source_type"\s*:\s*)(gold_league|season_play_pvp_mgr|qualifying_wheel_first_combat)\b')
-
-# 导入位置记录文件（JSON格式）
+# 旧版导入位置记录文件（JSON格式），首次运行时迁移到数据库
 _POSITION_FILE = ".import_positions.json"
 
+# 用于识别文件被替换的文件头长度
+_HEAD_BYTES = 1024
 
-def _robust_json_load(line: str) -> Optional[dict]:
-    """Try strict JSON first; if failed, fix known patterns then retry."""
-    try:
-        return json.loads(line)
-    except Exception:
-        pass
-    fixed = _ST_FIX_RE.sub(lambda m: f"{m.group(1)}\"{m.group(2)}\"", line)
-    if fixed != line:
-        try:
-            return json.loads(fixed)
-        except Exception:
-            return None
-    return None
-
-
-def _normalize_keys(obj: dict) -> dict:
-    """Map alternate field names to model fields"""
-    if "spirit_animal" not in obj and "pet_list" in obj:
-        obj["spirit_animal"] = obj.get("pet_list")
-    if "spirit_animal_talents" not in obj and "pet_talent_list" in obj:
-        obj["spirit_animal_talents"] = obj.get("pet_talent_list")
-    if "legendary_runes" not in obj and "rune_list" in obj:
-        obj["legendary_runes"] = obj.get("rune_list")
-    if "super_armor" not in obj and "armor" in obj:
-        obj["super_armor"] = obj.get("armor")
-    return obj
-
-
-def _get_source_types(value, obj) -> List[int]:
-    """获取数据源类型列表（可能返回多个类型）"""
-    result = []
-    if isinstance(value, int):
-        return [value]
-    if isinstance(value, str):
-        v = value.strip().lower()
-        is_win_val = obj.get("is_win")
-        has_valid_win = is_win_val is not None and is_win_val in (0, 1)
-        duration_val = obj.get("duration")
-        has_valid_duration = (duration_val is not None 
-                             and duration_val is not False 
-                             and isinstance(duration_val, (int, float)) 
-                             and duration_val > 0)
-        
-        if v in {"gold_league", "gold-league", "champion_league", "goldleague"}:
-            if has_valid_win:
-                result.append(1)
-            if has_valid_duration:
-                result.append(4)
-            if not result:
-                result.append(1)
-        elif v in {"season_play_pvp_mgr", "season", "ladder", "pvp_ladder"}:
-            if has_valid_win:
-                result.append(3)
-            if has_valid_duration:
-                result.append(6)
-            if not result:
-                result.append(3)
-        elif v in {"qualifying_wheel_first_combat", "qualifying-wheel-first-combat", "wheel_first"}:
-            if has_valid_win:
-                result.append(2)
-            if has_valid_duration:
-                result.append(5)
-            if not result:
-                result.append(2)
-        else:
-            try:
-                result.append(int(value))
-            except Exception:
-                result.append(0)
-    else:
-        try:
-            result.append(int(value))
-        except Exception:
-            result.append(0)
-    
-    return result if result else [0]
+_IMPORT_LOCK = threading.Lock()
 
 
 def _parse_exclude_servers() -> Set[int]:
@@ -115,177 +44,307 @@ def _parse_exclude_servers() -> Set[int]:
     return result
 
 
-def _load_positions(logs_dir: str) -> dict:
-    """加载导入位置记录"""
+def _get_file_key(file_path: str, logs_dir: str) -> str:
+    """生成文件的唯一标识：相对 logs_dir 的路径（统一使用 / 分隔）"""
+    rel = os.path.relpath(os.path.abspath(file_path), os.path.abspath(logs_dir))
+    return rel.replace(os.sep, '/')
+
+
+def _legacy_file_key(file_path: str) -> str:
+    """旧版 .import_positions.json 使用的文件标识（绝对路径的哈希）"""
+    abs_path = os.path.abspath(file_path)
+    return hashlib.md5(abs_path.encode('utf-8')).hexdigest()
+
+
+def _migrate_legacy_positions(db: Session, logs_dir: str) -> dict:
+    """把旧版 .import_positions.json 迁移到 import_checkpoints 表，迁移后文件重命名为 .migrated"""
     pos_file = os.path.join(logs_dir, _POSITION_FILE)
-    if os.path.exists(pos_file):
+    if not os.path.exists(pos_file):
+        return {}
+    try:
+        with open(pos_file, 'r', encoding='utf-8') as f:
+            legacy = json.load(f)
+    except Exception:
+        return {}
+
+    positions = {}
+    for src in _iter_log_files(logs_dir):
+        state = legacy.get(_legacy_file_key(src))
+        if state is None:
+            continue
         try:
-            with open(pos_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return {}
-    return {}
+            st = os.stat(src)
+        except OSError:
+            continue
+        if isinstance(state, int):
+            # 最早的格式记录的是已导入行数；文件可能在此之后又有追加，因此不记录 size/mtime，下次导入时从该偏移继续
+            offset = _line_count_to_offset(src, state)
+            state = dict(_file_state(src, st, offset), size=offset, mtime_ns=None)
+        positions[_get_file_key(src, logs_dir)] = state
+        save_checkpoint(db, _get_file_key(src, logs_dir), state)
+    db.commit()
+    try:
+        os.replace(pos_file, pos_file + '.migrated')
+    except OSError as e:
+        print(f"Warning: Failed to rename {pos_file}: {e}")
+    print(f"已将 {len(positions)} 个文件的导入位置从 {pos_file} 迁移到数据库")
+    return positions
 
 
-def _save_positions(logs_dir: str, positions: dict):
-    """保存导入位置记录"""
-    pos_file = os.path.join(logs_dir, _POSITION_FILE)
+def _load_positions(db: Session, logs_dir: str) -> dict:
+    """加载导入位置记录（数据库 import_checkpoints 表）；表为空时尝试迁移旧版位置文件"""
+    positions = load_checkpoints(db)
+    if not positions:
+        positions = _migrate_legacy_positions(db, logs_dir)
+    return positions
+
+
+def _read_head(file_path: str, length: int) -> str:
+    """文件开头 length 字节的 MD5，用于识别同名文件被替换"""
     try:
-        with open(pos_file, 'w', encoding='utf-8') as f:
-            json.dump(positions, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        print(f"Warning: Failed to save positions: {e}")
+        with open(file_path, 'rb') as f:
+            return hashlib.md5(f.read(length)).hexdigest()
+    except Exception:
+        return ""
 
 
-def _get_file_key(file_path: str) -> str:
-    """生成文件的唯一标识（使用绝对路径的哈希）"""
-    abs_path = os.path.abspath(file_path)
-    return hashlib.md5(abs_path.encode('utf-8')).hexdigest()
+def _file_state(file_path: str, st: os.stat_result, offset: int) -> dict:
+    """生成位置记录：字节偏移 + inode/size/mtime + 文件头指纹"""
+    head_len = min(_HEAD_BYTES, st.st_size)
+    return {
+        "offset": offset,
+        "inode": st.st_ino,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "head_len": head_len,
+        "head": _read_head(file_path, head_len),
+    }
 
 
-def _read_lines_from_position(file_path: str, start_position: int) -> Iterable[Tuple[int, str]]:
-    """从指定位置读取文件行，返回 (行号, 内容)"""
+def _line_count_to_offset(file_path: str, lines: int) -> int:
+    """旧版位置记录（行号）转换为字节偏移，仅在首次迁移时执行一次"""
+    offset = 0
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            # 如果 start_position > 0，跳过已读取的行
-            for _ in range(start_position):
-                try:
-                    f.readline()
-                except Exception:
+        with open_log_binary(file_path) as f:
+            for _ in range(lines):
+                raw = f.readline()
+                if not raw:
                     break
-            
-            # 读取剩余行
-            line_num = start_position
-            while True:
-                line = f.readline()
-                if not line:
+                offset += len(raw)
+    except Exception:
+        return 0
+    return offset
+
+
+def _resume_offset(file_path: str, st: os.stat_result, state) -> Optional[int]:
+    """根据位置记录判断本次应从哪个字节偏移开始导入
+
+    返回 None 表示文件未变化（只需一次 stat()）；
+    文件被截断、轮转或替换时返回 0，从头重新读取。
+    压缩文件的 offset 是解压后的偏移，inode/size/mtime/文件头取的是压缩文件本身
+    """
+    if state is None:
+        return 0
+
+    offset = int(state.get("offset", 0))
+    if st.st_ino != state.get("inode"):
+        print(f"检测到 {file_path} 已被轮转或替换（inode 变化），从头导入")
+        return 0
+    if st.st_size < (state.get("size") or 0) or (not is_compressed(file_path) and st.st_size < offset):
+        print(f"检测到 {file_path} 已被截断，从头导入")
+        return 0
+    if st.st_size == state.get("size") and st.st_mtime_ns == state.get("mtime_ns"):
+        return None
+    head_len = int(state.get("head_len") or 0)
+    if head_len and _read_head(file_path, head_len) != state.get("head"):
+        print(f"检测到 {file_path} 内容已被替换，从头导入")
+        return 0
+    return offset
+
+
+def _read_lines_from_offset(file_path: str, start_offset: int, end_offset: Optional[int] = None,
+                            status: Optional[dict] = None) -> Iterable[Tuple[int, str]]:
+    """从指定字节偏移读取完整的行，返回 (该行结束处的字节偏移, 内容)
+
+    end_offset 为分块导入时的块结束位置（必须位于行首），None 表示读到文件末尾；
+    文件末尾没有换行符的行可能仍在写入，只有能解析为 JSON 时才读取，否则留到下次导入。
+    压缩文件流式解压，偏移为解压后的字节数；仍在写入的 .gz 读到最后一个完整的行为止。
+    status 不为空时记录是否完整读完该范围：status["complete"] 为 False 表示 .gz 不完整或读取出错，
+    调用方不能据此认为文件已全部导入
+    """
+    if status is not None:
+        status["complete"] = False
+    try:
+        with open_log_binary(file_path) as f:
+            skip_to(f, start_offset, is_compressed(file_path))
+            offset = start_offset
+            for raw in f:
+                if end_offset is not None and offset >= end_offset:
+                    break
+                line = raw.decode('utf-8', errors='replace').rstrip('\n\r')
+                if not raw.endswith(b'\n') and robust_json_load(line) is None:
                     break
-                yield (line_num, line.rstrip('\n\r'))
-                line_num += 1
+                offset += len(raw)
+                yield (offset, line)
+        if status is not None:
+            status["complete"] = True
+    except EOFError:
+        # gzip 流还没有写完（缺少结束标记），已读到的完整行照常导入，剩余部分留到下次
+        return
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
 
 
-def _bulk_insert_incremental(db: Session, file_path: str, start_line: int, batch_size: int = 2000) -> int:
-    """增量导入：从指定行号开始导入"""
+def _bulk_insert_incremental(db: Session, file_path: str, start_offset: int, batch_size: int = 2000,
+                             end_offset: Optional[int] = None,
+                             checkpoint: Optional[Tuple[str, dict]] = None,
+                             status: Optional[dict] = None) -> Tuple[int, int]:
+    """增量导入：导入 [start_offset, end_offset) 范围内的行，返回 (导入行数, 新的字节偏移)
+
+    checkpoint 为 (file_key, 文件状态) 时，每个批次提交前在同一事务中把位置记录更新到该批次最后一行之后；
+    status 见 _read_lines_from_offset（是否完整读完该范围）
+    """
     count = 0
-    buf: List[MatchRecord] = []
+    last_offset = start_offset
+    buf: List[tuple] = []
     exclude_servers = _parse_exclude_servers()
+
+    def _flush():
+        before_commit = None
+        if checkpoint is not None:
+            file_key, state = checkpoint
+            state = dict(state, offset=last_offset)
+            before_commit = lambda s: save_checkpoint(s, file_key, state)
+        return flush_rows(db, buf, before_commit=before_commit)
     
-    for line_num, line in _read_lines_from_position(file_path, start_line):
+    for last_offset, line in _read_lines_from_offset(file_path, start_offset, end_offset, status):
         if not line.strip():
             continue
         
-        obj = _robust_json_load(line)
-        if obj is None:
+        rec = decode_record(line)
+        if rec is None:
             continue
         
-        obj = _normalize_keys(obj)
-        
         # server 过滤
-        try:
-            server_val = int(obj.get("server"))
-        except Exception:
-            continue
-        if server_val in exclude_servers:
+        if rec.server in exclude_servers:
             continue
         
-        # source_type 规范化
-        source_types = _get_source_types(obj.get("source_type"), obj)
-        
-        # 为每个 source_type 创建一条记录
-        for source_type in source_types:
-            buf.append(MatchRecord(
-                server=obj["server"],
-                timestamp=obj["timestamp"],
-                level=obj["level"],
-                clazz=obj["class"],
-                schools=obj["schools"],
-                opponent_class=obj.get("opponent_class", 0),
-                opponent_schools=obj.get("opponent_schools", 0),
-                is_win=obj.get("is_win", 0),
-                duration=obj.get("duration", 0),
-                spirit_animal=obj.get("spirit_animal"),
-                spirit_animal_talents=obj.get("spirit_animal_talents"),
-                legendary_runes=obj.get("legendary_runes"),
-                super_armor=obj.get("super_armor"),
-                source_type=source_type,
-                score_ratio=obj.get("score_ratio", 0),
-            ))
+        # source_type 规范化：单行存储时一条日志一行，拆分存储时每个 source_type 一行
+        try:
+            rows = record_rows(rec, line)
+        except (ValueError, TypeError):
+            continue
+        buf.extend(rows)
         
         if len(buf) >= batch_size:
-            db.bulk_save_objects(buf)
-            db.commit()
-            count += len(buf)
+            count += _flush()
             buf.clear()
     
-    if buf:
-        db.bulk_save_objects(buf)
-        db.commit()
-        count += len(buf)
+    # 最后一批（没有剩余数据时也要把位置推进到被过滤掉的尾部行之后）
+    if buf or checkpoint is not None:
+        count += _flush()
     
-    return count
+    return count, last_offset
 
 
-def _count_file_lines(file_path: str) -> int:
-    """统计文件总行数"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return sum(1 for _ in f)
-    except Exception:
-        return 0
+def _iter_log_files(logs_dir: str, paths: Optional[Iterable[str]] = None) -> Iterable[str]:
+    """遍历 logs_dir 下的日志文件；给定 paths 时只返回其中仍存在的日志文件"""
+    if paths is not None:
+        for src in sorted(set(paths)):
+            if is_log_file(os.path.basename(src)) and os.path.isfile(src):
+                yield src
+        return
+    for root, _, files in os.walk(logs_dir):
+        for f in files:
+            if is_log_file(f):
+                yield os.path.join(root, f)
 
 
-def run_incremental_import(logs_dir: str = None) -> int:
+def run_incremental_import(logs_dir: str = None, workers: Optional[int] = None,
+                           paths: Optional[Iterable[str]] = None) -> int:
     """增量导入：只导入文件的新增内容
     
     工作原理：
-    1. 读取 .import_positions.json 记录每个文件上次导入的行号
-    2. 对于每个日志文件，从上次位置继续导入
-    3. 更新位置记录
+    1. 读取 import_checkpoints 表中每个文件上次导入的字节偏移及 inode/size/mtime
+    2. 文件未变化时只做一次 stat() 即跳过；否则 seek() 到上次偏移继续导入
+    3. 文件被截断、轮转或替换时从头重新导入
+    4. 每个批次的数据与位置记录在同一事务中提交
+
+    workers（默认取 IMPORT_WORKERS）大于 1 时使用多进程并行导入；
+    paths 不为空时只检查这些文件（文件监听模式），否则扫描整个目录。
+    定时任务、文件监听与手动触发共用一把锁，同一进程内不会并发导入
     """
     logs_dir = logs_dir or os.environ.get('IMPORT_DIR', 'data_logs')
     if not os.path.isdir(logs_dir):
         return 0
     
-    positions = _load_positions(logs_dir)
+    with _IMPORT_LOCK:
+        from backend.app.parallel_importer import resolve_workers, run_parallel_incremental
+        workers = resolve_workers(workers)
+        if workers > 1:
+            return run_parallel_incremental(logs_dir, workers, paths)
+        return _run_incremental(logs_dir, paths)
+
+
+def _run_incremental(logs_dir: str, paths: Optional[Iterable[str]] = None) -> int:
     total_imported = 0
+    started = time.perf_counter()
     
     with SessionLocal() as db:
-        for root, _, files in os.walk(logs_dir):
-            for f in files:
-                if not (f.endswith('.jsonl') or f.endswith('.txt')):
-                    continue
-                
-                src = os.path.join(root, f)
-                file_key = _get_file_key(src)
-                
-                # 获取上次导入位置（默认为0，从头开始）
-                last_position = positions.get(file_key, 0)
-                
-                # 获取文件当前总行数
-                current_lines = _count_file_lines(src)
-                
-                # 如果文件没有新内容，跳过
-                if current_lines <= last_position:
-                    continue
-                
-                print(f"导入 {src} (从第 {last_position + 1} 行到第 {current_lines} 行)...")
-                
-                # 增量导入
-                imported = _bulk_insert_incremental(db, src, last_position, batch_size=2000)
-                total_imported += imported
-                
-                # 更新位置记录
-                positions[file_key] = current_lines
-                print(f"  已导入 {imported} 条记录，文件位置已更新到第 {current_lines} 行")
-        
-        # 保存位置记录
-        _save_positions(logs_dir, positions)
+        positions = _load_positions(db, logs_dir)
+        for src in _iter_log_files(logs_dir, paths):
+            file_key = _get_file_key(src, logs_dir)
+            try:
+                st = os.stat(src)
+            except OSError:
+                continue
+            
+            # 获取本次起始偏移；None 表示文件没有新内容
+            start_offset = _resume_offset(src, st, positions.get(file_key))
+            if start_offset is None:
+                continue
+            # size/mtime 取读取前的 stat，读取期间追加的内容下次仍会被检测到
+            state = _file_state(src, st, start_offset)
+            if start_offset >= st.st_size and not is_compressed(src):
+                save_checkpoint(db, file_key, state)
+                db.commit()
+                continue
+            
+            if is_compressed(src):
+                print(f"导入 {src} (从解压后第 {start_offset} 字节开始)...")
+            else:
+                print(f"导入 {src} (从第 {start_offset} 字节到第 {st.st_size} 字节)...")
+            
+            # 增量导入，位置记录随每个批次一起提交
+            imported, end_offset = _bulk_insert_incremental(db, src, start_offset, batch_size=2000,
+                                                            checkpoint=(file_key, state))
+            total_imported += imported
+            print(f"  已导入 {imported} 条记录，文件位置已更新到第 {end_offset} 字节")
     
+    report_throughput("增量导入", total_imported, started)
     return total_imported
 
 
+def mark_files_imported(logs_dir: str = None) -> int:
+    """把所有日志文件标记为已完全导入（位置记录指向当前文件末尾），返回文件数"""
+    logs_dir = logs_dir or os.environ.get('IMPORT_DIR', 'data_logs')
+    file_count = 0
+    with SessionLocal() as db:
+        for src in _iter_log_files(logs_dir):
+            try:
+                st = os.stat(src)
+            except OSError:
+                continue
+            if st.st_size == 0:
+                continue
+            size = uncompressed_size(src)
+            save_checkpoint(db, _get_file_key(src, logs_dir), _file_state(src, st, size))
+            print(f"  标记文件: {src} (共 {size} 字节)")
+            file_count += 1
+        db.commit()
+    return file_count
+
+
 def reset_import_positions(logs_dir: str = None, file_pattern: str = None):
     """重置导入位置（用于重新导入）
     
@@ -294,24 +353,24 @@ def reset_import_positions(logs_dir: str = None, file_pattern: str = None):
         file_pattern: 可选的文件名模式（如 "2025_11_13.txt"），只重置匹配的文件
     """
     logs_dir = logs_dir or os.environ.get('IMPORT_DIR', 'data_logs')
-    positions = _load_positions(logs_dir)
     
-    if file_pattern:
-        # 只重置匹配的文件
-        for root, _, files in os.walk(logs_dir):
-            for f in files:
-                if file_pattern in f:
-                    src = os.path.join(root, f)
-                    file_key = _get_file_key(src)
+    with SessionLocal() as db:
+        if file_pattern:
+            # 只重置匹配的文件
+            positions = load_checkpoints(db)
+            keys = []
+            for src in _iter_log_files(logs_dir):
+                if file_pattern in os.path.basename(src):
+                    file_key = _get_file_key(src, logs_dir)
                     if file_key in positions:
-                        del positions[file_key]
+                        keys.append(file_key)
                         print(f"已重置 {src} 的导入位置")
-    else:
-        # 重置所有文件
-        positions.clear()
-        print("已重置所有文件的导入位置")
-    
-    _save_positions(logs_dir, positions)
+            delete_checkpoints(db, keys)
+        else:
+            # 重置所有文件
+            delete_checkpoints(db)
+            print("已重置所有文件的导入位置")
+        db.commit()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,15 @@
 import argparse
-import json
 import os
-from typing import List, Set, Optional
+import queue
+import threading
+import time
+from typing import Iterable, Iterator, List, Set
 
 from sqlalchemy.orm import Session
 from backend.app.database import SessionLocal, engine, Base
-from backend.app.models import MatchRecord
-import re
+from backend.app.copy_loader import flush_rows, insert_rows, record_rows, report_throughput
+from backend.app.log_decoder import decode_lines
+from backend.app.log_files import is_log_file, open_log_text
 
 
 def ensure_tables():
@@ -28,193 +31,110 @@ def _parse_exclude_servers() -> Set[int]:
     return result
 
 
-def _get_source_types(value, obj) -> List[int]:
-    """获取数据源类型列表（可能返回多个类型）
-    - 数据源同时包含 is_win 和 duration 字段时，返回两个类型
-    - 计算胜率时使用 is_win 字段：
-      * gold_league -> 1 (冠军联赛胜率)
-      * season -> 3 (决斗天梯胜率)
-      * qualifying_wheel_first_combat -> 2 (武道大会(车轮战首场)胜率)
-    - 计算时长时使用 duration 字段：
-      * gold_league -> 4 (冠军联赛战斗时长)
-      * season -> 6 (决斗天梯战斗时长)
-      * qualifying_wheel_first_combat -> 5 (武道大会(车轮战首场)战斗时长)
-    - 返回列表，可能包含一个或两个类型
-    """
-    result = []
-    if isinstance(value, int):
-        return [value]
-    if isinstance(value, str):
-        v = value.strip().lower()
-        # 检查 is_win 是否有效：不为 None 且为 0 或 1
-        is_win_val = obj.get("is_win")
-        has_valid_win = is_win_val is not None and is_win_val in (0, 1)
-        # 检查 duration 是否有效：不为 None，不为 False，且 > 0
-        duration_val = obj.get("duration")
-        has_valid_duration = (duration_val is not None 
-                             and duration_val is not False 
-                             and isinstance(duration_val, (int, float)) 
-                             and duration_val > 0)
-        
-        if v in {"gold_league", "gold-league", "champion_league", "goldleague"}:
-            # 如果 is_win 有效，添加胜率类型
-            if has_valid_win:
-                result.append(1)
-            # 如果 duration 有效，添加时长类型
-            if has_valid_duration:
-                result.append(4)
-            # 如果两个都无效，默认返回胜率类型
-            if not result:
-                result.append(1)
-        elif v in {"season_play_pvp_mgr", "season", "ladder", "pvp_ladder"}:
-            # 如果 is_win 有效，添加胜率类型
-            if has_valid_win:
-                result.append(3)
-            # 如果 duration 有效，添加时长类型
-            if has_valid_duration:
-                result.append(6)
-            # 如果两个都无效，默认返回胜率类型
-            if not result:
-                result.append(3)
-        elif v in {"qualifying_wheel_first_combat", "qualifying-wheel-first-combat", "wheel_first"}:
-            # 如果 is_win 有效，添加胜率类型
-            if has_valid_win:
-                result.append(2)
-            # 如果 duration 有效，添加时长类型
-            if has_valid_duration:
-                result.append(5)
-            # 如果两个都无效，默认返回胜率类型
-            if not result:
-                result.append(2)
-        else:
-            # 未知类型，尝试转换为整数
-            try:
-                result.append(int(value))
-            except Exception:
-                result.append(0)
-    else:
-        try:
-            result.append(int(value))
-        except Exception:
-            result.append(0)
-    
-    return result if result else [0]
+def _iter_log_paths(logs_dir: str) -> Iterator[str]:
+    for root, _, files in os.walk(logs_dir):
+        for f in files:
+            if is_log_file(f):
+                yield os.path.join(root, f)
 
 
-def _normalize_source_type(value, obj) -> int:
-    """规范化数据源类型（兼容旧代码，返回第一个类型）"""
-    types = _get_source_types(value, obj)
-    return types[0] if types else 0
+def load_jsonl_files(logs_dir: str) -> Iterator[tuple]:
+    """流式读取 logs_dir 下的所有日志，逐条产出按 COPY_COLUMNS 排列的记录元组
 
+    读取、解析、过滤、按 source_type 拆分都是逐行进行的，不会把整个目录载入内存；
+    .gz / .zst 压缩文件边读边解压
+    """
+    exclude_servers = _parse_exclude_servers()
+    for path in _iter_log_paths(logs_dir):
+        with open_log_text(path) as fp:
+            for line, rec in decode_lines(fp):
+                # server 过滤
+                if rec.server in exclude_servers:
+                    continue
+                # 映射 source_type：单行存储时一条日志一行，拆分存储时每个类型（胜率和时长）一行
+                try:
+                    rows = record_rows(rec, line)
+                except (ValueError, TypeError):
+                    continue
+                yield from rows
+
+
+def iter_batches(rows: Iterable[tuple], batch_size: int = 2000) -> Iterator[List[tuple]]:
+    buf: List[tuple] = []
+    for row in rows:
+        buf.append(row)
+        if len(buf) >= batch_size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
 
-_ST_FIX_RE = re.compile(r'("source_type"\s*:\s*)(gold_league|season_play_pvp_mgr|qualifying_wheel_first_combat)\b')
 
+def bulk_insert(db: Session, rows: Iterable[tuple], batch_size: int = 2000) -> int:
+    return insert_rows(db, rows, batch_size)
 
-def _robust_json_load(line: str) -> Optional[dict]:
-    """Try strict JSON first; if failed, fix known patterns then retry."""
-    try:
-        return json.loads(line)
-    except Exception:
-        pass
-    # Fix unquoted source_type tokens
-    fixed = _ST_FIX_RE.sub(lambda m: f"{m.group(1)}\"{m.group(2)}\"", line)
-    if fixed != line:
-        try:
-            return json.loads(fixed)
-        except Exception:
-            return None
-    return None
 
+_DONE = object()
 
-def _normalize_keys(obj: dict) -> dict:
-    # Map alternate field names to model fields
-    if "spirit_animal" not in obj and "pet_list" in obj:
-        obj["spirit_animal"] = obj.get("pet_list")
-    if "spirit_animal_talents" not in obj and "pet_talent_list" in obj:
-        obj["spirit_animal_talents"] = obj.get("pet_talent_list")
-    if "legendary_runes" not in obj and "rune_list" in obj:
-        obj["legendary_runes"] = obj.get("rune_list")
-    if "super_armor" not in obj and "armor" in obj:
-        obj["super_armor"] = obj.get("armor")
-    return obj
 
+def run_pipeline(db: Session, logs_dir: str, batch_size: int = 2000, queue_depth: int = 4) -> int:
+    """流水线导入：解析线程产出批次，经过最多 queue_depth 个批次的有界队列交给写入端
 
-def load_jsonl_files(logs_dir: str) -> List[dict]:
-    records = []
-    exclude_servers = _parse_exclude_servers()
-    for root, _, files in os.walk(logs_dir):
-        for f in files:
-            if not (f.endswith('.jsonl') or f.endswith('.txt')):
+    内存占用上限约为 (queue_depth + 2) * batch_size 条记录，与输入总量无关
+    """
+    batches: "queue.Queue" = queue.Queue(maxsize=max(1, queue_depth))
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def _put(item) -> bool:
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.5)
+                return True
+            except queue.Full:
                 continue
-            path = os.path.join(root, f)
-            with open(path, 'r', encoding='utf-8') as fp:
-                for line in fp:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        obj = _robust_json_load(line)
-                        if obj is None:
-                            continue
-                        obj = _normalize_keys(obj)
-                        # server 过滤
-                        try:
-                            server_val = int(obj.get("server"))
-                        except Exception:
-                            continue
-                        if server_val in exclude_servers:
-                            continue
-                        # 映射 source_type - 可能返回多个类型（胜率和时长）
-                        # 为每个类型创建一条记录
-                        source_types = _get_source_types(obj.get("source_type"), obj)
-                        for source_type in source_types:
-                            obj_copy = obj.copy()
-                            obj_copy["source_type"] = source_type
-                            records.append(obj_copy)
-                    except Exception:
-                        continue
-    return records
-
-
-def bulk_insert(db: Session, rows: List[dict], batch_size: int = 2000):
-    buf = []
-    for obj in rows:
-        buf.append(MatchRecord(
-            server=obj["server"],
-            timestamp=obj["timestamp"],
-            level=obj["level"],
-            clazz=obj["class"],
-            schools=obj["schools"],
-            opponent_class=obj["opponent_class"],
-            opponent_schools=obj["opponent_schools"],
-            is_win=obj.get("is_win", 0),
-            duration=obj.get("duration", 0),
-            spirit_animal=obj.get("spirit_animal"),
-            spirit_animal_talents=obj.get("spirit_animal_talents"),
-            legendary_runes=obj.get("legendary_runes"),
-            super_armor=obj.get("super_armor"),
-            source_type=obj.get("source_type", 0),
-            score_ratio=obj.get("score_ratio", 0),
-        ))
-        if len(buf) >= batch_size:
-            db.bulk_save_objects(buf)
-            db.commit()
-            buf.clear()
-    if buf:
-        db.bulk_save_objects(buf)
-        db.commit()
+        return False
+
+    def _produce():
+        try:
+            for batch in iter_batches(load_jsonl_files(logs_dir), batch_size):
+                if not _put(batch):
+                    return
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            _put(_DONE)
+
+    producer = threading.Thread(target=_produce, name="ingestion-parser", daemon=True)
+    producer.start()
+    count = 0
+    try:
+        while True:
+            batch = batches.get()
+            if batch is _DONE:
+                break
+            count += flush_rows(db, batch)
+    finally:
+        stop.set()
+        producer.join()
+    if errors:
+        raise errors[0]
+    return count
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--logs_dir', type=str, required=True)
+    parser.add_argument('--batch_size', type=int, default=2000, help='每批写入的记录数')
+    parser.add_argument('--queue_depth', type=int, default=4, help='解析与写入之间最多缓冲的批次数')
     args = parser.parse_args()
 
     ensure_tables()
-    rows = load_jsonl_files(args.logs_dir)
+    started = time.perf_counter()
     with SessionLocal() as db:
-        bulk_insert(db, rows)
-    print(f"Imported {len(rows)} rows.")
+        count = run_pipeline(db, args.logs_dir, batch_size=args.batch_size, queue_depth=args.queue_depth)
+    report_throughput("导入", count, started)
+    print(f"Imported {count} rows.")
 
 
 if __name__ == '__main__':
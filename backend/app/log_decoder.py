@@ -0,0 +1,221 @@
+"""
+日志行解码模块 - 三个导入入口共用的快速 JSON 解码
+优先使用 orjson / msgspec（已安装时），否则回退到标准库 json；
+已知的 source_type 未加引号问题在解析前用廉价的预检识别并修复，避免“解析失败 -> 正则修复 -> 再解析”
+"""
+import json
+import os
+import re
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+
+_ST_FIX_RE = re.compile(r'("source_type"\s*:\s*)(gold_league|season_play_pvp_mgr|qualifying_wheel_first_combat)\b')
+_ST_UNQUOTED_RE = re.compile(r'"source_type"\s*:\s*[A-Za-z_]')
+
+
+def _load_backend(name: str) -> Optional[Callable[[str], Any]]:
+    if name == "orjson":
+        try:
+            import orjson
+        except ImportError:
+            return None
+        return orjson.loads
+    if name == "msgspec":
+        try:
+            import msgspec
+        except ImportError:
+            return None
+        return msgspec.json.Decoder().decode
+    if name == "json":
+        return json.loads
+    return None
+
+
+def _select_backend() -> str:
+    preferred = os.environ.get("LOG_JSON_BACKEND", "").strip().lower()
+    candidates = [preferred] if preferred else []
+    candidates += ["orjson", "msgspec", "json"]
+    for name in candidates:
+        if _load_backend(name) is not None:
+            return name
+    return "json"
+
+
+BACKEND = _select_backend()
+_loads = _load_backend(BACKEND)
+
+
+class LogRecord(NamedTuple):
+    """一条日志解码后的紧凑记录（字段名已规范化为模型字段名）
+
+    is_win / duration 保留原始值（缺失为 None），source_type 拆分时需要判断其有效性
+    """
+    server: int
+    timestamp: Any
+    level: Any
+    clazz: Any
+    schools: Any
+    opponent_class: Any
+    opponent_schools: Any
+    is_win: Any
+    duration: Any
+    spirit_animal: Any
+    spirit_animal_talents: Any
+    legendary_runes: Any
+    super_armor: Any
+    source_type: Any
+    score_ratio: Any
+
+
+def needs_repair(line: str) -> bool:
+    """廉价预检：source_type 的值是否是未加引号的标识符（一次 C 层正则扫描，不抛异常）"""
+    return _ST_UNQUOTED_RE.search(line) is not None
+
+
+def _repair(line: str) -> str:
+    return _ST_FIX_RE.sub(lambda m: f"{m.group(1)}\"{m.group(2)}\"", line)
+
+
+def robust_json_load(line: str) -> Optional[dict]:
+    """解析一行 JSON；已知的畸形写法在解析前修复，通常只解析一次"""
+    if needs_repair(line):
+        line = _repair(line)
+    try:
+        obj = _loads(line)
+    except Exception:
+        # 预检未覆盖的情况（例如 source_type 多次出现）走原来的修复路径
+        fixed = _repair(line)
+        if fixed == line:
+            return None
+        try:
+            obj = _loads(fixed)
+        except Exception:
+            return None
+    return obj if isinstance(obj, dict) else None
+
+
+_new_record = tuple.__new__
+
+
+def to_record(obj: dict) -> Optional[LogRecord]:
+    """把解析出的 dict 转换为 LogRecord；server 非法或缺少必填字段时返回 None"""
+    get = obj.get
+    try:
+        return _new_record(LogRecord, (
+            int(get("server")),
+            obj["timestamp"],
+            obj["level"],
+            obj["class"],
+            obj["schools"],
+            get("opponent_class", 0),
+            get("opponent_schools", 0),
+            get("is_win"),
+            get("duration"),
+            obj["spirit_animal"] if "spirit_animal" in obj else get("pet_list"),
+            obj["spirit_animal_talents"] if "spirit_animal_talents" in obj else get("pet_talent_list"),
+            obj["legendary_runes"] if "legendary_runes" in obj else get("rune_list"),
+            obj["super_armor"] if "super_armor" in obj else get("armor"),
+            get("source_type"),
+            get("score_ratio", 0),
+        ))
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+def decode_record(line: str) -> Optional[LogRecord]:
+    """解码一行日志为 LogRecord；空行或无法解析时返回 None"""
+    obj = robust_json_load(line)
+    if obj is None:
+        return None
+    return to_record(obj)
+
+
+def decode_lines(lines: Iterable[str]) -> Iterator[Tuple[str, LogRecord]]:
+    """批量解码：跳过空行与无法解析的行，产出 (去掉首尾空白的原始行, LogRecord)"""
+    decode = decode_record
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        rec = decode(line)
+        if rec is not None:
+            yield line, rec
+
+
+_GOLD_LEAGUE = {"gold_league", "gold-league", "champion_league", "goldleague"}
+_SEASON = {"season_play_pvp_mgr", "season", "ladder", "pvp_ladder"}
+_WHEEL_FIRST = {"qualifying_wheel_first_combat", "qualifying-wheel-first-combat", "wheel_first"}
+
+
+def _league_types(value) -> Optional[Tuple[int, int]]:
+    """已知数据源名称 -> (胜率类型, 时长类型)；不是已知名称时返回 None"""
+    if not isinstance(value, str):
+        return None
+    v = value.strip().lower()
+    if v in _GOLD_LEAGUE:
+        return 1, 4
+    if v in _SEASON:
+        return 3, 6
+    if v in _WHEEL_FIRST:
+        return 2, 5
+    return None
+
+
+def _win_valid(is_win) -> bool:
+    # is_win 有效：不为 None 且为 0 或 1
+    return is_win is not None and is_win in (0, 1)
+
+
+def _duration_valid(duration) -> bool:
+    # duration 有效：不为 None，不为 False，且 > 0
+    return (duration is not None and duration is not False
+            and isinstance(duration, (int, float)) and duration > 0)
+
+
+def get_source_types(value, is_win, duration) -> List[int]:
+    """获取数据源类型列表（可能返回多个类型）
+    - 数据源同时包含 is_win 和 duration 字段时，返回两个类型
+    - 计算胜率时使用 is_win 字段：
+      * gold_league -> 1 (冠军联赛胜率)
+      * season -> 3 (决斗天梯胜率)
+      * qualifying_wheel_first_combat -> 2 (武道大会(车轮战首场)胜率)
+    - 计算时长时使用 duration 字段：
+      * gold_league -> 4 (冠军联赛战斗时长)
+      * season -> 6 (决斗天梯战斗时长)
+      * qualifying_wheel_first_combat -> 5 (武道大会(车轮战首场)战斗时长)
+    - 返回列表，可能包含一个或两个类型
+    """
+    if isinstance(value, int):
+        return [value]
+    league = _league_types(value)
+    if league is None:
+        # 未知类型，尝试转换为整数
+        try:
+            return [int(value)]
+        except Exception:
+            return [0]
+
+    win_type, duration_type = league
+    result = []
+    if _win_valid(is_win):
+        result.append(win_type)
+    if _duration_valid(duration):
+        result.append(duration_type)
+    # 如果两个都无效，默认返回胜率类型
+    return result or [win_type]
+
+
+def record_source_types(rec: LogRecord) -> List[int]:
+    return get_source_types(rec.source_type, rec.is_win, rec.duration)
+
+
+def record_league(rec: LogRecord) -> Optional[Tuple[int, bool, bool]]:
+    """单行存储用：(league, is_win 是否有效, duration 是否有效)
+
+    league 取该数据源的胜率类型（1/2/3），对应的时长类型为 league + 3；
+    source_type 不是已知名称（例如直接写了数字）时返回 None，按原值存储
+    """
+    league = _league_types(rec.source_type)
+    if league is None:
+        return None
+    return league[0], _win_valid(rec.is_win), _duration_valid(rec.duration)
@@ -0,0 +1,86 @@
+"""
+日志文件读取 - 识别日志文件并以流式方式打开（支持 .gz / .zst 压缩归档）
+压缩文件边读边解压，不需要先解压到磁盘；导入位置记录的是解压后的字节偏移
+"""
+import gzip
+import io
+import os
+from typing import BinaryIO, TextIO
+
+
+_LOG_SUFFIXES = ('.jsonl', '.txt')
+COMPRESSED_SUFFIXES = ('.gz', '.zst')
+
+_READ_CHUNK = 1024 * 1024
+
+
+def _strip_compression(name: str) -> str:
+    for suffix in COMPRESSED_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def is_log_file(name: str) -> bool:
+    """是否是需要导入的日志文件（xxx.jsonl / xxx.txt 及其 .gz / .zst 压缩文件）"""
+    return _strip_compression(name).endswith(_LOG_SUFFIXES)
+
+
+def is_compressed(path: str) -> bool:
+    return path.endswith(COMPRESSED_SUFFIXES)
+
+
+def open_log_binary(path: str) -> BinaryIO:
+    """以二进制方式打开日志文件；压缩文件返回流式解压后的读取对象
+
+    .zst 需要安装 zstandard，未安装时抛出 RuntimeError
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(f"reading {path} requires the zstandard package")
+        raw = open(path, 'rb')
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+        return io.BufferedReader(reader, buffer_size=_READ_CHUNK)
+    return open(path, 'rb')
+
+
+def open_log_text(path: str) -> TextIO:
+    """以文本方式（UTF-8）打开日志文件，压缩文件同样流式解压"""
+    return io.TextIOWrapper(open_log_binary(path), encoding='utf-8')
+
+
+def skip_to(f: BinaryIO, offset: int, compressed: bool):
+    """把读取位置移动到 offset（解压后的字节偏移）
+
+    普通文件直接 seek()；压缩流只能从头解压并丢弃前面的数据（只消耗 CPU，不需要额外的磁盘空间）
+    """
+    if not compressed:
+        f.seek(offset)
+        return
+    remaining = offset
+    while remaining > 0:
+        data = f.read(min(remaining, _READ_CHUNK))
+        if not data:
+            break
+        remaining -= len(data)
+
+
+def uncompressed_size(path: str) -> int:
+    """日志内容的字节数；压缩文件需要完整解压一遍（只在标记已导入等一次性操作中使用）"""
+    if not is_compressed(path):
+        return os.path.getsize(path)
+    total = 0
+    with open_log_binary(path) as f:
+        while True:
+            try:
+                data = f.read(_READ_CHUNK)
+            except EOFError:
+                break
+            if not data:
+                break
+            total += len(data)
+    return total
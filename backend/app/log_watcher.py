@@ -0,0 +1,172 @@
+"""
+日志目录监听模块 - 文件追加/新建后约 1 秒内触发增量导入
+优先使用 watchdog（Linux 下为 inotify）；未安装时回退为每秒一次的 stat 轮询。
+短时间内的多次变化会合并（debounce）为一次导入，并且只导入发生变化的文件
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from backend.app.incremental_importer import is_log_file
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class _Debouncer:
+    """收集变化的文件路径，安静 debounce_sec 秒后（或最早的变化已等待 max_wait_sec 秒）批量回调"""
+
+    def __init__(self, on_batch: Callable[[Set[str]], None], debounce_sec: float, max_wait_sec: float):
+        self._on_batch = on_batch
+        self._debounce_sec = debounce_sec
+        self._max_wait_sec = max_wait_sec
+        self._lock = threading.Lock()
+        self._pending: Set[str] = set()
+        self._first_at: Optional[float] = None
+        self._timer: Optional[threading.Timer] = None
+
+    def add(self, path: str):
+        with self._lock:
+            now = time.monotonic()
+            self._pending.add(os.path.abspath(path))
+            if self._first_at is None:
+                self._first_at = now
+            if self._timer is not None:
+                self._timer.cancel()
+            delay = self._debounce_sec
+            if now - self._first_at >= self._max_wait_sec:
+                delay = 0
+            self._timer = threading.Timer(delay, self._fire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _fire(self):
+        with self._lock:
+            paths, self._pending = self._pending, set()
+            self._first_at = None
+            self._timer = None
+        if not paths:
+            return
+        try:
+            self._on_batch(paths)
+        except Exception as e:
+            print(f"Warning: watched import failed: {e}")
+
+    def cancel(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+            self._pending.clear()
+            self._first_at = None
+
+
+class _PollingObserver:
+    """watchdog 不可用时的兜底：每 interval 秒 stat 一遍日志文件，发现 size/mtime/inode 变化即上报"""
+
+    def __init__(self, logs_dir: str, on_change: Callable[[str], None], interval: float):
+        self._logs_dir = logs_dir
+        self._on_change = on_change
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-watcher-poll", daemon=True)
+        self._seen: Dict[str, Tuple[int, int, int]] = {}
+
+    def _scan(self) -> Iterable[Tuple[str, Tuple[int, int, int]]]:
+        for root, _, files in os.walk(self._logs_dir):
+            for f in files:
+                if not is_log_file(f):
+                    continue
+                path = os.path.join(root, f)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _run(self):
+        # 启动时的现有文件由定时全量扫描负责，这里只记录基线
+        self._seen = dict(self._scan())
+        while not self._stop.wait(self._interval):
+            current = dict(self._scan())
+            for path, sig in current.items():
+                if self._seen.get(path) != sig:
+                    self._on_change(path)
+            self._seen = current
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout: Optional[float] = None):
+        self._thread.join(timeout)
+
+
+def _watchdog_observer(logs_dir: str, on_change: Callable[[str], None]):
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        return None
+
+    class _Handler(FileSystemEventHandler):
+        def _report(self, path: str):
+            if is_log_file(os.path.basename(path)):
+                on_change(path)
+
+        def on_created(self, event):
+            if not event.is_directory:
+                self._report(event.src_path)
+
+        def on_modified(self, event):
+            if not event.is_directory:
+                self._report(event.src_path)
+
+        def on_moved(self, event):
+            if not event.is_directory:
+                self._report(event.dest_path)
+
+    observer = Observer()
+    observer.schedule(_Handler(), logs_dir, recursive=True)
+    return observer
+
+
+class LogWatcher:
+    """监听 logs_dir，变化的日志文件经过合并后交给 on_batch(paths)
+
+    debounce_sec 默认取 IMPORT_WATCH_DEBOUNCE_SEC（0.5 秒），持续写入时最多等待 IMPORT_WATCH_MAX_WAIT_SEC（2 秒）
+    """
+
+    def __init__(self, logs_dir: str, on_batch: Callable[[Set[str]], None],
+                 debounce_sec: Optional[float] = None, max_wait_sec: Optional[float] = None):
+        self.logs_dir = logs_dir
+        if debounce_sec is None:
+            debounce_sec = _float_env('IMPORT_WATCH_DEBOUNCE_SEC', 0.5)
+        if max_wait_sec is None:
+            max_wait_sec = _float_env('IMPORT_WATCH_MAX_WAIT_SEC', 2.0)
+        self._debouncer = _Debouncer(on_batch, debounce_sec, max(max_wait_sec, debounce_sec))
+        self._observer = None
+        self.mode = None
+
+    def start(self):
+        self._observer = _watchdog_observer(self.logs_dir, self._debouncer.add)
+        self.mode = "watchdog"
+        if self._observer is None:
+            self._observer = _PollingObserver(self.logs_dir, self._debouncer.add,
+                                              _float_env('IMPORT_WATCH_POLL_SEC', 1.0))
+            self.mode = "poll"
+        self._observer.start()
+
+    def stop(self):
+        self._debouncer.cancel()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
@@ -1,14 +1,22 @@
 from fastapi import FastAPI, Depends, Query
-from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse
+from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
 from typing import List, Optional
-import csv
-import io
+import asyncio
 
-from backend.app.database import engine, Base, get_db
-from backend.app import crud
+import anyio
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.util import greenlet_spawn
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+
+from backend.app.database import (engine, Base, SessionLocal, ReadSessionLocal, AsyncSessionLocal,
+                                  AsyncReadSessionLocal, async_enabled, replica_enabled,
+                                  get_db, get_async_db, get_async_read_db)
+from backend.app import columnar, crud, etags, exporter, governor, replica, stats_cache
+from backend.app.compression import CompressionMiddleware
 from backend.app.schemas import SERVER_MAP, SCHOOLS_MAP, SOURCE_TYPE_MAP, get_class_school_name, get_server_name
 from sqlalchemy.orm import Session
 import os
@@ -16,9 +24,11 @@ import os
 from apscheduler.schedulers.background import BackgroundScheduler
 from backend.app.auto_importer import run_import_once
 from backend.app.incremental_importer import run_incremental_import
+from backend.app.log_watcher import LogWatcher
 
 
 app = FastAPI(default_response_class=JSONResponse)
+app.add_middleware(CompressionMiddleware)
 
 # 创建表（延迟创建，避免启动时连接失败）
 def _ensure_tables():
@@ -30,6 +40,10 @@ def _ensure_tables():
 
 templates = Jinja2Templates(directory="backend/app/templates")
 _scheduler: Optional[BackgroundScheduler] = None
+_watcher: Optional[LogWatcher] = None
+
+# 统计接口单页最多返回的分组数（limit 参数的上限）
+MAX_PAGE_SIZE = 1000
 
 @app.on_event("startup")
 def _start_scheduler():
@@ -52,10 +66,34 @@ def _start_scheduler():
         print(f"Warning: Failed to start scheduler: {e}")
         print("Application will continue without auto-import")
         _scheduler = None
+    _start_watcher()
+    # 列式内存引擎（STATS_ENGINE=columnar）在后台加载快照，加载完成前统计查询走 SQL
+    columnar.start()
+
+
+def _start_watcher():
+    """文件监听模式：日志追加/新建后约 1 秒内只导入变化的文件，定时扫描作为兜底"""
+    global _watcher
+    if os.environ.get('IMPORT_WATCH', '0').strip().lower() not in ('1', 'true', 'yes', 'on'):
+        return
+    logs_dir = os.environ.get('IMPORT_DIR', 'data_logs')
+    if not os.path.isdir(logs_dir):
+        print(f"Warning: IMPORT_WATCH enabled but {logs_dir} does not exist")
+        return
+    try:
+        _watcher = LogWatcher(logs_dir, lambda paths: run_incremental_import(logs_dir, paths=paths))
+        _watcher.start()
+        print(f"Log watcher started ({_watcher.mode}), logs_dir={logs_dir}")
+    except Exception as e:
+        print(f"Warning: Failed to start log watcher: {e}")
+        _watcher = None
 
 @app.on_event("shutdown")
 def _stop_scheduler():
-    global _scheduler
+    global _scheduler, _watcher
+    if _watcher:
+        _watcher.stop()
+        _watcher = None
     if _scheduler:
         _scheduler.shutdown(wait=False)
         _scheduler = None
@@ -68,7 +106,7 @@ def index(request: Request):
 
 
 @app.get("/api/health")
-def health():
+async def health():
     """健康检查端点，不依赖数据库"""
     return {"status": "ok"}
 
@@ -97,6 +135,172 @@ def import_full():
     return {"imported": count, "type": "full"}
 
 
+@app.get("/api/stats/cache")
+def stats_cache_info(db: Session = Depends(get_db)):
+    """统计结果缓存的命中情况（本 worker 进程的计数）与当前数据版本号"""
+    return stats_cache.cache_stats(db)
+
+
+@app.get("/api/stats/replica")
+def stats_replica_info(db: Session = Depends(get_db)):
+    """只读副本路由状态：主库/副本的数据版本号、落后的版本数、副本读取与回退主库的次数"""
+    if not replica_enabled():
+        return replica.status(db, None)
+    with ReadSessionLocal() as read_db:
+        return replica.status(db, read_db)
+
+
+@app.get("/api/stats/governor")
+def stats_governor_info():
+    """查询调度状态：并发上限、当前执行/排队数，以及各接口的准入、排队、拒绝与语句超时计数（本 worker 进程）"""
+    return governor.status()
+
+
+@app.get("/api/stats/etag")
+def stats_etag_info():
+    """条件请求状态：是否启用、缓存的数据版本号、已发出的 ETag 数与 304 次数（本 worker 进程）"""
+    return etags.status()
+
+
+@app.get("/api/stats/engine")
+def stats_engine_info():
+    """列式内存引擎的状态（是否启用、加载中、行数、数据版本号、内存占用）"""
+    return columnar.status()
+
+
+class _ClientDisconnected(Exception):
+    pass
+
+
+@app.exception_handler(_ClientDisconnected)
+async def _client_disconnected(request: Request, exc: _ClientDisconnected):
+    # 客户端已经离开，响应不会被读取；499 仅用于访问日志
+    return Response(status_code=499)
+
+
+@app.exception_handler(governor.QueryRejected)
+async def _query_rejected(request: Request, exc: governor.QueryRejected):
+    return JSONResponse(status_code=exc.status_code, headers={"Retry-After": str(exc.retry_after)},
+                        content={"error": exc.reason, "retry_after": exc.retry_after})
+
+
+def _disconnect_poll_sec() -> float:
+    try:
+        return float(os.environ.get('DB_DISCONNECT_POLL_SEC', '0.25'))
+    except ValueError:
+        return 0.25
+
+
+async def _run_query(request: Request, endpoint: str, adb: Optional[AsyncSession], fn, *args,
+                     ardb: Optional[AsyncSession] = None, **kwargs):
+    """执行同步写法的查询函数 fn(db, *args, **kwargs)；配置了只读副本时另以 read_db= 传入副本会话
+
+    DB_ASYNC 模式下经 AsyncSession.run_sync 在事件循环中通过 asyncpg 执行，数据库往返不占用线程池，
+    列式计算、直方图合并、排序与 JSON 编解码等纯 CPU 部分经 database.offload 交给线程池；
+    查询期间轮询客户端连接，断开时取消查询（asyncpg 向 PostgreSQL 发送取消请求）并丢弃该连接。
+    同步模式下与原来一样在线程池中使用 psycopg2 会话。
+    查询带有该接口的 statement_timeout（governor），超时转换为 503
+    """
+    try:
+        return await _execute(request, adb, governor.with_timeout(endpoint, fn), *args, ardb=ardb, **kwargs)
+    except Exception as e:
+        _raise_if_statement_timeout(endpoint, e)
+        raise
+
+
+def _raise_if_statement_timeout(endpoint: str, exc: Exception):
+    if governor.is_statement_timeout(exc):
+        governor.record_statement_timeout(endpoint)
+        raise governor.QueryRejected(503, f"{endpoint} query exceeded statement_timeout") from exc
+
+
+async def _execute(request: Request, adb: Optional[AsyncSession], fn, *args,
+                   ardb: Optional[AsyncSession] = None, **kwargs):
+    if adb is None:
+        def call():
+            with SessionLocal() as db:
+                if not replica_enabled():
+                    return fn(db, *args, **kwargs)
+                with ReadSessionLocal() as read_db:
+                    return fn(db, *args, read_db=read_db, **kwargs)
+        return await run_in_threadpool(call)
+
+    if ardb is not None:
+        # 副本会话的同步接口在 run_sync 的 greenlet 中同样可用
+        kwargs["read_db"] = ardb.sync_session
+    task = asyncio.ensure_future(adb.run_sync(fn, *args, **kwargs))
+    poll = _disconnect_poll_sec()
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=poll)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+            # 连接状态不确定（取消请求可能仍在途中），不放回连接池
+            await adb.invalidate()
+            if ardb is not None:
+                await ardb.invalidate()
+            raise _ClientDisconnected()
+
+
+def _load_generation() -> int:
+    with SessionLocal() as db:
+        return stats_cache.current_generation(db)
+
+
+async def _etag(endpoint: str, params: dict) -> Optional[str]:
+    """本次请求的 ETag；未启用、结果可能来自落后的副本或读取版本号失败时返回 None（不做条件请求）"""
+    if not etags.enabled() or replica.may_lag():
+        return None
+    generation = etags.cached_generation()
+    if generation is None:
+        try:
+            generation = await run_in_threadpool(etags.load_generation, _load_generation)
+        except Exception as e:
+            print(f"Warning: failed to read data generation for ETag: {e}")
+            return None
+    return etags.make_etag(endpoint, params, generation)
+
+
+def _not_modified(request: Request, etag: Optional[str]) -> Optional[Response]:
+    if etag is not None and etags.matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=etags.headers(etag))
+    return None
+
+
+def _check_cursor(cursor: Optional[str], sort: Optional[str], metric: str, group_by_opponent: bool):
+    """游标无效（或与当前排序不一致）时返回 400 响应"""
+    if not cursor:
+        return None
+    try:
+        crud.decode_cursor(cursor, crud.page_keys(sort, metric, group_by_opponent))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return None
+
+
+async def _stats_query(request: Request, metric: str, compute, adb: Optional[AsyncSession],
+                       ardb: Optional[AsyncSession], group_by_opponent: bool,
+                       limit: Optional[int], cursor: Optional[str], filters: dict):
+    """执行统计查询，返回 (结果行, 查询路径, 缓存层级, 分页信息)
+
+    未传 limit 时返回全部分组（分页信息为空）；传了 limit 时只取一页，分页信息为 {"total", "next_cursor"}
+    """
+    if limit is None:
+        result, query_path, cache = await _run_query(
+            request, metric, adb, stats_cache.cached_query, metric, compute, ardb=ardb,
+            group_by_opponent=group_by_opponent, **filters)
+        return result, query_path, cache, {}
+    page, cache = await _run_query(
+        request, metric, adb, stats_cache.cached_page, metric, group_by_opponent, limit, cursor, ardb=ardb,
+        **filters)
+    return page["rows"], page["path"], cache, {"total": page["total"], "next_cursor": page["next_cursor"]}
+
+
 def _parse_int_list(csv_str: Optional[str]) -> Optional[List[int]]:
     if not csv_str:
         return None
@@ -107,7 +311,9 @@ def _parse_int_list(csv_str: Optional[str]) -> Optional[List[int]]:
 
 
 @app.get("/api/stats/winrate")
-def stats_winrate(
+async def stats_winrate(
+    request: Request,
+    response: Response,
     servers: Optional[str] = None,
     start_ts: Optional[int] = None,
     end_ts: Optional[int] = None,
@@ -125,11 +331,16 @@ def stats_winrate(
     score_ratio: Optional[int] = None,
     sort: Optional[str] = None,
     group_by_opponent: bool = False,
-    db: Session = Depends(get_db),
+    min_matches: Optional[int] = Query(None, ge=1, description="只返回场次不少于该值的分组"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="分页大小；不传时返回全部分组"),
+    cursor: Optional[str] = Query(None, description="上一页响应中的 next_cursor"),
+    adb: Optional[AsyncSession] = Depends(get_async_db),
+    ardb: Optional[AsyncSession] = Depends(get_async_read_db),
 ):
-    result = crud.query_winrate(
-        db=db,
-        group_by_opponent=group_by_opponent,
+    error = _check_cursor(cursor, sort, "winrate", group_by_opponent)
+    if error is not None:
+        return error
+    filters = dict(
         servers=_parse_int_list(servers),
         start_ts=start_ts, end_ts=end_ts,
         min_level=min_level, max_level=max_level,
@@ -142,8 +353,18 @@ def stats_winrate(
         super_armor=super_armor,
         source_types=_parse_int_list(source_types),
         score_ratio=score_ratio,
+        min_matches=min_matches,
         sort=sort,
     )
+    etag = await _etag("winrate", dict(filters, group_by_opponent=group_by_opponent, limit=limit, cursor=cursor))
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    if etag is not None:
+        response.headers.update(etags.headers(etag))
+    async with governor.slot("winrate"):
+        result, query_path, cache, page = await _stats_query(
+            request, "winrate", crud.query_winrate_routed, adb, ardb, group_by_opponent, limit, cursor, filters)
 
     rows = []
     for r in result:
@@ -168,11 +389,13 @@ def stats_winrate(
                 "opponent_class_schools_name": get_class_school_name(r[4], r[5]),
             })
         rows.append(record)
-    return {"data": rows}
+    return dict(page, data=rows, query_path=query_path, cache=cache)
 
 
 @app.get("/api/stats/duration")
-def stats_duration(
+async def stats_duration(
+    request: Request,
+    response: Response,
     servers: Optional[str] = None,
     start_ts: Optional[int] = None,
     end_ts: Optional[int] = None,
@@ -190,11 +413,17 @@ def stats_duration(
     score_ratio: Optional[int] = None,
     sort: Optional[str] = None,
     group_by_opponent: bool = False,
-    db: Session = Depends(get_db),
+    exact: bool = Query(False, description="true 时扫描原始记录计算精确分位数；默认由 rollup 时长直方图估算"),
+    min_matches: Optional[int] = Query(None, ge=1, description="只返回场次不少于该值的分组"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="分页大小；不传时返回全部分组"),
+    cursor: Optional[str] = Query(None, description="上一页响应中的 next_cursor"),
+    adb: Optional[AsyncSession] = Depends(get_async_db),
+    ardb: Optional[AsyncSession] = Depends(get_async_read_db),
 ):
-    result = crud.query_duration(
-        db=db,
-        group_by_opponent=group_by_opponent,
+    error = _check_cursor(cursor, sort, "duration", group_by_opponent)
+    if error is not None:
+        return error
+    filters = dict(
         servers=_parse_int_list(servers),
         start_ts=start_ts, end_ts=end_ts,
         min_level=min_level, max_level=max_level,
@@ -207,8 +436,19 @@ def stats_duration(
         super_armor=super_armor,
         source_types=_parse_int_list(source_types),
         score_ratio=score_ratio,
+        min_matches=min_matches,
         sort=sort,
+        exact=exact,
     )
+    etag = await _etag("duration", dict(filters, group_by_opponent=group_by_opponent, limit=limit, cursor=cursor))
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    if etag is not None:
+        response.headers.update(etags.headers(etag))
+    async with governor.slot("duration"):
+        result, query_path, cache, page = await _stats_query(
+            request, "duration", crud.query_duration_routed, adb, ardb, group_by_opponent, limit, cursor, filters)
 
     rows = []
     for r in result:
@@ -220,10 +460,15 @@ def stats_duration(
             "class_schools_name": get_class_school_name(r[1], r[2]),
             "source_type": r[3],
             "source_type_name": SOURCE_TYPE_MAP.get(r[3], f"未知来源({r[3]})"),
-            "avg_duration": float(r[-4] or 0.0),
-            "max_duration": int(r[-3] or 0),
-            "min_duration": int(r[-2] or 0),
-            "median_duration": float(r[-1] or 0.0),
+            "avg_duration": float(r[-8] or 0.0),
+            "max_duration": int(r[-7] or 0),
+            "min_duration": int(r[-6] or 0),
+            # 分位数：median / p25 / p75 / p90 / p99（crud.DURATION_PERCENTILES 的顺序）
+            "median_duration": float(r[-5] or 0.0),
+            "p25_duration": float(r[-4] or 0.0),
+            "p75_duration": float(r[-3] or 0.0),
+            "p90_duration": float(r[-2] or 0.0),
+            "p99_duration": float(r[-1] or 0.0),
         }
         if group_by_opponent:
             record.update({
@@ -232,12 +477,123 @@ def stats_duration(
                 "opponent_class_schools_name": get_class_school_name(r[4], r[5]),
             })
         rows.append(record)
-    return {"data": rows}
+    # rollup 路径的分位数由直方图估算（误差见 rollups.hist_percentile），raw 路径为 percentile_disc 精确值
+    percentiles = "approx" if query_path == "rollup" else "exact"
+    return dict(page, data=rows, query_path=query_path, cache=cache, percentiles=percentiles)
+
+
+@app.get("/api/stats/summary")
+async def stats_summary(
+    request: Request,
+    response: Response,
+    servers: Optional[str] = None,
+    start_ts: Optional[int] = None,
+    end_ts: Optional[int] = None,
+    min_level: Optional[int] = None,
+    max_level: Optional[int] = None,
+    clazz: Optional[int] = None,
+    schools: Optional[int] = None,
+    opponent_class: Optional[int] = None,
+    opponent_schools: Optional[int] = None,
+    spirit_animal: Optional[str] = None,
+    spirit_animal_talents: Optional[int] = None,
+    legendary_runes: Optional[str] = None,
+    super_armor: Optional[int] = None,
+    source_types: Optional[str] = None,
+    score_ratio: Optional[int] = None,
+    sort: Optional[str] = None,
+    group_by_opponent: bool = Query(True, description="同时返回按对手细分的分组（GROUPING SETS）"),
+    min_matches: Optional[int] = Query(None, ge=1, description="胜率或时长场次不少于该值的分组"),
+    adb: Optional[AsyncSession] = Depends(get_async_db),
+    ardb: Optional[AsyncSession] = Depends(get_async_read_db),
+):
+    """胜率与时长的合并统计：一次扫描得到两类聚合，以及按职业 / 按对手细分两种分组（见 crud.query_summary）"""
+    filters = dict(
+        servers=_parse_int_list(servers),
+        start_ts=start_ts, end_ts=end_ts,
+        min_level=min_level, max_level=max_level,
+        clazz=clazz, schools=schools,
+        opponent_class=opponent_class,
+        opponent_schools=opponent_schools,
+        spirit_animal=_parse_int_list(spirit_animal),
+        spirit_animal_talents=spirit_animal_talents,
+        legendary_runes=_parse_int_list(legendary_runes),
+        super_armor=super_armor,
+        source_types=_parse_int_list(source_types),
+        score_ratio=score_ratio,
+        min_matches=min_matches,
+        sort=sort,
+    )
+    etag = await _etag("summary", dict(filters, group_by_opponent=group_by_opponent))
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    if etag is not None:
+        response.headers.update(etags.headers(etag))
+    async with governor.slot("summary"):
+        result, query_path, cache = await _run_query(
+            request, "summary", adb, stats_cache.cached_query, "summary", crud.query_summary, ardb=ardb,
+            group_by_opponent=group_by_opponent, **filters)
+
+    by_class, by_opponent = [], []
+    for r in result:
+        duration_type = crud.SUMMARY_SOURCE_PAIRS.get(r[3])
+        record = {
+            "server": r[0],
+            "server_name": get_server_name(r[0]),
+            "class": r[1],
+            "schools": r[2],
+            "class_schools_name": get_class_school_name(r[1], r[2]),
+            "source_type": r[3],
+            "source_type_name": SOURCE_TYPE_MAP.get(r[3], f"未知来源({r[3]})"),
+            "duration_source_type": duration_type,
+            "duration_source_type_name": SOURCE_TYPE_MAP.get(duration_type, f"未知来源({duration_type})"),
+            "win_count": int(r[6] or 0),
+            "lose_count": int(r[7] or 0),
+            "match_count": int(r[8] or 0),
+            "win_rate": float(r[9] or 0.0),
+            "duration_count": int(r[10] or 0),
+            "avg_duration": float(r[11] or 0.0),
+            "max_duration": int(r[12] or 0),
+            "min_duration": int(r[13] or 0),
+            "median_duration": float(r[14] or 0.0),
+            "p25_duration": float(r[15] or 0.0),
+            "p75_duration": float(r[16] or 0.0),
+            "p90_duration": float(r[17] or 0.0),
+            "p99_duration": float(r[18] or 0.0),
+        }
+        if r[-1]:
+            record.update({
+                "opponent_class": r[4],
+                "opponent_schools": r[5],
+                "opponent_class_schools_name": get_class_school_name(r[4], r[5]),
+            })
+            by_opponent.append(record)
+        else:
+            by_class.append(record)
+    return {"data": by_class, "by_opponent": by_opponent if group_by_opponent else None,
+            "query_path": query_path, "cache": cache, "percentiles": "exact"}
+
+
+def _export_rows(result, metric: str, group_by_opponent: bool):
+    """把查询结果逐行转换为导出列（惰性，配合服务端游标使用）"""
+    for r in result:
+        base = [r[0], r[1], r[2], r[3]]
+        if group_by_opponent:
+            base += [r[4], r[5]]
+        if metric == 'winrate':
+            base += [int(r[-4] or 0), int(r[-3] or 0), int(r[-2] or 0), float(r[-1] or 0.0)]
+        else:
+            base += [float(r[-8] or 0.0), int(r[-7] or 0), int(r[-6] or 0)]
+            base += [float(v or 0.0) for v in r[-5:]]
+        yield base
 
 
 @app.get("/api/export/csv")
-def export_csv(
+async def export_csv(
+    request: Request,
     metric: str = Query(..., description="winrate 或 duration"),
+    format: str = Query("csv", description="csv、parquet 或 arrow（后两者需要 pyarrow）"),
     servers: Optional[str] = None,
     start_ts: Optional[int] = None,
     end_ts: Optional[int] = None,
@@ -255,70 +611,121 @@ def export_csv(
     score_ratio: Optional[int] = None,
     sort: Optional[str] = None,
     group_by_opponent: bool = False,
-    db: Session = Depends(get_db),
+    exact: bool = False,
+    min_matches: Optional[int] = Query(None, ge=1),
 ):
     metric = metric.lower()
+    fmt = format.lower()
+    if fmt not in exporter.available_formats():
+        return JSONResponse(status_code=400, content={
+            "error": f"unsupported export format: {format}",
+            "available": exporter.available_formats(),
+        })
+
+    filters = dict(
+        group_by_opponent=group_by_opponent,
+        servers=_parse_int_list(servers), start_ts=start_ts, end_ts=end_ts,
+        min_level=min_level, max_level=max_level,
+        clazz=clazz, schools=schools,
+        opponent_class=opponent_class, opponent_schools=opponent_schools,
+        spirit_animal=_parse_int_list(spirit_animal),
+        spirit_animal_talents=spirit_animal_talents,
+        legendary_runes=_parse_int_list(legendary_runes),
+        super_armor=super_armor,
+        source_types=_parse_int_list(source_types),
+        score_ratio=score_ratio,
+        min_matches=min_matches,
+        sort=sort,
+        yield_per=exporter.batch_size(),
+    )
+    header = ["server", "class", "schools", "source_type"]
+    if group_by_opponent:
+        header += ["opponent_class", "opponent_schools"]
+
     if metric == 'winrate':
-        result = crud.query_winrate(
-            db=db,
-            group_by_opponent=group_by_opponent,
-            servers=_parse_int_list(servers), start_ts=start_ts, end_ts=end_ts,
-            min_level=min_level, max_level=max_level,
-            clazz=clazz, schools=schools,
-            opponent_class=opponent_class, opponent_schools=opponent_schools,
-            spirit_animal=_parse_int_list(spirit_animal),
-            spirit_animal_talents=spirit_animal_talents,
-            legendary_runes=_parse_int_list(legendary_runes),
-            super_armor=super_armor,
-            source_types=_parse_int_list(source_types),
-            score_ratio=score_ratio,
-            sort=sort,
-        )
-        header = ["server", "class", "schools", "source_type"]
-        if group_by_opponent:
-            header += ["opponent_class", "opponent_schools"]
         header += ["win_count", "lose_count", "match_count", "win_rate"]
-        rows = []
-        for r in result:
-            base = [r[0], r[1], r[2], r[3]]
-            if group_by_opponent:
-                base += [r[4], r[5]]
-            base += [int(r[-4] or 0), int(r[-3] or 0), int(r[-2] or 0), float(r[-1] or 0.0)]
-            rows.append(base)
     else:
-        result = crud.query_duration(
-            db=db,
-            group_by_opponent=group_by_opponent,
-            servers=_parse_int_list(servers), start_ts=start_ts, end_ts=end_ts,
-            min_level=min_level, max_level=max_level,
-            clazz=clazz, schools=schools,
-            opponent_class=opponent_class, opponent_schools=opponent_schools,
-            spirit_animal=_parse_int_list(spirit_animal),
-            spirit_animal_talents=spirit_animal_talents,
-            legendary_runes=_parse_int_list(legendary_runes),
-            super_armor=super_armor,
-            source_types=_parse_int_list(source_types),
-            score_ratio=score_ratio,
-            sort=sort,
-        )
-        header = ["server", "class", "schools", "source_type"]
-        if group_by_opponent:
-            header += ["opponent_class", "opponent_schools"]
-        header += ["avg_duration", "max_duration", "min_duration", "median_duration"]
-        rows = []
-        for r in result:
-            base = [r[0], r[1], r[2], r[3]]
-            if group_by_opponent:
-                base += [r[4], r[5]]
-            base += [float(r[-4] or 0.0), int(r[-3] or 0), int(r[-2] or 0), float(r[-1] or 0.0)]
-            rows.append(base)
-
-    buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(header)
-    writer.writerows(rows)
-    buf.seek(0)
-    return StreamingResponse(iter([buf.getvalue()]), media_type="text/csv",
-                             headers={"Content-Disposition": f"attachment; filename={metric}.csv"})
+        header += ["avg_duration", "max_duration", "min_duration",
+                   "median_duration", "p25_duration", "p75_duration", "p90_duration", "p99_duration"]
+
+    def run(db, read_db=None):
+        source, _ = replica.pick(db, read_db)
+        if metric == 'winrate':
+            return crud.query_winrate_routed(source, **filters)[0]
+        return crud.query_duration_routed(source, exact=exact, **filters)[0]
+
+    media_type, ext = exporter.FORMATS[fmt]
+    headers = {"Content-Disposition": f"attachment; filename={metric}.{ext}"}
+    etag = await _etag("export", dict(filters, metric=metric, format=fmt, exact=exact, yield_per=None))
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    if etag is not None:
+        headers.update(etags.headers(etag))
+    # 会话与执行名额随响应流一起释放：服务端游标在整个输出过程中保持打开
+    slot = await governor.admit("export")
+    if async_enabled():
+        sessions = [AsyncSessionLocal()]
+        if AsyncReadSessionLocal is not None:
+            sessions.append(AsyncReadSessionLocal())
+        try:
+            result = await _run_query(request, "export", sessions[0], run,
+                                      ardb=sessions[1] if len(sessions) > 1 else None)
+        except BaseException:
+            for adb in sessions:
+                await adb.close()
+            slot.release()
+            raise
+        chunks = exporter.stream(fmt, header, _export_rows(result, metric, group_by_opponent))
+        return StreamingResponse(_stream_async(chunks, sessions, slot), media_type=media_type, headers=headers,
+                                 background=BackgroundTask(slot.release))
+
+    sessions = [SessionLocal()]
+    if replica_enabled():
+        sessions.append(ReadSessionLocal())
+
+    db, read_db = sessions[0], sessions[1] if len(sessions) > 1 else None
+
+    def close():
+        # 生成器的 finally 与 background 都会调用；pop 保证每个会话只关闭一次（release 可重复调用）
+        while sessions:
+            sessions.pop().close()
+        slot.release()
+
+    try:
+        result = await run_in_threadpool(governor.with_timeout("export", run), db, read_db=read_db)
+    except Exception as e:
+        close()
+        _raise_if_statement_timeout("export", e)
+        raise
+    body = exporter.stream(fmt, header, _export_rows(result, metric, group_by_opponent), on_close=close)
+    # 流在开始输出前被取消时生成器的 finally 不会执行，会话（连同服务端游标）与名额由 background 兜底释放
+    return StreamingResponse(body, media_type=media_type, headers=headers, background=BackgroundTask(close))
+
+
+async def _stream_async(chunks, sessions: List[AsyncSession], slot: governor.Slot):
+    """异步模式的导出流：在 greenlet 中逐块推进同步的导出生成器（结果行经 asyncpg 服务端游标按批读取）；
+    客户端断开时 Starlette 取消本生成器，游标所在的连接随之丢弃"""
+    finished = False
+    try:
+        while True:
+            chunk = await greenlet_spawn(next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+        finished = True
+    finally:
+        with anyio.CancelScope(shield=True):
+            for adb in sessions:
+                if finished:
+                    await adb.close()
+                else:
+                    await adb.invalidate()
+            if not finished:
+                try:
+                    await greenlet_spawn(chunks.close)
+                except Exception:
+                    pass
+        slot.release()
 
 
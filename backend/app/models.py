@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, DateTime, JSON
-from sqlalchemy import Index
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, DateTime, JSON, Boolean, Text
+from sqlalchemy import Index, func
 from sqlalchemy.dialects.postgresql import ARRAY
 from backend.app.database import Base
 from sqlalchemy import Table
@@ -7,12 +7,16 @@ from sqlalchemy import Table
 
 class MatchRecord(Base):
     __tablename__ = "match_records"
+    # 按 timestamp 做 RANGE 分区（按月/按周，见 backend/app/partitions.py），分区在导入时自动创建
+    __table_args__ = {"postgresql_partition_by": "RANGE (timestamp)"}
 
+    # 分区表的主键/唯一索引必须包含分区键 timestamp
     id = Column(BigInteger, primary_key=True, autoincrement=True)
 
     # 核心维度
     server = Column(Integer, nullable=False)
-    timestamp = Column(BigInteger, nullable=False)  # 秒级时间戳
+    server_group = Column(Integer, nullable=True)  # 合并后的区服组（schemas.SERVER_GROUP_MAP），入库时写入
+    timestamp = Column(BigInteger, primary_key=True, autoincrement=False)  # 秒级时间戳，分区键
     level = Column(Integer, nullable=False)
 
     # 职业/流派（己方）
@@ -31,21 +35,105 @@ class MatchRecord(Base):
     spirit_animal = Column(ARRAY(Integer), nullable=True)          # 最多3个
     spirit_animal_talents = Column(ARRAY(Integer), nullable=True)  # 与上对应
     legendary_runes = Column(ARRAY(Integer), nullable=True)        # 最多3个
+    pet_talent_packed = Column(ARRAY(Integer), nullable=True)      # 灵宠与天赋按位置打包（schemas.pack_pet_talent），入库时写入
     super_armor = Column(Integer, nullable=True)
 
-    # 来源类型：1..8
+    # 来源类型：1..8（单行存储时为拆分后的第一个类型，查询时由 league + 有效标记展开）
     source_type = Column(SmallInteger, nullable=False)
     score_ratio = Column(Integer, nullable=False, default=0)  # 千分比
 
+    # 行指纹：原始日志行 + source_type 的 64 位哈希，唯一索引保证重复导入时跳过已有记录
+    row_hash = Column(BigInteger, nullable=True)
+
+    # 单行存储：一条日志一行。league 为胜率类型 1/2/3（对应时长类型 league + 3），
+    # is_win/duration 是否有效决定该行计入胜率类型、时长类型还是两者；league 为 NULL 的行按 source_type 原值统计
+    league = Column(SmallInteger, nullable=True)
+    win_valid = Column(Boolean, nullable=True)
+    duration_valid = Column(Boolean, nullable=True)
+
 
 # 常用组合索引
-Index("ix_records_time", MatchRecord.timestamp)
+# 数据按时间顺序到达，时间列用 BRIN 即可（体积远小于 B-tree，分区裁剪后再按块范围过滤）
+Index("ix_records_time_brin", MatchRecord.timestamp, postgresql_using="brin")
 Index("ix_records_server", MatchRecord.server)
+Index("ix_records_server_group", MatchRecord.server_group, MatchRecord.clazz, MatchRecord.schools)
 Index("ix_records_level", MatchRecord.level)
 Index("ix_records_class_school", MatchRecord.clazz, MatchRecord.schools)
 Index("ix_records_opp_class_school", MatchRecord.opponent_class, MatchRecord.opponent_schools)
 Index("ix_records_source_type", MatchRecord.source_type)
 Index("ix_records_score_ratio", MatchRecord.score_ratio)
+# 指纹来自原始日志行，同一行的 timestamp 相同，因此 (row_hash, timestamp) 唯一与 row_hash 唯一等价
+Index("ux_records_row_hash", MatchRecord.row_hash, MatchRecord.timestamp, unique=True)
+Index("ix_records_league", MatchRecord.league)
+# 装配过滤使用数组运算符 &&，由 GIN 索引支持
+Index("ix_records_spirit_animal_gin", MatchRecord.spirit_animal, postgresql_using="gin")
+Index("ix_records_legendary_runes_gin", MatchRecord.legendary_runes, postgresql_using="gin")
+Index("ix_records_pet_talent_gin", MatchRecord.pet_talent_packed, postgresql_using="gin")
+
+
+class MatchRollup(Base):
+    """预聚合表：按时间桶 / 区服 / 职业流派 / source_type / 对手 / 等级段累计胜负与时长
+
+    source_type 为展开后的对外类型；导入时随每个批次在同一事务中累加，scripts/rebuild_rollups.py 可全量重建
+    """
+    __tablename__ = "match_rollups"
+
+    bucket_ts = Column(BigInteger, primary_key=True)        # 时间桶起点（ROLLUP_BUCKET_SEC 对齐）
+    server = Column(Integer, primary_key=True)              # 原始区服，查询时再合并
+    clazz = Column(SmallInteger, primary_key=True)
+    schools = Column(SmallInteger, primary_key=True)
+    source_type = Column(SmallInteger, primary_key=True)
+    opponent_class = Column(SmallInteger, primary_key=True)
+    opponent_schools = Column(SmallInteger, primary_key=True)
+    level_band = Column(Integer, primary_key=True)          # 等级段起点（ROLLUP_LEVEL_BAND 对齐）
+
+    win_count = Column(BigInteger, nullable=False, default=0)
+    lose_count = Column(BigInteger, nullable=False, default=0)
+    match_count = Column(BigInteger, nullable=False, default=0)
+    duration_sum = Column(BigInteger, nullable=False, default=0)
+    duration_min = Column(Integer, nullable=True)
+    duration_max = Column(Integer, nullable=True)
+    duration_hist = Column(ARRAY(Integer), nullable=True)  # 定长时长直方图（见 rollups.duration_bucket）
+
+
+Index("ix_rollups_source_type", MatchRollup.source_type)
+
+
+class ImportCheckpoint(Base):
+    """增量导入进度：每个日志文件已导入到的字节偏移，与该批数据在同一事务中更新"""
+    __tablename__ = "import_checkpoints"
+
+    # 文件标识：相对 IMPORT_DIR 的路径（多个实例共享数据库时不依赖本机绝对路径）
+    file_key = Column(String(512), primary_key=True)
+    byte_offset = Column(BigInteger, nullable=False, default=0)
+
+    # 文件身份：用于识别截断、轮转与替换
+    inode = Column(BigInteger, nullable=True)
+    size = Column(BigInteger, nullable=True)
+    mtime_ns = Column(BigInteger, nullable=True)
+    head_len = Column(Integer, nullable=True)
+    head = Column(String(32), nullable=True)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class ImportGeneration(Base):
+    """数据版本号：每个写入了新数据的导入批次在同一事务中加一，统计结果缓存以此判断是否过期"""
+    __tablename__ = "import_generation"
+
+    id = Column(SmallInteger, primary_key=True)   # 只有一行，id = 1
+    generation = Column(BigInteger, nullable=False, default=0)
+
+
+class StatsCacheEntry(Base):
+    """统计结果的共享缓存（多个 uvicorn worker 共用）；UNLOGGED 表不写 WAL，崩溃后清空即可"""
+    __tablename__ = "stats_cache"
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+
+    cache_key = Column(String(64), primary_key=True)
+    generation = Column(BigInteger, nullable=False)
+    expires_at = Column(BigInteger, nullable=False)   # 秒级时间戳
+    payload = Column(Text, nullable=False)            # JSON
 
 
 # Helper views as tables for querying (created via SQL in scripts/migration_001_views.sql)
@@ -0,0 +1,185 @@
+"""
+并行导入模块 - 使用进程池并行解析、入库多个日志文件
+大文件按行对齐切分为多个字节区间；每个区间在独立的工作进程中解析，并使用该进程自己的数据库连接写入
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from backend.app.database import SessionLocal
+from backend.app.checkpoints import save_checkpoint
+from backend.app.copy_loader import report_throughput
+from backend.app.log_files import is_compressed
+from backend.app import incremental_importer as inc
+
+
+def resolve_workers(workers: Optional[int] = None) -> int:
+    """解析工作进程数：参数优先，其次 IMPORT_WORKERS（0 或 auto 表示 CPU 核数），默认 1（串行）"""
+    if workers is None:
+        raw = os.environ.get('IMPORT_WORKERS', '1').strip().lower()
+        if raw in ('', 'auto', '0'):
+            return os.cpu_count() or 1
+        try:
+            workers = int(raw)
+        except ValueError:
+            return 1
+    if workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def _chunk_bytes() -> int:
+    try:
+        return max(1, int(os.environ.get('IMPORT_CHUNK_MB', '64'))) * 1024 * 1024
+    except ValueError:
+        return 64 * 1024 * 1024
+
+
+def _split_ranges(file_path: str, start: int, size: int, chunk_bytes: int) -> List[Tuple[int, Optional[int]]]:
+    """把 [start, size) 切分为按行对齐的字节区间；最后一个区间读到文件末尾（end=None）
+
+    压缩文件无法随机访问，整个文件作为一个区间
+    """
+    if is_compressed(file_path):
+        return [(start, None)]
+    ranges: List[Tuple[int, Optional[int]]] = []
+    pos = start
+    with open(file_path, 'rb') as f:
+        while size - pos > chunk_bytes:
+            f.seek(pos + chunk_bytes)
+            f.readline()
+            nxt = f.tell()
+            if nxt >= size:
+                break
+            ranges.append((pos, nxt))
+            pos = nxt
+    ranges.append((pos, None))
+    return ranges
+
+
+def _import_range(file_path: str, start: int, end: Optional[int],
+                  checkpoint: Optional[Tuple[str, dict]] = None) -> Tuple[int, int, bool]:
+    """工作进程入口：导入一个字节区间，返回 (导入行数, 结束偏移, 是否完整读完该区间)
+
+    checkpoint 不为空时（文件只有一个区间），位置记录随每个批次在同一事务中提交；
+    .gz 不完整（仍在写入）或读取出错时已读到的行照常入库，但区间不算完成
+    """
+    status: dict = {}
+    with SessionLocal() as db:
+        count, end_offset = inc._bulk_insert_incremental(db, file_path, start, batch_size=2000, end_offset=end,
+                                                         checkpoint=checkpoint, status=status)
+    return count, end_offset, bool(status.get("complete"))
+
+
+def _executor(workers: int) -> ProcessPoolExecutor:
+    # 使用 spawn：调度器所在进程是多线程的，fork 可能继承到被其他线程持有的锁
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _run_ranges(tasks: Dict[str, List[Tuple[int, Optional[int]]]], workers: int, on_file_done,
+                checkpoints: Optional[Dict[str, Tuple[str, dict]]] = None) -> int:
+    """并行执行所有文件的区间；某个文件的全部区间完成后调用 on_file_done(path, end_offset)
+
+    checkpoints 给出单区间文件的 (file_key, 文件状态)，由工作进程逐批次提交位置记录
+    """
+    checkpoints = checkpoints or {}
+    total = 0
+    pending = {path: len(ranges) for path, ranges in tasks.items()}
+    final_end: Dict[str, int] = {}
+    failed = set()
+    with _executor(workers) as pool:
+        futures = {}
+        for path, ranges in tasks.items():
+            for start, end in ranges:
+                checkpoint = checkpoints.get(path) if len(ranges) == 1 else None
+                futures[pool.submit(_import_range, path, start, end, checkpoint)] = (path, end)
+        for fut in as_completed(futures):
+            path, end = futures[fut]
+            try:
+                count, end_offset, complete = fut.result()
+                total += count
+                if end is None:
+                    final_end[path] = end_offset
+                if not complete:
+                    # 文件不完整或读取出错：不写 .done 标记、不推进多区间文件的位置记录，下次重新读取
+                    print(f"Warning: {path} was not fully read, will retry next run")
+                    failed.add(path)
+            except Exception as e:
+                print(f"Error importing {path}: {e}")
+                failed.add(path)
+            pending[path] -= 1
+            if pending[path] == 0 and path not in failed:
+                on_file_done(path, final_end[path])
+    return total
+
+
+def run_parallel_incremental(logs_dir: str, workers: int, paths: Optional[Iterable[str]] = None) -> int:
+    """run_incremental_import 的并行版本
+
+    只有一个区间的文件由工作进程逐批次提交位置记录；切分为多个区间的文件在全部区间完成后
+    由主进程一次性更新位置记录（中途失败时重新导入的行会被 row_hash 去重）
+    """
+    started = time.perf_counter()
+    chunk_bytes = _chunk_bytes()
+    tasks: Dict[str, List[Tuple[int, Optional[int]]]] = {}
+    checkpoints: Dict[str, Tuple[str, dict]] = {}
+
+    with SessionLocal() as db:
+        positions = inc._load_positions(db, logs_dir)
+        for src in inc._iter_log_files(logs_dir, paths):
+            file_key = inc._get_file_key(src, logs_dir)
+            try:
+                st = os.stat(src)
+            except OSError:
+                continue
+            start_offset = inc._resume_offset(src, st, positions.get(file_key))
+            if start_offset is None:
+                continue
+            state = inc._file_state(src, st, start_offset)
+            if start_offset >= st.st_size and not is_compressed(src):
+                save_checkpoint(db, file_key, state)
+                continue
+            tasks[src] = _split_ranges(src, start_offset, st.st_size, chunk_bytes)
+            checkpoints[src] = (file_key, state)
+            print(f"导入 {src} (从第 {start_offset} 字节到第 {st.st_size} 字节, {len(tasks[src])} 个分块)...")
+        db.commit()
+
+        def _file_done(path: str, end_offset: int):
+            if len(tasks[path]) > 1:
+                file_key, state = checkpoints[path]
+                save_checkpoint(db, file_key, dict(state, offset=end_offset))
+                db.commit()
+            print(f"  {path} 导入完成，文件位置已更新到第 {end_offset} 字节")
+
+        total = _run_ranges(tasks, workers, _file_done, checkpoints) if tasks else 0
+    report_throughput(f"增量导入（{workers} 进程）", total, started)
+    return total
+
+
+def run_parallel_full(logs_dir: str, workers: int) -> int:
+    """run_import_once 的并行版本：每个文件全部完成后写入 .done 标记"""
+    started = time.perf_counter()
+    chunk_bytes = _chunk_bytes()
+    tasks: Dict[str, List[Tuple[int, Optional[int]]]] = {}
+
+    for src in inc._iter_log_files(logs_dir):
+        if os.path.exists(src + '.done'):
+            continue
+        try:
+            size = os.path.getsize(src)
+        except OSError:
+            continue
+        tasks[src] = _split_ranges(src, 0, size, chunk_bytes)
+
+    def _file_done(path: str, end_offset: int):
+        try:
+            with open(path + '.done', 'w') as m:
+                m.write('ok')
+        except Exception:
+            pass
+
+    total = _run_ranges(tasks, workers, _file_done) if tasks else 0
+    report_throughput(f"全量导入（{workers} 进程）", total, started)
+    return total
@@ -0,0 +1,173 @@
+"""
+match_records 按时间分区 - 以 timestamp 做 RANGE 分区（按月或按周，UTC）
+导入时按批次中出现的时间自动创建缺少的分区；时间范围查询只扫描相关分区，
+过期数据通过 DETACH PARTITION（可选 DROP）清理，不需要长时间的 DELETE。
+未分区的旧表（尚未执行 scripts/manage_partitions.py convert）上这里的操作都是空操作
+"""
+import datetime as dt
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from backend.app.models import MatchRecord
+from backend.app import rollups
+
+
+_TABLE = MatchRecord.__tablename__
+_UTC = dt.timezone.utc
+_WEEK_SEC = 7 * 86400
+# 1970-01-05 是周一：按周分区的边界都落在周一 00:00 UTC
+_WEEK_EPOCH = 4 * 86400
+
+_created: Set[str] = set()
+_partitioned: Optional[bool] = None
+
+_BOUND_RE = re.compile(r"FROM \('?(-?\d+)'?\) TO \('?(-?\d+)'?\)")
+
+
+def interval() -> str:
+    """MATCH_PARTITION_INTERVAL：month（默认）或 week"""
+    value = os.environ.get("MATCH_PARTITION_INTERVAL", "month").strip().lower()
+    return "week" if value == "week" else "month"
+
+
+def partition_for(ts: int, unit: Optional[str] = None) -> Tuple[str, int, int]:
+    """ts 所在分区的 (表名, 起始时间戳, 结束时间戳)，区间左闭右开"""
+    unit = unit or interval()
+    if unit == "week":
+        lo = (ts - _WEEK_EPOCH) // _WEEK_SEC * _WEEK_SEC + _WEEK_EPOCH
+        day = dt.datetime.fromtimestamp(lo, _UTC)
+        return f"{_TABLE}_w{day:%Y%m%d}", lo, lo + _WEEK_SEC
+    day = dt.datetime.fromtimestamp(ts, _UTC)
+    start = dt.datetime(day.year, day.month, 1, tzinfo=_UTC)
+    end = dt.datetime(day.year + (day.month == 12), day.month % 12 + 1, 1, tzinfo=_UTC)
+    return f"{_TABLE}_m{start:%Y%m}", int(start.timestamp()), int(end.timestamp())
+
+
+def is_partitioned(db: Session) -> bool:
+    global _partitioned
+    if _partitioned is None:
+        _partitioned = bool(db.execute(text(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t)"
+        ), {"t": _TABLE}).scalar())
+    return _partitioned
+
+
+def forget():
+    """清空本进程的分区缓存（其他进程卸载了分区或转换了表之后，下次导入重新从 pg_inherits 确认）"""
+    global _partitioned
+    _created.clear()
+    _partitioned = None
+
+
+def is_missing_partition(exc: BaseException) -> bool:
+    """写入时是否因为没有对应的分区失败（分区已被其他进程卸载，或本进程的缓存过期）"""
+    return "no partition of relation" in str(exc)
+
+
+def _attached(db: Session, name: str) -> bool:
+    return bool(db.execute(text(
+        "SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:n) AND inhparent = to_regclass(:t)"
+    ), {"n": name, "t": _TABLE}).scalar())
+
+
+def _create_partition(db: Session, name: str, lo: int, hi: int) -> bool:
+    """创建一个分区；已存在（包括并发导入刚刚创建）时返回 False"""
+    try:
+        with db.begin_nested():
+            db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {_TABLE} FOR VALUES FROM ({lo}) TO ({hi})"
+            ))
+        return True
+    except Exception as e:
+        # 并发创建同名分区，或该时间段已被其他粒度的分区覆盖
+        print(f"Warning: partition {name} not created: {e}")
+        return False
+
+
+def ensure_for_timestamps(db: Session, timestamps: Iterable[Optional[int]]) -> List[Tuple[str, int, int]]:
+    """确保这些时间戳所在的分区都存在（在导入批次的事务中、写入数据之前调用）
+
+    返回仍没有挂载分区覆盖的 [(分区名, 起始时间戳, 结束时间戳)]：detach 未加 --drop 时同名的表仍然存在，
+    CREATE TABLE IF NOT EXISTS 什么也不做，调用方应跳过落在这些范围内的行。
+    本进程已确认挂载的分区会被缓存，正常导入时只是一次集合查找；未挂载的分区不缓存，下一个批次会再次确认
+    """
+    days = {ts // 86400 for ts in timestamps if ts is not None}
+    if not days:
+        return []
+    unit = interval()
+    needed: Dict[str, Tuple[int, int]] = {}
+    for day in days:
+        name, lo, hi = partition_for(day * 86400, unit)
+        if name not in _created:
+            needed[name] = (lo, hi)
+    if not needed or not is_partitioned(db):
+        return []
+    missing = []
+    for name, (lo, hi) in sorted(needed.items()):
+        _create_partition(db, name, lo, hi)
+        # CREATE TABLE IF NOT EXISTS 遇到同名的已卸载表时什么也不做，以实际挂载情况为准
+        if _attached(db, name):
+            _created.add(name)
+        else:
+            missing.append((name, lo, hi))
+    return missing
+
+
+def ensure_range(db: Session, start_ts: int, end_ts: int) -> int:
+    """创建覆盖 [start_ts, end_ts] 的全部分区，返回处理的分区数"""
+    unit = interval()
+    count = 0
+    ts = start_ts
+    while ts <= end_ts:
+        name, lo, hi = partition_for(ts, unit)
+        _create_partition(db, name, lo, hi)
+        if _attached(db, name):
+            _created.add(name)
+        count += 1
+        ts = hi
+    return count
+
+
+def list_partitions(db: Session) -> List[Dict[str, object]]:
+    """当前挂载的分区：[{name, start_ts, end_ts}]，按起始时间排序"""
+    rows = db.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:t)"
+    ), {"t": _TABLE}).all()
+    result = []
+    for name, bound in rows:
+        m = _BOUND_RE.search(bound or "")
+        result.append({
+            "name": name,
+            "start_ts": int(m.group(1)) if m else None,
+            "end_ts": int(m.group(2)) if m else None,
+        })
+    result.sort(key=lambda p: (p["start_ts"] is None, p["start_ts"] or 0))
+    return result
+
+
+def detach_before(db: Session, before_ts: int, drop: bool = False) -> List[str]:
+    """卸载结束时间不晚于 before_ts 的分区（drop=True 时同时删除），不提交，返回处理的分区名
+
+    在同一事务中重建被卸载时间范围内的 match_rollups 时间桶，使 rollup 路径与原始记录保持一致
+    （调用方随后增加数据版本号并提交）
+    """
+    names = []
+    detached_end = None
+    for p in list_partitions(db):
+        if p["end_ts"] is None or p["end_ts"] > before_ts:
+            continue
+        db.execute(text(f"ALTER TABLE {_TABLE} DETACH PARTITION {p['name']}"))
+        if drop:
+            db.execute(text(f"DROP TABLE {p['name']}"))
+        _created.discard(p["name"])
+        names.append(p["name"])
+        detached_end = max(detached_end or p["end_ts"], p["end_ts"])
+    if detached_end is not None:
+        rollups.rebuild_range(db, None, detached_end)
+    return names
@@ -0,0 +1,124 @@
+"""
+只读副本路由 - 统计查询与导出优先在副本（POSTGRES_READ_HOST）上执行，导入等写入始终走主库
+副本是否足够新由数据版本号 import_generation 判断：每个导入批次在主库上把版本号加一，随数据一起复制到副本，
+副本的版本号落后主库超过 REPLICA_MAX_LAG（默认 0，即必须一致）时该次查询回退到主库；
+主库的版本号最多缓存 REPLICA_CHECK_SEC（默认 1 秒），避免每个请求都多一次主库查询
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from backend.app.database import replica_enabled
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+class _State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.primary_generation: Optional[int] = None
+        self.checked_at = 0.0
+        self.replica_generation: Optional[int] = None
+        self.replica_reads = 0
+        self.primary_fallbacks = 0
+        self.replica_errors = 0
+        self.last_error: Optional[str] = None
+
+
+_STATE = _State()
+
+
+def _primary_generation(db: Session, generation: Optional[int]) -> int:
+    from backend.app.stats_cache import current_generation
+
+    now = time.monotonic()
+    with _STATE.lock:
+        if generation is not None:
+            _STATE.primary_generation, _STATE.checked_at = generation, now
+            return generation
+        if _STATE.primary_generation is not None and now - _STATE.checked_at < _float_env("REPLICA_CHECK_SEC", 1.0):
+            return _STATE.primary_generation
+    generation = current_generation(db)
+    with _STATE.lock:
+        _STATE.primary_generation, _STATE.checked_at = generation, now
+    return generation
+
+
+def replica_generation(read_db: Session) -> Optional[int]:
+    """副本上的数据版本号；副本不可用（或表不存在）时返回 None"""
+    from backend.app.stats_cache import current_generation
+
+    try:
+        generation = current_generation(read_db)
+    except Exception as e:
+        read_db.rollback()
+        with _STATE.lock:
+            _STATE.replica_errors += 1
+            _STATE.last_error = str(e).splitlines()[0]
+        print(f"Warning: read replica unavailable, using primary: {_STATE.last_error}")
+        return None
+    with _STATE.lock:
+        _STATE.replica_generation = generation
+    return generation
+
+
+def may_lag() -> bool:
+    """统计结果是否可能来自落后于主库的副本（配置了副本且 REPLICA_MAX_LAG > 0）"""
+    return replica_enabled() and _int_env("REPLICA_MAX_LAG", 0) > 0
+
+
+def pick(db: Session, read_db: Optional[Session],
+         generation: Optional[int] = None) -> Tuple[Session, Optional[int]]:
+    """选择执行统计查询的会话，返回 (会话, 该会话上的数据版本号)
+
+    副本可用且不落后时返回 read_db，否则返回主库会话 db（版本号为 generation）；
+    generation 为调用方刚从主库读到的版本号（有则不再查询主库）
+    """
+    if read_db is None or read_db is db or not replica_enabled():
+        return db, generation
+    lag_limit = _int_env("REPLICA_MAX_LAG", 0)
+    replica_gen = replica_generation(read_db)
+    if replica_gen is not None and replica_gen >= _primary_generation(db, generation) - lag_limit:
+        with _STATE.lock:
+            _STATE.replica_reads += 1
+        return read_db, replica_gen
+    with _STATE.lock:
+        _STATE.primary_fallbacks += 1
+    return db, generation
+
+
+def status(db: Session, read_db: Optional[Session]) -> Dict[str, object]:
+    """副本路由状态（本进程计数）与当前主库/副本的数据版本号"""
+    from backend.app.stats_cache import current_generation
+
+    info = {"enabled": replica_enabled(), "max_lag": _int_env("REPLICA_MAX_LAG", 0)}
+    if not replica_enabled() or read_db is None:
+        return info
+    primary = current_generation(db)
+    replica = replica_generation(read_db)
+    with _STATE.lock:
+        info.update({
+            "primary_generation": primary,
+            "replica_generation": replica,
+            "lag": primary - replica if replica is not None else None,
+            "replica_reads": _STATE.replica_reads,
+            "primary_fallbacks": _STATE.primary_fallbacks,
+            "replica_errors": _STATE.replica_errors,
+            "last_error": _STATE.last_error,
+        })
+    return info
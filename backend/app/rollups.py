@@ -0,0 +1,336 @@
+"""
+预聚合（rollup）维护 - match_rollups 表
+导入时把每个批次实际插入的行在内存中先聚合，再在同一事务中累加到 match_rollups；
+统计接口的过滤条件只涉及 rollup 维度时直接查询该表，避免对 match_records 做全表 GROUP BY
+"""
+import math
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Integer, Text, and_, case, cast, delete, func, literal_column, select, text, true
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert as pg_insert
+from sqlalchemy.orm import Session
+
+from backend.app.models import MatchRecord, MatchRollup
+
+
+# 插入 match_records 时 RETURNING 的列，aggregate() 按此顺序读取（其后可以有其他列）
+SOURCE_COLUMNS = (
+    "server",
+    "timestamp",
+    "level",
+    "clazz",
+    "schools",
+    "opponent_class",
+    "opponent_schools",
+    "is_win",
+    "duration",
+    "source_type",
+    "league",
+    "win_valid",
+    "duration_valid",
+)
+
+_KEY_COLUMNS = ("bucket_ts", "server", "clazz", "schools", "source_type",
+                "opponent_class", "opponent_schools", "level_band")
+
+# 只有这些过滤条件可以由 rollup 回答；其余（宠物、符文、超级护甲、积分比例）需要扫描原始记录
+_ROLLUP_FILTERS = {"servers", "start_ts", "end_ts", "min_level", "max_level", "clazz", "schools",
+                   "opponent_class", "opponent_schools", "source_types", "sort", "min_matches"}
+
+
+# 时长直方图（可合并的分位数草图）：<60 秒每 1 秒一桶，<600 秒每 5 秒，<3600 秒每 30 秒，其余落入溢出桶。
+# 由直方图估算的分位数误差不超过所在桶的宽度：60 秒以内精确，600 秒以内 ≤5 秒，3600 秒以内 ≤30 秒
+_HIST_RANGES = ((0, 60, 1), (60, 600, 5), (600, 3600, 30))
+HIST_BUCKETS = sum((hi - lo) // width for lo, hi, width in _HIST_RANGES) + 1
+_OVERFLOW = HIST_BUCKETS - 1
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def bucket_sec() -> int:
+    """时间桶宽度（秒），默认 1 小时"""
+    return _int_env("ROLLUP_BUCKET_SEC", 3600)
+
+
+def level_band() -> int:
+    """等级段宽度，默认 10 级"""
+    return _int_env("ROLLUP_LEVEL_BAND", 10)
+
+
+def serving_enabled() -> bool:
+    """STATS_ROLLUPS=1 时统计接口才使用 rollup（需先运行 scripts/rebuild_rollups.py 补齐历史数据）"""
+    return os.environ.get("STATS_ROLLUPS", "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+def expand_source_types(source_type, league, win_valid, duration_valid) -> List[int]:
+    """与 crud._source_type_expansion 相同的展开规则（Python 版）"""
+    if league is None:
+        return [source_type]
+    types = []
+    if win_valid or not duration_valid:
+        types.append(league)
+    if duration_valid:
+        types.append(league + 3)
+    return types
+
+
+def duration_bucket(duration: int) -> int:
+    """时长所在的直方图桶（从 0 开始）"""
+    offset = 0
+    for lo, hi, width in _HIST_RANGES:
+        if duration < hi:
+            return offset + (max(duration, lo) - lo) // width
+        offset += (hi - lo) // width
+    return _OVERFLOW
+
+
+def duration_bucket_sql(col):
+    """duration_bucket 的 SQL 版本（从 1 开始，与 PostgreSQL 数组下标一致）"""
+    whens = []
+    offset = 1
+    for lo, hi, width in _HIST_RANGES:
+        whens.append((col < hi, offset + (func.greatest(col, lo) - lo) // width))
+        offset += (hi - lo) // width
+    return case(*whens, else_=offset)
+
+
+def _bucket_bounds(idx: int) -> Tuple[int, Optional[int]]:
+    """桶 idx 的 [下界, 上界)，溢出桶的上界为 None"""
+    for lo, hi, width in _HIST_RANGES:
+        n = (hi - lo) // width
+        if idx < n:
+            return lo + idx * width, lo + (idx + 1) * width
+        idx -= n
+    return _HIST_RANGES[-1][1], None
+
+
+def hist_percentile(hist: Sequence[int], p: float, dmin: Optional[int], dmax: Optional[int]) -> Optional[float]:
+    """由合并后的直方图估算 percentile_disc(p)：找到累计计数达到 ceil(p*N) 的桶，并假设桶内均匀分布
+
+    结果限制在 [dmin, dmax] 内；1 秒宽的桶给出精确值，其他桶的误差不超过桶宽
+    """
+    total = sum(hist)
+    if total <= 0:
+        return None
+    rank = max(1, math.ceil(p * total))
+    # 第一名与最后一名就是最短/最长时长，直接返回精确值
+    if rank == 1 and dmin is not None:
+        return float(dmin)
+    if rank == total and dmax is not None:
+        return float(dmax)
+    seen = 0
+    for idx, count in enumerate(hist):
+        if count and seen + count >= rank:
+            lo, hi = _bucket_bounds(idx)
+            if hi is None:
+                hi = (dmax if dmax is not None else lo) + 1
+            value = lo + (hi - lo) * (rank - seen - 1) // count
+            if dmin is not None:
+                value = max(value, dmin)
+            if dmax is not None:
+                value = min(value, dmax)
+            return float(value)
+        seen += count
+    return float(dmax) if dmax is not None else None
+
+
+def aggregate(rows: Iterable[Sequence]) -> Dict[tuple, list]:
+    """把以 SOURCE_COLUMNS 开头的行聚合为 {rollup 键: [胜, 负, 场次, 时长和, 最短, 最长, {直方图桶: 计数}]}"""
+    bucket = bucket_sec()
+    band = level_band()
+    cells: Dict[tuple, list] = {}
+    for (server, ts, level, clazz, schools, opp_class, opp_schools, is_win, duration,
+         source_type, league, win_valid, duration_valid, *_) in rows:
+        bucket_ts = ts // bucket * bucket
+        level_start = level // band * band
+        win = 1 if is_win == 1 else 0
+        lose = 1 if is_win == 0 else 0
+        hist_idx = duration_bucket(duration)
+        for st in expand_source_types(source_type, league, win_valid, duration_valid):
+            key = (bucket_ts, server, clazz, schools, st, opp_class, opp_schools, level_start)
+            cell = cells.get(key)
+            if cell is None:
+                cells[key] = [win, lose, 1, duration, duration, duration, {hist_idx: 1}]
+            else:
+                cell[0] += win
+                cell[1] += lose
+                cell[2] += 1
+                cell[3] += duration
+                if duration < cell[4]:
+                    cell[4] = duration
+                if duration > cell[5]:
+                    cell[5] = duration
+                hist = cell[6]
+                hist[hist_idx] = hist.get(hist_idx, 0) + 1
+    return cells
+
+
+def _dense_hist(sparse: Dict[int, int]) -> List[int]:
+    hist = [0] * HIST_BUCKETS
+    for idx, count in sparse.items():
+        hist[idx] = count
+    return hist
+
+
+def upsert(db: Session, cells: Dict[tuple, list]):
+    """把聚合结果累加到 match_rollups（不提交）；按键排序写入，避免并行导入时互相死锁"""
+    if not cells:
+        return
+    params = [
+        dict(zip(_KEY_COLUMNS, key), win_count=c[0], lose_count=c[1], match_count=c[2],
+             duration_sum=c[3], duration_min=c[4], duration_max=c[5], duration_hist=_dense_hist(c[6]))
+        for key, c in sorted(cells.items())
+    ]
+    stmt = pg_insert(MatchRollup)
+    t = MatchRollup.__table__
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(_KEY_COLUMNS),
+        set_={
+            "win_count": t.c.win_count + stmt.excluded.win_count,
+            "lose_count": t.c.lose_count + stmt.excluded.lose_count,
+            "match_count": t.c.match_count + stmt.excluded.match_count,
+            "duration_sum": t.c.duration_sum + stmt.excluded.duration_sum,
+            "duration_min": func.least(t.c.duration_min, stmt.excluded.duration_min),
+            "duration_max": func.greatest(t.c.duration_max, stmt.excluded.duration_max),
+            # 直方图逐桶相加（旧数据没有直方图时视为全 0）
+            "duration_hist": literal_column(
+                f"ARRAY(SELECT coalesce(h.a, 0) + coalesce(h.b, 0) "
+                f"FROM unnest({t.name}.duration_hist, excluded.duration_hist) WITH ORDINALITY AS h(a, b, i) "
+                f"ORDER BY h.i)"
+            ),
+        },
+    )
+    db.execute(stmt, params)
+
+
+def apply_inserted(db: Session, rows: Sequence[Sequence]):
+    """导入批次提交前调用：rows 为本批次实际插入（未被指纹去重跳过）的行"""
+    if rows:
+        upsert(db, aggregate(rows))
+
+
+def _rebuild_select(start_ts: Optional[int] = None, end_ts: Optional[int] = None):
+    """从 match_records 聚合 rollup 行的查询（可限定 timestamp 在 [start_ts, end_ts) 内），返回 (查询, 列名)"""
+    from backend.app.crud import _source_type_expansion
+
+    bucket = bucket_sec()
+    band = level_band()
+    st = _source_type_expansion()
+    bucket_ts = MatchRecord.timestamp // bucket * bucket
+    level_start = MatchRecord.level // band * band
+    keys = [bucket_ts, MatchRecord.server, MatchRecord.clazz, MatchRecord.schools, st.c.source_type,
+            MatchRecord.opponent_class, MatchRecord.opponent_schools, level_start]
+    # 第一层：按 rollup 键 + 直方图桶聚合；第二层：合并为 rollup 行，直方图先收集为 {桶: 计数}；
+    # 第三层：展开为定长数组
+    hist_idx = duration_bucket_sql(MatchRecord.duration).label("hist_idx")
+    key_labels = list(_KEY_COLUMNS)
+    l1 = (
+        select(
+            *(k.label(name) for k, name in zip(keys, key_labels)),
+            hist_idx,
+            func.sum(case((MatchRecord.is_win == 1, 1), else_=0)).label("win_count"),
+            func.sum(case((MatchRecord.is_win == 0, 1), else_=0)).label("lose_count"),
+            func.count().label("match_count"),
+            func.sum(MatchRecord.duration).label("duration_sum"),
+            func.min(MatchRecord.duration).label("duration_min"),
+            func.max(MatchRecord.duration).label("duration_max"),
+        )
+        .select_from(MatchRecord)
+        .join(st, true())
+        .where(st.c.source_type.isnot(None))
+    )
+    if start_ts is not None:
+        l1 = l1.where(MatchRecord.timestamp >= start_ts)
+    if end_ts is not None:
+        l1 = l1.where(MatchRecord.timestamp < end_ts)
+    l1 = l1.group_by(*keys, hist_idx).subquery("l1")
+    l1_keys = [l1.c[name] for name in key_labels]
+    l2 = (
+        select(
+            *l1_keys,
+            func.sum(l1.c.win_count).label("win_count"),
+            func.sum(l1.c.lose_count).label("lose_count"),
+            func.sum(l1.c.match_count).label("match_count"),
+            func.sum(l1.c.duration_sum).label("duration_sum"),
+            func.min(l1.c.duration_min).label("duration_min"),
+            func.max(l1.c.duration_max).label("duration_max"),
+            func.jsonb_object_agg(l1.c.hist_idx, l1.c.match_count).label("hist_map"),
+        )
+        .group_by(*l1_keys)
+        .subquery("l2")
+    )
+    slot = func.generate_series(1, HIST_BUCKETS).column_valued("slot")
+    hist = (
+        select(func.array_agg(aggregate_order_by(
+            func.coalesce(l2.c.hist_map.op("->>")(cast(slot, Text)).cast(Integer), 0), slot
+        )))
+        .scalar_subquery()
+    )
+    q = select(*(l2.c[name] for name in key_labels),
+               l2.c.win_count, l2.c.lose_count, l2.c.match_count,
+               l2.c.duration_sum, l2.c.duration_min, l2.c.duration_max, hist)
+    cols = list(_KEY_COLUMNS) + ["win_count", "lose_count", "match_count",
+                                 "duration_sum", "duration_min", "duration_max", "duration_hist"]
+    return q, cols
+
+
+def rebuild(db: Session) -> int:
+    """从 match_records 全量重建 match_rollups，返回 rollup 行数（调用方提交）"""
+    q, cols = _rebuild_select()
+    db.execute(text(f"TRUNCATE TABLE {MatchRollup.__tablename__}"))
+    result = db.execute(MatchRollup.__table__.insert().from_select(cols, q))
+    return result.rowcount
+
+
+def rebuild_range(db: Session, start_ts: Optional[int], end_ts: int) -> int:
+    """按 match_records 当前的数据重建 [start_ts, end_ts) 内的时间桶（start_ts 为 None 表示更早的全部），
+    返回重建的 rollup 行数（调用方提交）
+
+    用于卸载分区等成批删除原始记录之后；范围两端按桶宽度向外取整，跨边界的桶由剩余的记录重新聚合
+    """
+    bucket = bucket_sec()
+    lo = start_ts // bucket * bucket if start_ts is not None else None
+    hi = -(-end_ts // bucket) * bucket
+    cond = MatchRollup.bucket_ts < hi
+    if lo is not None:
+        cond = and_(cond, MatchRollup.bucket_ts >= lo)
+    db.execute(delete(MatchRollup).where(cond))
+    q, cols = _rebuild_select(lo, hi)
+    return db.execute(MatchRollup.__table__.insert().from_select(cols, q)).rowcount
+
+
+def unsupported_filters(filters: dict) -> List[str]:
+    """返回 rollup 无法回答的过滤条件（空列表表示可以走 rollup）"""
+    reasons = []
+    for key, value in filters.items():
+        if key in _ROLLUP_FILTERS or value is None or value == []:
+            continue
+        # 宠物天赋只在指定了宠物时生效
+        if key == "spirit_animal_talents" and not filters.get("spirit_animal"):
+            continue
+        reasons.append(key)
+    bucket = bucket_sec()
+    band = level_band()
+    # 时间 / 等级范围必须与桶边界对齐（end_ts、max_level 为闭区间）
+    if filters.get("start_ts") is not None and filters["start_ts"] % bucket:
+        reasons.append("start_ts")
+    if filters.get("end_ts") is not None and (filters["end_ts"] + 1) % bucket:
+        reasons.append("end_ts")
+    if filters.get("min_level") is not None and filters["min_level"] % band:
+        reasons.append("min_level")
+    if filters.get("max_level") is not None and (filters["max_level"] + 1) % band:
+        reasons.append("max_level")
+    return reasons
+
+
+def choose_path(filters: dict) -> str:
+    """决定查询路径："rollup" 或 "raw"（未启用 STATS_ROLLUPS 或有 rollup 无法回答的过滤条件）"""
+    if not serving_enabled() or unsupported_filters(filters):
+        return "raw"
+    return "rollup"
@@ -13,19 +13,60 @@ SERVER_MAP = {
     8010: "公会服"
 }
 
+# 区服合并：成员区服 -> 代表区服（统计时合并为同一组，未列出的区服自成一组）
+# 入库时据此写入 match_records.server_group，查询与展示共用这一份映射
+SERVER_GROUP_MAP = {
+    8002: 8001,
+    8004: 8001,
+    8027: 8024,
+}
+
+
+def get_server_group(server_id: int) -> int:
+    """区服所属的合并组（以代表区服 ID 表示）"""
+    return SERVER_GROUP_MAP.get(server_id, server_id)
+
+
+def server_group_members(group_id: int) -> set:
+    """合并组包含的全部区服"""
+    return {group_id} | {s for s, g in SERVER_GROUP_MAP.items() if g == group_id}
+
+
+# 灵宠 + 天赋打包：pet_id * PET_TALENT_BASE + 天赋值，写入 match_records.pet_talent_packed，
+# 按位置配对的 (灵宠, 天赋) 可以直接用数组运算符 && 与 GIN 索引过滤
+PET_TALENT_BASE = 100
+_PET_ID_MAX = (2 ** 31 - 1) // PET_TALENT_BASE - 1
+
+
+def pack_pet_talent(pet_id: Optional[int], talent: Optional[int]) -> Optional[int]:
+    """打包一对 (灵宠, 天赋)，缺少天赋按 0 处理；超出可打包范围（天赋不在 0..99 或灵宠 ID 过大/为负）时返回 None"""
+    if pet_id is None:
+        return None
+    talent = talent or 0
+    if not (0 <= talent < PET_TALENT_BASE and 0 <= pet_id <= _PET_ID_MAX):
+        return None
+    return pet_id * PET_TALENT_BASE + talent
+
+
+def pack_pet_talents(pets: Optional[List[Optional[int]]],
+                     talents: Optional[List[Optional[int]]]) -> Optional[List[int]]:
+    """按位置配对打包灵宠与天赋（与视图 match_pet_talent_v 的配对方式一致），无法打包的配对不写入"""
+    if pets is None:
+        return None
+    talents = talents or []
+    packed = []
+    for idx, pet_id in enumerate(pets):
+        value = pack_pet_talent(pet_id, talents[idx] if idx < len(talents) else None)
+        if value is not None:
+            packed.append(value)
+    return packed
+
+
 def get_server_name(server_id: int) -> str:
-    """获取服务器名称，支持合并逻辑的兜底"""
-    # 先尝试直接查找
-    name = SERVER_MAP.get(server_id)
+    """获取服务器名称，未配置时回退到所属合并组的名称"""
+    name = SERVER_MAP.get(server_id) or SERVER_MAP.get(get_server_group(server_id))
     if name:
         return name
-    # 如果找不到，尝试合并逻辑的映射
-    # 8024/8027 合并为 8024
-    if server_id == 8027:
-        return SERVER_MAP.get(8024, f"未知区服({server_id})")
-    # 8001/8002/8004 合并为 8001
-    if server_id in [8002, 8004]:
-        return SERVER_MAP.get(8001, f"未知区服({server_id})")
     return f"未知区服({server_id})"
 
 # 职业映射
@@ -0,0 +1,330 @@
+"""
+统计结果缓存 - /api/stats/* 前的两级缓存
+L1：进程内 LRU；L2：PostgreSQL UNLOGGED 表 stats_cache，多个 uvicorn worker 共享。
+缓存键是规范化后的过滤条件指纹（不含排序，排序在内存中完成），缓存项带有数据版本号 import_generation，
+任何导入批次写入新数据后版本号加一，旧缓存自然失效；另有条目数上限与 TTL
+分页请求（limit/cursor）优先从已缓存的完整结果中取页，否则把分页下推到 SQL，并按页（含排序与游标）缓存
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from backend.app import replica
+from backend.app.crud import decode_cursor, page_keys, paginate_rows, query_page, result_columns, sort_rows
+from backend.app.database import offload
+from backend.app.models import ImportGeneration, StatsCacheEntry
+
+
+def _enabled() -> bool:
+    return os.environ.get("STATS_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.l2_errors = 0
+
+    def incr(self, name: str, n: int = 1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + n)
+
+
+class _LRU:
+    """进程内 LRU：{key: (generation, expires_at, payload)}"""
+
+    def __init__(self, max_entries: int):
+        self._max = max_entries
+        self._data: "OrderedDict[str, Tuple[int, float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, generation: int) -> Optional[dict]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            gen, expires_at, payload = item
+            if gen != generation or expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return payload
+
+    def put(self, key: str, generation: int, expires_at: float, payload: dict) -> int:
+        """写入并返回淘汰的条目数"""
+        evicted = 0
+        with self._lock:
+            self._data[key] = (generation, expires_at, payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self._max:
+                self._data.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_STATS = _Stats()
+_L1 = _LRU(_int_env("STATS_CACHE_SIZE", 256))
+_l2_disabled = os.environ.get("STATS_CACHE_SHARED", "1").strip().lower() in ("0", "false", "no", "off")
+# 共享缓存出错（连接问题、超时、锁等待等）后暂停使用到该时间点，之后自动重试
+_l2_retry_at = 0.0
+_l2_writes = 0
+
+
+def bump_generation(db: Session) -> int:
+    """数据版本号加一（不提交，由导入批次与数据一起提交），返回新的版本号"""
+    stmt = pg_insert(ImportGeneration).values(id=1, generation=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ImportGeneration.id],
+        set_={"generation": ImportGeneration.__table__.c.generation + 1},
+    ).returning(ImportGeneration.generation)
+    return db.execute(stmt).scalar_one()
+
+
+def current_generation(db: Session) -> int:
+    gen = db.execute(select(ImportGeneration.generation).where(ImportGeneration.id == 1)).scalar()
+    return gen or 0
+
+
+def cache_key(metric: str, group_by_opponent: bool, filters: dict) -> str:
+    """规范化过滤条件（去掉空值与排序，列表排序去重）后取指纹"""
+    norm = {}
+    for k, v in filters.items():
+        if k == "sort" or v is None or v == []:
+            continue
+        norm[k] = sorted(set(v)) if isinstance(v, (list, tuple, set)) else v
+    raw = json.dumps([metric, bool(group_by_opponent), norm], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"not JSON serializable: {type(value)!r}")
+
+
+def _encode(payload: dict) -> Tuple[str, dict]:
+    """序列化缓存项，返回 (JSON 文本, 解码后的对象)；解码后的对象与从共享缓存读到的完全一致（Decimal 已转为 float）"""
+    raw = json.dumps(payload, default=_json_default)
+    return raw, json.loads(raw)
+
+
+def _l2_available() -> bool:
+    return not _l2_disabled and time.time() >= _l2_retry_at
+
+
+def _is_undefined_table(exc: BaseException) -> bool:
+    """共享缓存表不存在（SQLSTATE 42P01）"""
+    orig = getattr(exc, "orig", None) or exc
+    code = getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None) \
+        or getattr(getattr(orig, "__cause__", None), "sqlstate", None)
+    return code == "42P01"
+
+
+def _l2_failed(exc: BaseException):
+    """共享缓存表不存在时永久停用，其他错误暂停 STATS_CACHE_SHARED_BACKOFF_SEC 秒（默认 30）后重试"""
+    global _l2_disabled, _l2_retry_at
+    _STATS.incr("l2_errors")
+    if _is_undefined_table(exc):
+        print(f"Warning: shared stats cache disabled: {exc}")
+        _l2_disabled = True
+        return
+    backoff = _int_env("STATS_CACHE_SHARED_BACKOFF_SEC", 30)
+    print(f"Warning: shared stats cache unavailable, retrying in {backoff}s: {exc}")
+    _l2_retry_at = time.time() + backoff
+
+
+def _l2_get(db: Session, key: str, generation: int) -> Optional[dict]:
+    """读取共享缓存；在保存点中执行，出错时只回滚保存点，不影响会话上已设置的 statement_timeout（SET LOCAL）"""
+    if not _l2_available():
+        return None
+    try:
+        with db.begin_nested():
+            raw = db.execute(
+                select(StatsCacheEntry.payload).where(
+                    StatsCacheEntry.cache_key == key,
+                    StatsCacheEntry.generation == generation,
+                    StatsCacheEntry.expires_at > int(time.time()),
+                )
+            ).scalar()
+    except Exception as e:
+        _l2_failed(e)
+        return None
+    return offload(json.loads, raw) if raw is not None else None
+
+
+def _l2_put(db: Session, key: str, generation: int, expires_at: int, payload: str):
+    """写入共享缓存；每 50 次写入清理一次过期/旧版本条目，并把条目数限制在 STATS_CACHE_SHARED_SIZE 以内
+
+    写入在保存点中执行，出错时只回滚保存点，随后的提交不受影响
+    """
+    global _l2_writes
+    if not _l2_available():
+        return
+    try:
+        with db.begin_nested():
+            stmt = pg_insert(StatsCacheEntry).values(
+                cache_key=key, generation=generation, expires_at=expires_at, payload=payload)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[StatsCacheEntry.cache_key],
+                set_={"generation": generation, "expires_at": expires_at, "payload": payload},
+            )
+            db.execute(stmt)
+            _l2_writes += 1
+            if _l2_writes % 50 == 0:
+                db.execute(delete(StatsCacheEntry).where(
+                    (StatsCacheEntry.generation != generation) | (StatsCacheEntry.expires_at <= int(time.time()))
+                ))
+                max_rows = _int_env("STATS_CACHE_SHARED_SIZE", 10000)
+                overflow = db.execute(select(func.count()).select_from(StatsCacheEntry)).scalar() - max_rows
+                if overflow > 0:
+                    oldest = select(StatsCacheEntry.cache_key).order_by(StatsCacheEntry.expires_at).limit(overflow)
+                    db.execute(delete(StatsCacheEntry).where(StatsCacheEntry.cache_key.in_(oldest)))
+                    _STATS.incr("evictions", overflow)
+    except Exception as e:
+        _l2_failed(e)
+        return
+    try:
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        _l2_failed(e)
+
+
+def _columnar_kwargs(metric: str, db: Session, source: Session, generation: Optional[int] = None) -> dict:
+    """查询落在只读副本上时，把主库的数据版本号交给列式引擎（列式快照从主库加载，见 columnar._ready_view）"""
+    if metric not in ("winrate", "duration") or source is db:
+        return {}
+    return {"primary_generation": current_generation(db) if generation is None else generation}
+
+
+def cached_query(db: Session, metric: str, compute: Callable[..., Tuple[Sequence, str]],
+                 group_by_opponent: bool, read_db: Optional[Session] = None,
+                 **filters) -> Tuple[List[list], str, str]:
+    """带缓存地执行 crud 的统计查询，返回 (结果行, 查询路径, 缓存层级 l1/l2/miss/off)
+
+    compute 为 crud.query_winrate_routed / query_duration_routed；缓存的是未排序的结果，排序在内存中完成。
+    db 为主库会话（数据版本号与共享缓存表都在主库）；给定只读副本会话 read_db 时，未命中缓存的查询
+    在副本不落后于主库的前提下在副本上执行（见 replica.pick）
+    """
+    sort = filters.pop("sort", None)
+    columns = result_columns(metric, group_by_opponent)
+
+    if not _enabled():
+        source, _ = replica.pick(db, read_db)
+        rows, path = compute(source, group_by_opponent, sort=sort, **_columnar_kwargs(metric, db, source), **filters)
+        return [list(r) for r in rows], path, "off"
+
+    key = cache_key(metric, group_by_opponent, filters)
+    generation = current_generation(db)
+    payload = _L1.get(key, generation)
+    tier = "l1"
+    if payload is None:
+        payload = _l2_get(db, key, generation)
+        tier = "l2"
+        if payload is not None:
+            _L1.put(key, generation, payload["expires_at"], payload)
+    if payload is not None:
+        _STATS.incr("l1_hits" if tier == "l1" else "l2_hits")
+        return offload(sort_rows, payload["rows"], sort, columns), payload["path"], tier
+
+    _STATS.incr("misses")
+    source, data_generation = replica.pick(db, read_db, generation)
+    rows, path = compute(source, group_by_opponent, **_columnar_kwargs(metric, db, source, generation), **filters)
+    if data_generation != generation:
+        # 允许副本落后（REPLICA_MAX_LAG > 0）时，旧版本数据算出的结果不写入缓存
+        return offload(sort_rows, [list(r) for r in rows], sort, columns), path, "miss"
+    expires_at = int(time.time()) + _int_env("STATS_CACHE_TTL_SEC", 300)
+    raw, payload = offload(_encode, {"rows": [list(r) for r in rows], "path": path, "expires_at": expires_at})
+    _STATS.incr("evictions", _L1.put(key, generation, expires_at, payload))
+    _l2_put(db, key, generation, expires_at, raw)
+    return offload(sort_rows, payload["rows"], sort, columns), path, "miss"
+
+
+def cached_page(db: Session, metric: str, group_by_opponent: bool, limit: int, cursor: Optional[str] = None,
+                read_db: Optional[Session] = None, **filters) -> Tuple[Dict[str, object], str]:
+    """带缓存地取统计结果的一页，返回 ({"rows", "total", "next_cursor", "path"}, 缓存层级)
+
+    同样条件的完整结果已在缓存中时直接在内存中分页；否则执行 crud.query_page（排序、游标与 LIMIT 下推到 SQL），
+    结果按页缓存。游标无效时抛出 ValueError
+    """
+    columns = result_columns(metric, group_by_opponent)
+    keys = page_keys(filters.get("sort"), metric, group_by_opponent)
+    cursor_values = decode_cursor(cursor, keys) if cursor else None
+
+    if not _enabled():
+        source, _ = replica.pick(db, read_db)
+        return query_page(source, metric, group_by_opponent, limit, cursor,
+                          **_columnar_kwargs(metric, db, source), **filters), "off"
+
+    full_key = cache_key(metric, group_by_opponent, filters)
+    page_key = cache_key(metric, group_by_opponent, dict(
+        filters, page_sort=[f"{n}:{'desc' if d else 'asc'}" for n, d in keys], page_limit=limit, page_cursor=cursor))
+    generation = current_generation(db)
+    full = _L1.get(full_key, generation)
+    if full is not None:
+        _STATS.incr("l1_hits")
+        rows, next_cursor = offload(paginate_rows, full["rows"], keys, columns, limit, cursor_values)
+        return {"rows": rows, "total": len(full["rows"]), "next_cursor": next_cursor, "path": full["path"]}, "l1"
+    payload = _L1.get(page_key, generation)
+    tier = "l1"
+    if payload is None:
+        payload = _l2_get(db, page_key, generation)
+        tier = "l2"
+        if payload is not None:
+            _L1.put(page_key, generation, payload["expires_at"], payload)
+    if payload is not None:
+        _STATS.incr("l1_hits" if tier == "l1" else "l2_hits")
+        return payload, tier
+
+    _STATS.incr("misses")
+    source, data_generation = replica.pick(db, read_db, generation)
+    page = query_page(source, metric, group_by_opponent, limit, cursor,
+                      **_columnar_kwargs(metric, db, source, generation), **filters)
+    if data_generation != generation:
+        return page, "miss"
+    expires_at = int(time.time()) + _int_env("STATS_CACHE_TTL_SEC", 300)
+    raw, payload = offload(_encode, dict(page, expires_at=expires_at))
+    _STATS.incr("evictions", _L1.put(page_key, generation, expires_at, payload))
+    _l2_put(db, page_key, generation, expires_at, raw)
+    return payload, "miss"
+
+
+def cache_stats(db: Session) -> Dict[str, object]:
+    """缓存命中情况（本进程计数）"""
+    with _STATS.lock:
+        lookups = _STATS.l1_hits + _STATS.l2_hits + _STATS.misses
+        return {
+            "enabled": _enabled(),
+            "shared_enabled": not _l2_disabled,
+            "shared_available": _l2_available(),
+            "generation": current_generation(db),
+            "l1_entries": len(_L1),
+            "l1_hits": _STATS.l1_hits,
+            "l2_hits": _STATS.l2_hits,
+            "misses": _STATS.misses,
+            "hit_rate": (_STATS.l1_hits + _STATS.l2_hits) / lookups if lookups else 0.0,
+            "evictions": _STATS.evictions,
+            "l2_errors": _STATS.l2_errors,
+        }
@@ -77,53 +77,23 @@ fi
 log_info "正在初始化位置文件..."
 python3 << 'PYEOF'
 import os
-import json
-import hashlib
+import sys
 from pathlib import Path
 
+# 添加项目根目录到路径
+project_root = Path.cwd()
+sys.path.insert(0, str(project_root))
+
+from backend.app.incremental_importer import mark_files_imported
+
 IMPORT_DIR = os.environ.get('IMPORT_DIR', 'data_logs')
-POSITION_FILE = os.path.join(IMPORT_DIR, ".import_positions.json")
-
-def _get_file_key(file_path: str) -> str:
-    """生成文件的唯一标识（使用绝对路径的哈希）"""
-    abs_path = os.path.abspath(file_path)
-    return hashlib.md5(abs_path.encode('utf-8')).hexdigest()
-
-def _count_file_lines(file_path: str) -> int:
-    """统计文件总行数"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return sum(1 for _ in f)
-    except Exception:
-        return 0
-
-positions = {}
-file_count = 0
-
-# 遍历所有日志文件
-for root, _, files in os.walk(IMPORT_DIR):
-    for f in files:
-        if not (f.endswith('.jsonl') or f.endswith('.txt')):
-            continue
-        
-        src = os.path.join(root, f)
-        file_key = _get_file_key(src)
-        total_lines = _count_file_lines(src)
-        
-        if total_lines > 0:
-            positions[file_key] = total_lines
-            print(f"  标记文件: {src} (共 {total_lines} 行)")
-            file_count += 1
-
-# 保存位置文件
+
 try:
-    with open(POSITION_FILE, 'w', encoding='utf-8') as f:
-        json.dump(positions, f, indent=2, ensure_ascii=False)
+    file_count = mark_files_imported(IMPORT_DIR)
     print(f"\n成功初始化 {file_count} 个文件的位置记录")
-    print(f"位置文件已保存到: {POSITION_FILE}")
+    print("位置记录已保存到数据库表: import_checkpoints")
 except Exception as e:
-    print(f"\n错误: 保存位置文件失败: {e}")
-    import sys
+    print(f"\n错误: 初始化位置记录失败: {e}")
     sys.exit(1)
 PYEOF
 
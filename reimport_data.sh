@@ -100,7 +100,7 @@ if [[ "$old_count" -gt 0 ]]; then
     read -p "是否清空数据库中的所有旧数据？(y/n): " -n 1 -r
     echo ""
     if [[ ! $REPLY =~ ^[Yy]$ ]]; then
-        log_info "取消清空数据库，但将继续导入（可能导致重复数据）"
+        log_info "取消清空数据库，继续导入（已入库的行按 row_hash 指纹自动跳过，不会重复）"
     else
         # 清空数据库中的旧数据
         log_warning "正在清空数据库中的旧数据..."
@@ -117,8 +117,9 @@ os.environ.setdefault('POSTGRES_DB', 'pvp')
 
 try:
     with engine.connect() as conn:
-        # 清空表
+        # 清空表（预聚合表随之清空）
         conn.execute(text("TRUNCATE TABLE match_records;"))
+        conn.execute(text("DO $$ BEGIN IF to_regclass('match_rollups') IS NOT NULL THEN TRUNCATE TABLE match_rollups; END IF; END $$;"))
         conn.commit()
         print("数据库表已清空")
 except Exception as e:
@@ -0,0 +1,54 @@
+"""
+为已有记录回填 match_records.server_group（映射来自 backend/app/schemas.py 的 SERVER_GROUP_MAP）
+按 id 分批更新，每批单独提交，避免长时间锁表；修改 SERVER_GROUP_MAP 后加 --all 重新计算全部记录
+
+用法：
+    python scripts/migrate.py                    # 先添加列与索引
+    python scripts/backfill_server_group.py [--batch 50000] [--all]
+"""
+import argparse
+import sys
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import case, func, select, update
+
+from backend.app.database import SessionLocal
+from backend.app.models import MatchRecord
+from backend.app.schemas import SERVER_GROUP_MAP
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", type=int, default=50000, help="每批更新的 id 范围")
+    parser.add_argument("--all", action="store_true", help="重新计算所有记录（默认只回填为空的记录）")
+    args = parser.parse_args()
+
+    group = case(SERVER_GROUP_MAP, value=MatchRecord.server, else_=MatchRecord.server) \
+        if SERVER_GROUP_MAP else MatchRecord.server
+    total = 0
+    with SessionLocal() as db:
+        lo, hi = db.execute(select(func.min(MatchRecord.id), func.max(MatchRecord.id))).one()
+        if lo is None:
+            print("match_records is empty, nothing to backfill.")
+            return
+        start = lo
+        while start <= hi:
+            end = start + args.batch
+            stmt = update(MatchRecord).where(MatchRecord.id >= start, MatchRecord.id < end)
+            if not args.all:
+                stmt = stmt.where(MatchRecord.server_group.is_(None))
+            result = db.execute(stmt.values(server_group=group))
+            db.commit()
+            total += result.rowcount
+            start = end
+            print(f"  id < {end}: {total} rows updated")
+    print(f"Backfilled server_group for {total} rows.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+日志解码微基准：对比旧的逐行解码（json.loads 失败后正则修复再解析）与 backend.app.log_decoder 的快速路径
+
+用法：
+    python scripts/bench_decode.py                      # 使用合成数据
+    python scripts/bench_decode.py --file data_logs/season_play_pvp_mgr/2025_11_03.txt
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+script_dir = Path(__file__).parent
+sys.path.insert(0, str(script_dir.parent))
+
+from backend.app import log_decoder  # noqa: E402
+
+
+_ST_FIX_RE = re.compile(r'("source_type"\s*:\s*)(gold_league|season_play_pvp_mgr|qualifying_wheel_first_combat)\b')
+
+
+def _legacy_decode(line: str):
+    """基线：与改造前三个导入模块中的 _robust_json_load + _normalize_keys 相同"""
+    try:
+        obj = json.loads(line)
+    except Exception:
+        fixed = _ST_FIX_RE.sub(lambda m: f"{m.group(1)}\"{m.group(2)}\"", line)
+        if fixed == line:
+            return None
+        try:
+            obj = json.loads(fixed)
+        except Exception:
+            return None
+    if "spirit_animal" not in obj and "pet_list" in obj:
+        obj["spirit_animal"] = obj.get("pet_list")
+    if "spirit_animal_talents" not in obj and "pet_talent_list" in obj:
+        obj["spirit_animal_talents"] = obj.get("pet_talent_list")
+    if "legendary_runes" not in obj and "rune_list" in obj:
+        obj["legendary_runes"] = obj.get("rune_list")
+    if "super_armor" not in obj and "armor" in obj:
+        obj["super_armor"] = obj.get("armor")
+    return obj
+
+
+def _synthetic_lines(n: int, unquoted_ratio: float):
+    sources = ["gold_league", "season_play_pvp_mgr", "qualifying_wheel_first_combat"]
+    lines = []
+    for i in range(n):
+        st = random.choice(sources)
+        st_json = st if random.random() < unquoted_ratio else f'"{st}"'
+        lines.append(
+            '{"server": %d, "timestamp": %d, "level": %d, "class": %d, "schools": %d, '
+            '"pet_talent_list": [3,1,3], "opponent_class": %d, "opponent_schools": %d, '
+            '"is_win": %d, "duration": %d, "pet_list": [4004,4006,4005], "rune_list": [26010,26011], '
+            '"armor": 340220, "source_type": %s, "level_id": 109, "uid": %d}'
+            % (random.choice([8001, 8002, 8024]), 1762158578 + i, random.randint(30, 110),
+               random.randint(1, 11), random.randint(0, 2), random.randint(1, 11), random.randint(0, 2),
+               random.randint(0, 1), random.randint(20, 600), st_json, i)
+        )
+    return lines
+
+
+def _bench(label: str, fn, lines, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for line in lines:
+            fn(line)
+        best = min(best, time.perf_counter() - t0)
+    rate = len(lines) / best
+    print(f"{label:<28} {rate:>12,.0f} 行/秒")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default=None, help="使用真实日志文件作为输入")
+    parser.add_argument("--lines", type=int, default=50000, help="合成数据行数")
+    parser.add_argument("--unquoted_ratio", type=float, default=1.0, help="合成数据中 source_type 未加引号的比例")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as fp:
+            lines = [line.strip() for line in fp if line.strip()]
+    else:
+        random.seed(0)
+        lines = _synthetic_lines(args.lines, args.unquoted_ratio)
+    print(f"输入 {len(lines)} 行")
+
+    base = _bench("legacy (json + 失败后修复)", _legacy_decode, lines, args.repeat)
+    for name in ("json", "msgspec", "orjson"):
+        loads = log_decoder._load_backend(name)
+        if loads is None:
+            print(f"{'decode_record [' + name + ']':<28} {'未安装':>12}")
+            continue
+        log_decoder._loads = loads
+        rate = _bench(f"decode_record [{name}]", log_decoder.decode_record, lines, args.repeat)
+        print(f"{'':<28} {rate / base:>11.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+检查只读副本的读路由：打印主库与副本的数据版本号、副本落后的版本数与本次会选择的库，
+并在两边各执行一次胜率查询核对结果（副本追上主库时应完全一致）
+
+用法：
+    POSTGRES_READ_HOST=localhost POSTGRES_READ_PORT=5433 python scripts/check_replica.py
+"""
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent
+sys.path.insert(0, str(project_root))
+
+from backend.app.database import SessionLocal, ReadSessionLocal, replica_enabled
+from backend.app import crud, replica
+
+
+def _timed(fn, db):
+    started = time.perf_counter()
+    rows = fn(db, False)
+    return sorted(tuple(r) for r in rows), (time.perf_counter() - started) * 1000
+
+
+def main():
+    if not replica_enabled():
+        print("POSTGRES_READ_HOST is not set; stats queries use the primary.")
+        sys.exit(1)
+    with SessionLocal() as db, ReadSessionLocal() as read_db:
+        info = replica.status(db, read_db)
+        print(f"primary generation={info['primary_generation']} replica generation={info['replica_generation']} "
+              f"lag={info['lag']} (REPLICA_MAX_LAG={info['max_lag']})")
+        source, _ = replica.pick(db, read_db)
+        print(f"stats queries would run on: {'replica' if source is read_db else 'primary'}")
+        if info["replica_generation"] is None:
+            print(f"replica error: {info['last_error']}")
+            sys.exit(1)
+
+        primary_rows, primary_ms = _timed(crud.query_winrate, db)
+        replica_rows, replica_ms = _timed(crud.query_winrate, read_db)
+    same = primary_rows == replica_rows
+    print(f"winrate groups: primary={len(primary_rows)} ({primary_ms:.1f}ms) "
+          f"replica={len(replica_rows)} ({replica_ms:.1f}ms) -> {'identical' if same else 'DIFFERENT'}")
+    if not same and info["lag"] == 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -133,6 +133,7 @@ echo "[5/7] Truncating table 'match_records'..."
 from backend.app.database import engine
 with engine.connect() as conn:
     conn.exec_driver_sql('TRUNCATE TABLE match_records;')
+    conn.exec_driver_sql("DO $$ BEGIN IF to_regclass('match_rollups') IS NOT NULL THEN TRUNCATE TABLE match_rollups; END IF; END $$;")
     conn.commit()
 print('Truncated match_records.')
 PY
@@ -0,0 +1,144 @@
+"""
+match_records 时间分区管理（分区粒度由 MATCH_PARTITION_INTERVAL 决定：month（默认）或 week）
+
+用法：
+    python scripts/manage_partitions.py list
+    python scripts/manage_partitions.py create --start 2025-11-01 --end 2026-03-31   # 预先创建分区（导入时也会自动创建）
+    python scripts/manage_partitions.py detach --before 2025-06-01 [--drop]          # 卸载（并删除）早于该日期的分区
+    python scripts/manage_partitions.py convert                                      # 把未分区的旧表转换为分区表
+
+convert 在一个事务中完成：旧表重命名为 match_records_legacy，新建分区表并按时间范围建好分区，
+复制全部数据（保留 id），重建 match_pet_talent_v / match_rune_v 视图。确认无误后手动 DROP TABLE match_records_legacy
+"""
+import argparse
+import datetime as dt
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import text
+
+from backend.app.database import engine, Base, SessionLocal
+from backend.app.models import MatchRecord
+from backend.app import partitions
+from backend.app.stats_cache import bump_generation
+
+
+_LEGACY = "match_records_legacy"
+
+
+def _parse_date(value: str) -> int:
+    return int(dt.datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=dt.timezone.utc).timestamp())
+
+
+def _fmt_ts(ts) -> str:
+    if ts is None:
+        return "?"
+    return dt.datetime.fromtimestamp(ts, dt.timezone.utc).strftime("%Y-%m-%d")
+
+
+def cmd_list(db, args):
+    if not partitions.is_partitioned(db):
+        print("match_records is not partitioned (run: python scripts/manage_partitions.py convert)")
+        return
+    for p in partitions.list_partitions(db):
+        rows = db.execute(text(f"SELECT count(*) FROM {p['name']}")).scalar()
+        print(f"{p['name']:<28} {_fmt_ts(p['start_ts'])} ~ {_fmt_ts(p['end_ts'])}  {rows} rows")
+
+
+def cmd_create(db, args):
+    if not partitions.is_partitioned(db):
+        print("match_records is not partitioned, nothing to create.")
+        return
+    count = partitions.ensure_range(db, _parse_date(args.start), _parse_date(args.end))
+    db.commit()
+    print(f"Ensured {count} partitions ({partitions.interval()}).")
+
+
+def cmd_detach(db, args):
+    if not partitions.is_partitioned(db):
+        print("match_records is not partitioned, nothing to detach.")
+        return
+    names = partitions.detach_before(db, _parse_date(args.before), drop=args.drop)
+    if names:
+        # 统计缓存随数据版本号失效
+        bump_generation(db)
+    db.commit()
+    action = "Detached and dropped" if args.drop else "Detached"
+    print(f"{action} {len(names)} partitions: {', '.join(names) or '-'}")
+    if names and not args.drop:
+        print("Detached tables are kept; DROP TABLE them once no longer needed.")
+
+
+def cmd_convert(db, args):
+    if partitions.is_partitioned(db):
+        print("match_records is already partitioned.")
+        return
+    if db.execute(text("SELECT to_regclass(:t)"), {"t": _LEGACY}).scalar():
+        print(f"{_LEGACY} already exists; drop or rename it first.")
+        sys.exit(1)
+    started = time.perf_counter()
+    table = MatchRecord.__tablename__
+    try:
+        # 旧表连同其索引、序列改名，释放名字给新的分区表；依赖旧表的视图随后重建
+        db.execute(text("DROP VIEW IF EXISTS match_pet_talent_v, match_rune_v"))
+        db.execute(text(f"ALTER TABLE {table} RENAME TO {_LEGACY}"))
+        for (index_name,) in db.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :t"
+        ), {"t": _LEGACY}).all():
+            db.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{index_name}_legacy"'))
+        db.execute(text(f"ALTER SEQUENCE IF EXISTS {table}_id_seq RENAME TO {_LEGACY}_id_seq"))
+
+        MatchRecord.__table__.create(bind=db.connection())
+        partitions._partitioned = True
+
+        lo, hi = db.execute(text(f"SELECT min(timestamp), max(timestamp) FROM {_LEGACY}")).one()
+        if lo is not None:
+            count = partitions.ensure_range(db, lo, hi)
+            print(f"Created {count} partitions ({partitions.interval()}) for {_fmt_ts(lo)} ~ {_fmt_ts(hi)}")
+
+        legacy_cols = set(db.execute(text(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = :t"
+        ), {"t": _LEGACY}).scalars())
+        cols = ", ".join(c.name for c in MatchRecord.__table__.columns if c.name in legacy_cols)
+        copied = db.execute(text(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {_LEGACY}")).rowcount
+        db.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce((SELECT max(id) FROM {table}), 1))"
+        ))
+        db.execute(text((script_dir / "migration_001_views.sql").read_text(encoding="utf-8")))
+        bump_generation(db)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error converting match_records: {e}")
+        sys.exit(1)
+    print(f"Converted match_records: {copied} rows in {time.perf_counter() - started:.1f}s; "
+          f"old table kept as {_LEGACY}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="列出分区及行数")
+    p_create = sub.add_parser("create", help="创建覆盖某个日期范围的分区")
+    p_create.add_argument("--start", required=True, help="起始日期 YYYY-MM-DD（UTC）")
+    p_create.add_argument("--end", required=True, help="结束日期 YYYY-MM-DD（UTC）")
+    p_detach = sub.add_parser("detach", help="卸载结束时间早于某日期的分区")
+    p_detach.add_argument("--before", required=True, help="日期 YYYY-MM-DD（UTC）")
+    p_detach.add_argument("--drop", action="store_true", help="卸载后直接删除分区表")
+    sub.add_parser("convert", help="把未分区的 match_records 转换为分区表")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    handlers = {"list": cmd_list, "create": cmd_create, "detach": cmd_detach, "convert": cmd_convert}
+    with SessionLocal() as db:
+        handlers[args.command](db, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+按文件名顺序执行 scripts/migration_*.sql（每个脚本都是幂等的，可重复执行）
+
+用法：
+    python scripts/migrate.py
+"""
+import sys
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent
+sys.path.insert(0, str(project_root))
+
+from backend.app.database import engine, Base
+import backend.app.models  # noqa: F401  注册所有表
+
+
+def main():
+    # 新库先建表，已有的表不受影响
+    Base.metadata.create_all(bind=engine)
+    for path in sorted(script_dir.glob("migration_*.sql")):
+        print(f"Applying {path.name}...")
+        raw_conn = engine.raw_connection()
+        try:
+            with raw_conn.cursor() as cur:
+                cur.execute(path.read_text(encoding="utf-8"))
+            raw_conn.commit()
+        except Exception as e:
+            raw_conn.rollback()
+            print(f"Error applying {path.name}: {e}")
+            sys.exit(1)
+        finally:
+            raw_conn.close()
+    print("Migrations applied.")
+
+
+if __name__ == "__main__":
+    main()
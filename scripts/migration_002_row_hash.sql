@@ -0,0 +1,7 @@
+-- Row fingerprint for idempotent imports: hash(raw log line + source_type)
+-- Rows imported before this migration keep row_hash = NULL (never conflict);
+-- truncate and re-import once if those rows also need to be deduplicated.
+
+alter table match_records add column if not exists row_hash bigint;
+
+create unique index if not exists ux_records_row_hash on match_records (row_hash);
@@ -0,0 +1,48 @@
+-- Single-row storage: one match_records row per log line instead of one per source_type.
+-- league = winrate type 1/2/3 (duration type = league + 3); win_valid / duration_valid
+-- say which virtual source_types the row counts towards. Rows with league = NULL keep
+-- their literal source_type, so old and new rows can live side by side.
+-- Idempotent: only rows that still have league = NULL are converted.
+
+alter table match_records add column if not exists league smallint;
+alter table match_records add column if not exists win_valid boolean;
+alter table match_records add column if not exists duration_valid boolean;
+
+create index if not exists ix_records_league on match_records (league);
+
+-- 1. Collapse winrate/duration pairs written by the split importer (consecutive ids,
+--    identical columns, source_type n and n + 3). The winrate row is kept so that its
+--    row_hash matches what the single-row importer computes for the same log line.
+with pairs as (
+  select a.id as win_id, b.id as dur_id
+  from match_records a
+  join match_records b on b.id = a.id + 1
+  where a.league is null and b.league is null
+    and a.source_type in (1, 2, 3) and b.source_type = a.source_type + 3
+    and a.server = b.server and a.timestamp = b.timestamp and a.level = b.level
+    and a.clazz = b.clazz and a.schools = b.schools
+    and a.opponent_class = b.opponent_class and a.opponent_schools = b.opponent_schools
+    and a.is_win = b.is_win and a.duration = b.duration
+    and a.spirit_animal is not distinct from b.spirit_animal
+    and a.spirit_animal_talents is not distinct from b.spirit_animal_talents
+    and a.legendary_runes is not distinct from b.legendary_runes
+    and a.super_armor is not distinct from b.super_armor
+    and a.score_ratio = b.score_ratio
+), kept as (
+  update match_records m
+  set league = m.source_type, win_valid = true, duration_valid = true
+  from pairs p
+  where m.id = p.win_id
+  returning p.dur_id
+)
+delete from match_records d using kept where d.id = kept.dur_id;
+
+-- 2. Unpaired winrate rows (duration was missing or invalid).
+update match_records
+set league = source_type, win_valid = true, duration_valid = false
+where league is null and source_type in (1, 2, 3);
+
+-- 3. Unpaired duration rows (is_win was missing or invalid).
+update match_records
+set league = source_type - 3, win_valid = false, duration_valid = true
+where league is null and source_type in (4, 5, 6);
@@ -0,0 +1,9 @@
+-- Materialized server group: the merged server id (see SERVER_GROUP_MAP in
+-- backend/app/schemas.py) is written at import time, so grouping/filtering by
+-- server no longer evaluates a CASE per row and can use an index.
+-- Existing rows are filled by scripts/backfill_server_group.py (the mapping
+-- lives in Python only), which is safe to re-run.
+
+alter table match_records add column if not exists server_group integer;
+
+create index if not exists ix_records_server_group on match_records (server_group, clazz, schools);
@@ -0,0 +1,6 @@
+-- Duration histogram per rollup cell: fixed buckets (1s below 60s, 5s below
+-- 600s, 30s below 3600s, plus one overflow bucket; see backend/app/rollups.py)
+-- that can be summed across cells to estimate duration percentiles.
+-- Run scripts/rebuild_rollups.py afterwards so existing cells get histograms.
+
+alter table match_rollups add column if not exists duration_hist integer[];
@@ -0,0 +1,23 @@
+-- Loadout filters on array operators: spirit_animal / legendary_runes are
+-- filtered with && and pet+talent pairs with a packed array
+-- (pet_id * 100 + talent, see pack_pet_talent in backend/app/schemas.py),
+-- all backed by GIN indexes instead of unnesting every row through the
+-- match_pet_talent_v / match_rune_v views.
+-- Pairs that cannot be packed (talent outside 0..99, negative or huge pet id)
+-- are left out; queries for such values fall back to the view.
+
+alter table match_records add column if not exists pet_talent_packed integer[];
+
+update match_records mr
+set pet_talent_packed = array(
+  select pet.pet_id * 100 + coalesce(mr.spirit_animal_talents[pet.idx], 0)
+  from unnest(mr.spirit_animal) with ordinality as pet(pet_id, idx)
+  where pet.pet_id between 0 and 21474835
+    and coalesce(mr.spirit_animal_talents[pet.idx], 0) between 0 and 99
+  order by pet.idx
+)
+where mr.spirit_animal is not null and mr.pet_talent_packed is null;
+
+create index if not exists ix_records_spirit_animal_gin on match_records using gin (spirit_animal);
+create index if not exists ix_records_legendary_runes_gin on match_records using gin (legendary_runes);
+create index if not exists ix_records_pet_talent_gin on match_records using gin (pet_talent_packed);
@@ -0,0 +1,7 @@
+-- BRIN index on the time column: rows arrive in time order, so a block-range
+-- index covers start_ts/end_ts filters at a fraction of the B-tree size.
+-- Works on both the partitioned table (propagates to every partition) and an
+-- unpartitioned legacy match_records; convert the latter with
+-- python scripts/manage_partitions.py convert.
+
+create index if not exists ix_records_time_brin on match_records using brin (timestamp);
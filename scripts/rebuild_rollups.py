@@ -0,0 +1,37 @@
+"""
+从 match_records 全量重建 match_rollups（首次启用 STATS_ROLLUPS、修改 ROLLUP_BUCKET_SEC / ROLLUP_LEVEL_BAND
+或手动修改过 match_records 后执行）。重建在一个事务中完成，期间导入会等待 match_rollups 上的锁
+
+用法：
+    python scripts/rebuild_rollups.py
+"""
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent
+sys.path.insert(0, str(project_root))
+
+from backend.app.database import engine, Base, SessionLocal
+from backend.app import rollups
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        try:
+            cells = rollups.rebuild(db)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Error rebuilding rollups: {e}")
+            sys.exit(1)
+    print(f"Rebuilt match_rollups: {cells} rows in {time.perf_counter() - started:.1f}s "
+          f"(bucket={rollups.bucket_sec()}s, level_band={rollups.level_band()})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+核对列式内存引擎与 SQL 路径的结果是否一致，并对比两者的耗时
+
+用法：
+    STATS_ENGINE=columnar python scripts/verify_columnar.py [--repeat 5]
+    COLUMNAR_SNAPSHOT_DIR=/data/columnar python scripts/verify_columnar.py   # 核对共享快照文件（会先从数据库重建）
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent
+sys.path.insert(0, str(project_root))
+
+os.environ["STATS_ENGINE"] = "columnar"
+
+from sqlalchemy import func, select
+
+from backend.app.database import SessionLocal
+from backend.app.models import MatchRecord
+from backend.app import columnar, crud
+
+
+def _cases(db):
+    lo, hi = db.execute(select(func.min(MatchRecord.timestamp), func.max(MatchRecord.timestamp))).one()
+    mid = (lo + hi) // 2 if lo is not None else 0
+    pet = db.execute(select(MatchRecord.spirit_animal[1]).where(MatchRecord.spirit_animal.isnot(None)).limit(1)).scalar()
+    rune = db.execute(select(MatchRecord.legendary_runes[1]).where(MatchRecord.legendary_runes.isnot(None)).limit(1)).scalar()
+    cases = [
+        {},
+        {"start_ts": mid},
+        {"servers": [8001, 8002, 8004]},
+        {"min_level": 60, "max_level": 100, "clazz": 1},
+        {"source_types": [1, 4]},
+        {"score_ratio": 500},
+        {"super_armor": 340220},
+    ]
+    if pet is not None:
+        cases.append({"spirit_animal": [pet]})
+        cases.append({"spirit_animal": [pet], "spirit_animal_talents": 3})
+    if rune is not None:
+        cases.append({"legendary_runes": [rune]})
+    return cases
+
+
+def _normalize(rows, groups: int):
+    out = {}
+    for r in rows:
+        key = tuple(r[:groups])
+        out[key] = [None if v is None else round(float(v), 6) for v in r[groups:]]
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    if not columnar.enabled():
+        print("numpy is not installed.")
+        sys.exit(1)
+
+    columnar.load_now()
+    status = columnar.status()
+    size = f", {status['bytes'] / 1024 / 1024:.1f} MiB" if "bytes" in status else ""
+    print(f"Snapshot ({status['source']}): {status['rows']} rows in {status['segments']} segments{size}")
+
+    failures = 0
+    with SessionLocal() as db:
+        for filters in _cases(db):
+            for metric in ("winrate", "duration"):
+                for gbo in (False, True):
+                    sql_fn = crud.query_winrate if metric == "winrate" else crud.query_duration
+                    t0 = time.perf_counter()
+                    expected = sql_fn(db, gbo, **filters)
+                    sql_ms = (time.perf_counter() - t0) * 1000
+                    best = float("inf")
+                    for _ in range(args.repeat):
+                        t0 = time.perf_counter()
+                        actual = columnar.query(db, metric, gbo, **filters)
+                        best = min(best, (time.perf_counter() - t0) * 1000)
+                    groups = 6 if gbo else 4
+                    ok = actual is not None and _normalize(actual, groups) == _normalize(expected, groups)
+                    failures += not ok
+                    print(f"{'OK ' if ok else 'DIFF'} {metric:<8} gbo={gbo!s:<5} {filters} "
+                          f"groups={len(expected)} sql={sql_ms:.1f}ms columnar={best:.1f}ms")
+    if failures:
+        print(f"{failures} mismatches")
+        sys.exit(1)
+    print("All results identical.")
+
+
+if __name__ == "__main__":
+    main()
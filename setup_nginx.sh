@@ -61,6 +61,7 @@ fi
 # 创建日志目录
 log_info "创建日志目录..."
 mkdir -p "$NGINX_LOG_DIR" 2>/dev/null || true
+mkdir -p /var/cache/nginx/pvp_stats 2>/dev/null || true
 
 # 生成 nginx 配置
 log_info "生成 Nginx 配置文件..."
@@ -82,6 +83,10 @@ fi
 # 生成配置内容
 log_info "写入配置文件: $CONFIG_FILE"
 cat > "$CONFIG_FILE" << EOF
+# 统计接口的缓存：后端对相同条件与数据版本返回相同的 ETag，缓存到期后带 If-None-Match 向后端验证，
+# 数据未变化时后端直接返回 304（不执行查询）
+proxy_cache_path /var/cache/nginx/pvp_stats levels=1:2 keys_zone=pvp_stats:10m max_size=512m inactive=1h;
+
 server {
     listen ${NGINX_PORT};
     server_name ${SERVER_IP};  # 使用服务器IP或域名
@@ -119,6 +124,25 @@ server {
         proxy_request_buffering off;
     }
 
+    # 统计接口：缓存 1 秒后重新验证（后端的 Cache-Control: no-cache 面向浏览器，这里忽略）
+    # 响应已由后端按 Accept-Encoding 压缩，缓存按 Vary 分别保存
+    location /api/stats/ {
+        proxy_pass http://127.0.0.1:${APP_PORT};
+        proxy_set_header Host \$host;
+        proxy_set_header X-Real-IP \$remote_addr;
+        proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto \$scheme;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
+
+        proxy_cache pvp_stats;
+        proxy_cache_valid 200 1s;
+        proxy_cache_revalidate on;
+        proxy_cache_lock on;
+        proxy_ignore_headers Cache-Control;
+        add_header X-Cache-Status \$upstream_cache_status;
+    }
+
     # 健康检查端点（可选，直接访问后端）
     location /api/health {
         proxy_pass http://127.0.0.1:${APP_PORT}/api/health;
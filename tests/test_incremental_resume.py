@@ -0,0 +1,98 @@
+"""增量导入的续读位置与轮转/截断/替换识别（incremental_importer._file_state / _resume_offset）"""
+import hashlib
+import os
+
+from backend.app import incremental_importer as inc
+
+
+def _write(path, data: bytes, mtime_ns: int):
+    path.write_bytes(data)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def _state(path, offset=None):
+    st = os.stat(path)
+    return inc._file_state(str(path), st, st.st_size if offset is None else offset)
+
+
+def test_file_state_records_head_fingerprint(tmp_path):
+    log = tmp_path / "a.jsonl"
+    data = b'{"a": 1}\n' * 200
+    _write(log, data, 1_000_000_000)
+    state = _state(log)
+    assert state["offset"] == len(data)
+    assert state["size"] == len(data)
+    assert state["mtime_ns"] == 1_000_000_000
+    assert state["head_len"] == inc._HEAD_BYTES
+    assert state["head"] == hashlib.md5(data[:inc._HEAD_BYTES]).hexdigest()
+
+
+def test_file_state_short_file_uses_whole_file_as_head(tmp_path):
+    log = tmp_path / "a.jsonl"
+    _write(log, b'{"a": 1}\n', 1_000_000_000)
+    state = _state(log)
+    assert state["head_len"] == 9
+    assert state["head"] == hashlib.md5(b'{"a": 1}\n').hexdigest()
+
+
+def test_resume_without_state_starts_from_zero(tmp_path):
+    log = tmp_path / "a.jsonl"
+    _write(log, b'{"a": 1}\n', 1_000_000_000)
+    assert inc._resume_offset(str(log), os.stat(log), None) == 0
+
+
+def test_resume_unchanged_file_is_skipped(tmp_path):
+    log = tmp_path / "a.jsonl"
+    _write(log, b'{"a": 1}\n{"a": 2}\n', 1_000_000_000)
+    state = _state(log)
+    assert inc._resume_offset(str(log), os.stat(log), state) is None
+
+
+def test_resume_appended_file_continues_from_offset(tmp_path):
+    log = tmp_path / "a.jsonl"
+    _write(log, b'{"a": 1}\n', 1_000_000_000)
+    state = _state(log)
+    _write(log, b'{"a": 1}\n{"a": 2}\n', 2_000_000_000)
+    assert inc._resume_offset(str(log), os.stat(log), state) == 9
+
+
+def test_resume_inode_change_restarts(tmp_path):
+    log = tmp_path / "a.jsonl"
+    _write(log, b'{"a": 1}\n', 1_000_000_000)
+    state = dict(_state(log), inode=os.stat(log).st_ino + 1)
+    assert inc._resume_offset(str(log), os.stat(log), state) == 0
+
+
+def test_resume_truncated_file_restarts(tmp_path):
+    log = tmp_path / "a.jsonl"
+    _write(log, b'{"a": 1}\n{"a": 2}\n', 1_000_000_000)
+    state = _state(log)
+    with open(log, "r+b") as f:
+        f.truncate(9)
+    os.utime(log, ns=(2_000_000_000, 2_000_000_000))
+    assert inc._resume_offset(str(log), os.stat(log), state) == 0
+
+
+def test_resume_offset_beyond_size_restarts(tmp_path):
+    log = tmp_path / "a.jsonl"
+    _write(log, b'{"a": 1}\n', 1_000_000_000)
+    state = _state(log, offset=100)
+    _write(log, b'{"a": 1}\n{"a": 2}\n', 2_000_000_000)
+    assert inc._resume_offset(str(log), os.stat(log), state) == 0
+
+
+def test_resume_replaced_content_restarts(tmp_path):
+    log = tmp_path / "a.jsonl"
+    _write(log, b'{"a": 1}\n', 1_000_000_000)
+    state = _state(log)
+    # 同一个 inode 被整体重写为更长的新内容：大小增加但文件头不同
+    _write(log, b'{"b": 9}\n{"b": 8}\n', 2_000_000_000)
+    assert inc._resume_offset(str(log), os.stat(log), state) == 0
+
+
+def test_read_lines_from_offset_resumes_and_holds_back_partial_line(tmp_path):
+    log = tmp_path / "a.jsonl"
+    log.write_bytes(b'{"a": 1}\n{"a": 2}\n{"a": ')
+    lines = list(inc._read_lines_from_offset(str(log), 9))
+    # 末尾未写完（也不是完整 JSON）的行留到下次导入
+    assert lines == [(18, '{"a": 2}')]
@@ -0,0 +1,81 @@
+"""目录监听的变化合并（log_watcher._Debouncer）"""
+import os
+import threading
+import time
+
+from backend.app.log_watcher import _Debouncer
+
+
+class _Batches:
+    def __init__(self):
+        self.batches = []
+        self.event = threading.Event()
+
+    def __call__(self, paths):
+        self.batches.append(set(paths))
+        self.event.set()
+
+    def wait(self, timeout=2.0):
+        assert self.event.wait(timeout)
+        self.event.clear()
+
+
+def test_changes_within_debounce_are_merged():
+    batches = _Batches()
+    d = _Debouncer(batches, debounce_sec=0.1, max_wait_sec=5)
+    d.add("a.jsonl")
+    d.add("b.jsonl")
+    d.add("a.jsonl")
+    batches.wait()
+    time.sleep(0.2)
+    assert batches.batches == [{os.path.abspath("a.jsonl"), os.path.abspath("b.jsonl")}]
+
+
+def test_quiet_period_restarts_on_each_change():
+    batches = _Batches()
+    d = _Debouncer(batches, debounce_sec=0.15, max_wait_sec=5)
+    started = time.monotonic()
+    for _ in range(4):
+        d.add("a.jsonl")
+        time.sleep(0.05)
+    batches.wait()
+    # 最后一次变化之后还要再安静 debounce_sec 秒
+    assert time.monotonic() - started >= 0.15 + 0.15
+    assert len(batches.batches) == 1
+
+
+def test_max_wait_fires_during_continuous_changes():
+    batches = _Batches()
+    d = _Debouncer(batches, debounce_sec=0.2, max_wait_sec=0.3)
+    deadline = time.monotonic() + 1.0
+    while time.monotonic() < deadline and not batches.batches:
+        d.add("a.jsonl")
+        time.sleep(0.05)
+    d.cancel()
+    # 变化从未停止超过 debounce_sec，但最早的变化等待满 max_wait_sec 后仍会触发
+    assert batches.batches == [{os.path.abspath("a.jsonl")}]
+
+
+def test_cancel_drops_pending_changes():
+    batches = _Batches()
+    d = _Debouncer(batches, debounce_sec=0.05, max_wait_sec=5)
+    d.add("a.jsonl")
+    d.cancel()
+    time.sleep(0.15)
+    assert batches.batches == []
+
+
+def test_callback_errors_do_not_stop_later_batches():
+    calls = []
+
+    def on_batch(paths):
+        calls.append(paths)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+
+    d = _Debouncer(on_batch, debounce_sec=0.05, max_wait_sec=5)
+    d.add("a.jsonl")
+    time.sleep(0.15)
+    d.add("b.jsonl")
+    time.sleep(0.15)
+    assert calls == [{os.path.abspath("a.jsonl")}, {os.path.abspath("b.jsonl")}]
@@ -0,0 +1,98 @@
+"""统计分页：排序键、游标编解码与内存分页（crud.page_keys / encode_cursor / decode_cursor / paginate_rows / query_page）"""
+import random
+from decimal import Decimal
+
+import pytest
+
+from backend.app import crud
+
+
+def _winrate_rows(count=60, seed=3):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        win, lose = rng.randrange(0, 20), rng.randrange(0, 20)
+        total = win + lose
+        rate = Decimal(win) / Decimal(total) if win else None
+        rows.append([rng.choice([1, 2, 3]), i % 7, i, rng.choice([1, 2]), win, lose, total, rate])
+    return rows
+
+
+def _all_pages(rows, keys, columns, limit):
+    pages, cursor_values = [], None
+    while True:
+        page, cursor = crud.paginate_rows(rows, keys, columns, limit, cursor_values)
+        pages.append(page)
+        if cursor is None:
+            return pages
+        cursor_values = crud.decode_cursor(cursor, keys)
+
+
+def test_page_keys_complete_sort_with_group_columns():
+    keys = crud.page_keys("win_rate:desc,class:asc,unknown:desc", "winrate", False)
+    assert keys == [("win_rate", True), ("class", False), ("server", False), ("schools", False),
+                    ("source_type", False)]
+
+
+def test_page_keys_default_is_group_order():
+    assert crud.page_keys(None, "winrate", True) == [
+        (c, False) for c in ["server", "class", "schools", "source_type", "opponent_class", "opponent_schools"]]
+
+
+def test_cursor_round_trip_keeps_decimal_and_null():
+    columns = crud.result_columns("winrate", False)
+    keys = crud.page_keys("win_rate:desc", "winrate", False)
+    row = [1, 2, 3, 1, 5, 5, 10, Decimal("0.33333333333333333333")]
+    cursor = crud.encode_cursor(keys, row, columns)
+    assert "=" not in cursor
+    assert crud.decode_cursor(cursor, keys) == [Decimal("0.33333333333333333333"), 1, 2, 3, 1]
+    row[-1] = None
+    assert crud.decode_cursor(crud.encode_cursor(keys, row, columns), keys)[0] is None
+
+
+def test_cursor_with_other_sort_is_rejected():
+    columns = crud.result_columns("winrate", False)
+    cursor = crud.encode_cursor(crud.page_keys("win_rate:desc", "winrate", False), [1, 2, 3, 1, 5, 5, 10, 0.5],
+                                columns)
+    with pytest.raises(ValueError):
+        crud.decode_cursor(cursor, crud.page_keys("win_rate:asc", "winrate", False))
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "eyJrIjoxfQ"])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        crud.decode_cursor(cursor, crud.page_keys(None, "winrate", False))
+
+
+@pytest.mark.parametrize("sort", [None, "win_rate:desc", "win_rate:asc", "match_count:desc,win_rate:asc"])
+def test_pages_cover_every_row_once_in_order(sort):
+    rows = _winrate_rows()
+    columns = crud.result_columns("winrate", False)
+    keys = crud.page_keys(sort, "winrate", False)
+    pages = _all_pages(rows, keys, columns, limit=7)
+    assert all(len(p) == 7 for p in pages[:-1]) and 0 < len(pages[-1]) <= 7
+    flat = [r for p in pages for r in p]
+    assert sorted(map(tuple, flat), key=repr) == sorted(map(tuple, rows), key=repr)
+    # 与 SQL 的 ORDER BY 一致：逐键比较，NULL 在升序时排最后、降序时排最前
+    assert flat == crud.sort_rows(rows, ",".join(f"{n}:{'desc' if d else 'asc'}" for n, d in keys), columns)
+
+
+def test_last_full_page_has_no_next_cursor():
+    rows = _winrate_rows(14)
+    columns = crud.result_columns("winrate", False)
+    keys = crud.page_keys(None, "winrate", False)
+    pages = _all_pages(rows, keys, columns, limit=7)
+    assert [len(p) for p in pages] == [7, 7]
+
+
+def test_query_page_paginates_in_memory_results(monkeypatch):
+    rows = _winrate_rows()
+    monkeypatch.setattr(crud.columnar, "query", lambda db, metric, gbo, generation=None, **filters: rows)
+    first = crud.query_page(None, "winrate", False, 10, sort="win_rate:desc")
+    assert first["path"] == "columnar" and first["total"] == len(rows) and len(first["rows"]) == 10
+    second = crud.query_page(None, "winrate", False, 10, first["next_cursor"], sort="win_rate:desc")
+    keys = crud.page_keys("win_rate:desc", "winrate", False)
+    expected = _all_pages(rows, keys, crud.result_columns("winrate", False), limit=10)
+    assert first["rows"] == expected[0] and second["rows"] == expected[1]
+    with pytest.raises(ValueError):
+        crud.query_page(None, "winrate", False, 10, first["next_cursor"], sort="match_count:asc")
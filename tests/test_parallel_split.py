@@ -0,0 +1,67 @@
+"""并行导入的按行对齐字节区间切分（parallel_importer._split_ranges）"""
+import gzip
+
+from backend.app import incremental_importer as inc
+from backend.app.parallel_importer import _split_ranges
+
+
+def _log(tmp_path, count=500):
+    lines = [f'{{"n": {i}, "pad": "{"x" * (i % 37)}"}}\n'.encode() for i in range(count)]
+    path = tmp_path / "a.jsonl"
+    path.write_bytes(b"".join(lines))
+    return path, lines
+
+
+def _check_ranges(ranges, data, start):
+    assert ranges[0][0] == start
+    assert ranges[-1][1] is None
+    for (lo, hi), (next_lo, _) in zip(ranges, ranges[1:]):
+        # 区间首尾相接，边界都在行首
+        assert hi == next_lo
+        assert lo < hi
+        assert data[hi - 1:hi] == b"\n"
+
+
+def test_small_file_is_one_range(tmp_path):
+    path, _ = _log(tmp_path, 10)
+    assert _split_ranges(str(path), 0, path.stat().st_size, 1 << 20) == [(0, None)]
+
+
+def test_ranges_are_line_aligned_and_contiguous(tmp_path):
+    path, _ = _log(tmp_path)
+    data = path.read_bytes()
+    ranges = _split_ranges(str(path), 0, len(data), 1000)
+    assert len(ranges) > 5
+    _check_ranges(ranges, data, 0)
+
+
+def test_ranges_start_at_resume_offset(tmp_path):
+    path, lines = _log(tmp_path)
+    data = path.read_bytes()
+    start = sum(len(line) for line in lines[:100])
+    ranges = _split_ranges(str(path), start, len(data), 1000)
+    _check_ranges(ranges, data, start)
+
+
+def test_ranges_read_every_line_exactly_once(tmp_path):
+    path, lines = _log(tmp_path)
+    data = path.read_bytes()
+    read = []
+    for lo, hi in _split_ranges(str(path), 0, len(data), 777):
+        read.extend(line for _, line in inc._read_lines_from_offset(str(path), lo, hi))
+    assert read == [line.decode().rstrip("\n") for line in lines]
+
+
+def test_chunk_ending_inside_last_line_does_not_add_empty_range(tmp_path):
+    path, lines = _log(tmp_path, 3)
+    data = path.read_bytes()
+    # 切分点落在最后一行中间：读到行尾已是文件末尾，不再切出新区间
+    chunk = len(data) - len(lines[-1]) // 2
+    assert _split_ranges(str(path), 0, len(data), chunk) == [(0, None)]
+
+
+def test_compressed_file_is_one_range(tmp_path):
+    path = tmp_path / "a.jsonl.gz"
+    with gzip.open(path, "wb") as f:
+        f.write(b'{"n": 1}\n' * 1000)
+    assert _split_ranges(str(path), 0, path.stat().st_size, 10) == [(0, None)]
@@ -0,0 +1,83 @@
+"""rollup 时长直方图：分桶与分位数估算（rollups.duration_bucket / hist_percentile）"""
+import math
+import random
+
+import pytest
+
+from backend.app import rollups
+from backend.app.crud import DURATION_PERCENTILES
+
+
+def _hist(durations):
+    hist = [0] * rollups.HIST_BUCKETS
+    for d in durations:
+        hist[rollups.duration_bucket(d)] += 1
+    return hist
+
+
+def _percentile_disc(durations, p):
+    ordered = sorted(durations)
+    return float(ordered[max(1, math.ceil(p * len(ordered))) - 1])
+
+
+@pytest.mark.parametrize("duration, bucket", [
+    (-5, 0), (0, 0), (59, 59),          # 0-60 秒：1 秒一个桶
+    (60, 60), (64, 60), (65, 61), (599, 167),   # 60-600 秒：5 秒一个桶
+    (600, 168), (629, 168), (630, 169), (3599, 267),   # 600-3600 秒：30 秒一个桶
+    (3600, rollups.HIST_BUCKETS - 1), (10 ** 6, rollups.HIST_BUCKETS - 1),
+])
+def test_duration_bucket_boundaries(duration, bucket):
+    assert rollups.duration_bucket(duration) == bucket
+
+
+def test_duration_bucket_is_monotonic_and_matches_bounds():
+    previous = 0
+    for d in range(0, 4000):
+        b = rollups.duration_bucket(d)
+        assert previous <= b < rollups.HIST_BUCKETS
+        lo, hi = rollups._bucket_bounds(b)
+        assert lo <= d and (hi is None or d < hi)
+        previous = b
+
+
+def test_empty_histogram_has_no_percentile():
+    assert rollups.hist_percentile([0] * rollups.HIST_BUCKETS, 0.5, None, None) is None
+
+
+def test_one_second_buckets_are_exact():
+    rng = random.Random(1)
+    durations = [rng.randrange(0, 60) for _ in range(1001)]
+    hist = _hist(durations)
+    for _, p in DURATION_PERCENTILES:
+        assert rollups.hist_percentile(hist, p, min(durations), max(durations)) == _percentile_disc(durations, p)
+
+
+def test_estimate_error_is_within_bucket_width():
+    rng = random.Random(2)
+    durations = [int(rng.lognormvariate(5, 1)) for _ in range(5000)]
+    hist = _hist(durations)
+    for _, p in DURATION_PERCENTILES:
+        exact = _percentile_disc(durations, p)
+        lo, hi = rollups._bucket_bounds(rollups.duration_bucket(int(exact)))
+        width = (hi - lo) if hi is not None else max(durations) - lo + 1
+        assert abs(rollups.hist_percentile(hist, p, min(durations), max(durations)) - exact) < width
+
+
+def test_first_and_last_rank_return_min_and_max():
+    durations = [61, 100, 200, 3000]
+    hist = _hist(durations)
+    assert rollups.hist_percentile(hist, 0.0, 61, 3000) == 61.0
+    assert rollups.hist_percentile(hist, 1.0, 61, 3000) == 3000.0
+
+
+def test_estimate_is_clamped_to_min_max():
+    # 一个 30 秒宽的桶中只有一条 601 秒的记录：桶内插值不能超出 [dmin, dmax]
+    hist = _hist([601, 601])
+    assert rollups.hist_percentile(hist, 0.5, 601, 601) == 601.0
+
+
+def test_overflow_bucket_uses_max_duration():
+    durations = [4000, 5000, 9000]
+    hist = _hist(durations)
+    value = rollups.hist_percentile(hist, 0.5, 4000, 9000)
+    assert 4000 <= value <= 9000